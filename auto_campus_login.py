@@ -15,18 +15,34 @@ Safety:
 - Avoids writing any credentials to disk unless the GUI config is used.
 """
 import os
+import sys
+import atexit
 import re
 import time
+import random
 import logging
 import argparse
-from urllib.parse import urljoin, urlparse, parse_qs
+import threading
+import socket
+import errno
+import contextlib
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import json
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse, parse_qs, quote
 import hashlib
 import base64
-from typing import Dict, List
+import secrets
+import ipaddress
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import requests
 from bs4 import BeautifulSoup
 
+from campus_config import url_list
+
 # Default probe URLs that commonly trigger captive portals
 DEFAULT_PROBE_URLS = [
     "http://www.douyin.com/",  # Douyin - reliable domestic site
@@ -68,51 +84,681 @@ def setup_logger(verbosity: int):
     )
 
 
-def check_network_status(session: requests.Session, timeout: float = 10.0) -> bool:
+# Portals answering 200 with an HTML/JS redirect put it near the top of the page
+PORTAL_SNIFF_BYTES = 4096
+_META_REFRESH_RE = re.compile(rb"<meta\b[^>]*?http-equiv\s*=\s*[\"']?refresh[^>]*>", re.I)
+_META_URL_RE = re.compile(rb"url\s*=\s*[\"']?([^\"'>\s;]+)", re.I)
+# Only a statement that assigns to or calls location itself; the lookbehinds keep
+# attributes and identifiers such as data-location= or pageLocation = out
+_JS_LOCATION = rb"(?:^|(?<=[\s;{}(),>]))(?<![\w.$-])(?:(?:window|top|self|parent|document)\.)*location"
+_JS_REDIRECT_RE = re.compile(
+    _JS_LOCATION + rb"(?:\.href)?\s*=(?!=)\s*[\"']([^\"']+)[\"']"
+    rb"|" + _JS_LOCATION + rb"\.(?:replace|assign)\(\s*[\"']([^\"']+)[\"']", re.I | re.M)
+
+
+def sniff_portal_redirect(head: bytes, page_url: str) -> Optional[str]:
     """
-    改进的网络状态检测函数
-    使用多个URL进行探测，任意一个成功即认为在线
+    Find a meta-refresh or JavaScript redirect in the first bytes of a probe
+    response. Redirects within the probed site itself are ignored.
     """
-    endpoints = [
-        ("http://www.douyin.com/", 200),  # 抖音
-        ("http://www.oppo.com/", 200),    # OPPO
-        ("http://www.baidu.com/", 200),   # 百度
-    ]
+    target = None
+    m = _META_REFRESH_RE.search(head)
+    if m:
+        u = _META_URL_RE.search(m.group(0))
+        if u:
+            target = u.group(1)
+    if target is None:
+        m = _JS_REDIRECT_RE.search(head)
+        if m:
+            target = m.group(1) or m.group(2)
+    if not target:
+        return None
+    url = urljoin(page_url, target.decode("utf-8", "replace").strip())
+    host = urlparse(url).hostname
+    # same host only: a registrable-domain guess would lump every *.edu.cn together
+    if not host or host == urlparse(page_url).hostname:
+        return None
+    return url
+
+
+def _read_head(resp: requests.Response, limit: int = PORTAL_SNIFF_BYTES) -> bytes:
+    """Read at most ``limit`` decoded bytes of a streamed response."""
+    try:
+        return resp.raw.read(limit, decode_content=True) or b""
+    except Exception:
+        return b""
+
 
-    for url, expect in endpoints:
+class ProbeHealth:
+    """
+    Per-endpoint EWMA latency and failure rate used to order probes.
+
+    Healthy, fast endpoints are tried first. An endpoint that keeps failing
+    while other endpoints answer is quarantined (moved to the back) for a
+    backoff period, so one blocked site no longer delays every check.
+    """
+
+    def __init__(self, alpha: float = 0.3, quarantine_after: int = 3,
+                 quarantine_s: float = 300.0, max_quarantine_s: float = 3600.0):
+        self.alpha = alpha
+        self.quarantine_after = quarantine_after
+        self.quarantine_s = quarantine_s
+        self.max_quarantine_s = max_quarantine_s
+        self._lock = threading.Lock()
+        self._stats: Dict[str, dict] = {}
+        self._last_any_success = 0.0
+
+    def _get(self, url: str) -> dict:
+        st = self._stats.get(url)
+        if st is None:
+            st = self._stats[url] = {"latency": None, "fail_rate": 0.0, "consecutive": 0,
+                                     "until": 0.0, "penalty": self.quarantine_s}
+        return st
+
+    def record(self, url: str, ok: bool, latency_ms: float = None):
+        now = time.monotonic()
+        with self._lock:
+            st = self._get(url)
+            a = self.alpha
+            st["fail_rate"] = (1 - a) * st["fail_rate"] + a * (0.0 if ok else 1.0)
+            if ok:
+                if latency_ms is not None:
+                    st["latency"] = latency_ms if st["latency"] is None else (1 - a) * st["latency"] + a * latency_ms
+                st["consecutive"] = 0
+                if st["until"] and now >= st["until"]:
+                    st["until"] = 0.0
+                    st["penalty"] = self.quarantine_s
+                self._last_any_success = now
+                return
+            st["consecutive"] += 1
+            # only blame the endpoint if others are working right now
+            others_ok = now - self._last_any_success < 120.0
+            if st["consecutive"] >= self.quarantine_after and others_ok and now >= st["until"]:
+                st["until"] = now + st["penalty"]
+                logging.info("[Probe] %s 连续失败 %d 次，隔离 %.0f 秒", url, st["consecutive"], st["penalty"])
+                st["penalty"] = min(self.max_quarantine_s, st["penalty"] * 2)
+
+    def score(self, url: str) -> float:
+        st = self._stats.get(url)
+        if st is None or st["latency"] is None:
+            return 0.0  # unknown endpoints go first so they get measured
+        return st["latency"] * (1.0 + 4.0 * st["fail_rate"])
+
+    def quarantined(self, url: str) -> bool:
+        st = self._stats.get(url)
+        return bool(st) and time.monotonic() < st["until"]
+
+    def order(self, urls: Sequence[str]) -> List[str]:
+        with self._lock:
+            ranked = sorted(enumerate(urls), key=lambda iu: (self.quarantined(iu[1]), self.score(iu[1]), iu[0]))
+        return [u for _, u in ranked]
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {u: {"latency_ms": st["latency"], "fail_rate": round(st["fail_rate"], 3),
+                        "quarantined": self.quarantined(u)} for u, st in self._stats.items()}
+
+
+# Shared by every probe in this process
+PROBE_HEALTH = ProbeHealth()
+
+
+def check_network_status(session: requests.Session, timeout: float = 10.0, urls: Sequence[str] = None,
+                         health: ProbeHealth = None) -> bool:
+    """
+    改进的网络状态检测函数
+    使用多个URL进行探测，任意一个成功即认为在线；按各站点的健康度（延迟/失败率）动态排序
+    """
+    health = health or PROBE_HEALTH
+    for url in health.order(urls or DEFAULT_PROBE_URLS):
         try:
-            r = session.get(url, timeout=timeout, allow_redirects=False, headers=HEADERS)
-            logging.debug("[Probe] %s -> %s in %.0f ms", url, r.status_code, r.elapsed.total_seconds() * 1000)
-            if r.status_code == expect:
+            with session.get(url, timeout=timeout, allow_redirects=False, headers=HEADERS, stream=True) as r:
+                latency_ms = r.elapsed.total_seconds() * 1000
+                logging.debug("[Probe] %s -> %s in %.0f ms", url, r.status_code, latency_ms)
+                # any answer means the endpoint itself is reachable (a portal redirect is not its fault)
+                health.record(url, True, latency_ms)
+                if r.status_code != 200:
+                    continue
+                # portals may answer 200 with a meta/JS redirect: one small read tells them apart
+                portal = sniff_portal_redirect(_read_head(r), url)
+                if portal:
+                    logging.debug("[Probe] %s answered with portal redirect %s", url, portal)
+                    continue
                 return True
         except Exception as e:
             logging.debug("[Probe] %s failed: %s", url, e)
+            health.record(url, False)
             continue
 
     return False
 
 
-def internet_ok(session: requests.Session, timeout: float = 5.0) -> bool:
+def internet_ok(session: requests.Session, timeout: float = 5.0, urls: Sequence[str] = None) -> bool:
     """
     保持向后兼容的函数，使用新的检测逻辑
     """
-    return check_network_status(session, timeout)
+    return check_network_status(session, timeout, urls=urls)
+
+
+# Post-submit verification polls one endpoint with short requests until the
+# portal lets traffic through or the total budget runs out.
+VERIFY_TIMEOUT = 0.8
+VERIFY_POLL_INTERVAL = 0.02
+VERIFY_MAX_POLL_INTERVAL = 0.25
+VERIFY_TOTAL = 3.0
+# budget when the portal's answer already looks like a rejection
+VERIFY_TOTAL_ON_FAILURE = 0.3
+
+
+def verify_online(session: requests.Session, urls: Sequence[str] = None, total: float = VERIFY_TOTAL,
+                  timeout: float = VERIFY_TIMEOUT, poll_interval: float = VERIFY_POLL_INTERVAL,
+                  health: ProbeHealth = None, family: int = None) -> bool:
+    """
+    Confirm a login took effect: every ``poll_interval`` seconds (backing off
+    to VERIFY_MAX_POLL_INTERVAL) go through the probe endpoints, healthiest
+    first, and return as soon as any of them answers 200 without a portal
+    redirect -- the same "online" rule as ``check_network_status`` (an
+    endpoint that always redirects, e.g. http->https, can be the fastest one
+    and must not decide alone). False once ``total`` seconds have passed.
+    Failures here are expected while the portal is still opening the gate, so
+    they are not fed into ``health`` (default PROBE_HEALTH).
+
+    With ``family`` (socket.AF_INET/AF_INET6) the polls are pinned to that
+    address family, so a dual-stack login is confirmed over the family that
+    was behind the portal rather than whichever one the session picks.
+    """
+    ordered = (health or PROBE_HEALTH).order(urls or DEFAULT_PROBE_URLS)
+    deadline = time.monotonic() + total
+    interval = poll_interval
+    polls = 0
+    while True:
+        polls += 1
+        for url in ordered:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if family is not None:
+                if _probe_http_family(url, family, max(0.05, min(timeout, remaining)))["online"]:
+                    logging.debug("[Verify] %s online over family %s after %d poll(s)", url, family, polls)
+                    return True
+                continue
+            try:
+                with session.get(url, timeout=max(0.05, min(timeout, remaining)), allow_redirects=False,
+                                 headers=HEADERS, stream=True) as r:
+                    if r.status_code == 200 and not sniff_portal_redirect(_read_head(r), url):
+                        logging.debug("[Verify] %s online after %d poll(s)", url, polls)
+                        return True
+            except requests.RequestException as e:
+                logging.debug("[Verify] %s poll %d failed: %s", url, polls, e)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.debug("[Verify] still offline after %d poll(s)", polls)
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, VERIFY_MAX_POLL_INTERVAL)
+
+
+class ConnectivityState:
+    """
+    Shared, single-flight connectivity state.
+
+    Concurrent callers join the probe already in flight instead of starting their
+    own, and a result is reused for ``ttl`` seconds. Call ``invalidate`` after a
+    login (or anything else that changes connectivity).
+    """
+
+    def __init__(self, session: requests.Session, ttl: float = 3.0, timeout: float = 10.0,
+                 urls: Sequence[str] = None, health: ProbeHealth = None):
+        self.session = session
+        self.ttl = ttl
+        self.timeout = timeout
+        self.urls = urls
+        self.health = health
+        self._lock = threading.Lock()
+        self._inflight: Optional[threading.Event] = None
+        self._value: Optional[bool] = None
+        self._checked_at = 0.0
+        self._generation = 0
+
+    def check(self, max_age: float = None) -> bool:
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._checked_at <= max_age:
+                return self._value
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+                generation = self._generation
+        if not leader:
+            event.wait()
+            return event.result
+        event.result = False
+        try:
+            value = check_network_status(self.session, self.timeout, urls=self.urls, health=self.health)
+        except Exception:
+            value = False
+        with self._lock:
+            # a concurrent invalidate() means this result may already be stale
+            if generation == self._generation:
+                self._value = value
+                self._checked_at = time.monotonic()
+            self._inflight = None
+        event.result = value
+        event.set()
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+    def set(self, online: bool):
+        """Record a connectivity result learned elsewhere (e.g. a verified login)."""
+        with self._lock:
+            self._value = online
+            self._checked_at = time.monotonic()
+            self._generation += 1
+
+
+# Tier-0 route check targets (AliDNS, IPv4 then IPv6); a UDP connect() only
+# consults the routing table, nothing is sent.
+ROUTE_CHECK_ADDRS = ((socket.AF_INET, ("223.5.5.5", 53)), (socket.AF_INET6, ("2400:3200::1", 53)))
+LIVENESS_TCP_TIMEOUT = 0.5
+# Full HTTP audit every this many watch periods, so a steady-state tick stays a
+# single TCP handshake; logins reset the pipeline and force HTTP anyway
+LIVENESS_AUDIT_PERIODS = 6
+LIVENESS_HTTP_EVERY = 20.0 * LIVENESS_AUDIT_PERIODS
+
+
+class LivenessPipeline:
+    """
+    Tiered connectivity check for watch loops, cheapest first:
+
+      tier 0 (route): is there a route out, from the same local address as before?
+      tier 1 (tcp):   TCP connect to anchor addresses learned while online
+      tier 2 (http):  full HTTP probes (check_network_status)
+
+    A healthy network costs one SYN/ACK round trip per tick. HTTP is used when
+    the route is new, the last known state was not online, no anchor answers,
+    or every ``http_every`` seconds as an audit (a portal can let TCP through
+    while still capturing HTTP). Call ``invalidate`` after a login attempt,
+    whatever its outcome, so the next check is a full HTTP probe. ``snapshot``
+    exposes per-tier decision counts and escalation reasons.
+    """
+
+    def __init__(self, session: requests.Session, urls: Sequence[str] = None, anchors: Sequence[str] = None,
+                 http_every: float = LIVENESS_HTTP_EVERY, tcp_timeout: float = LIVENESS_TCP_TIMEOUT,
+                 http_timeout: float = 10.0):
+        self.session = session
+        self.urls = urls
+        # "host:port"; default: the probe hosts on 443, which portals rarely intercept
+        self.anchors = list(anchors or [])
+        self.http_every = http_every
+        self.tcp_timeout = tcp_timeout
+        self.http_timeout = http_timeout
+        self.counts = Counter()
+        self.escalations = Counter()
+        self.last_tier: Optional[str] = None
+        self._anchor_addrs: List[Tuple[int, tuple]] = []
+        self._local_addr: Optional[str] = None
+        self._online: Optional[bool] = None
+        self._http_ok_at = 0.0
+        self._last_reason: Optional[str] = None
+
+    def _anchor_specs(self) -> List[Tuple[str, int]]:
+        if self.anchors:
+            specs = []
+            for a in self.anchors:
+                host, _, port = a.rpartition(":")
+                specs.append((host.strip("[]"), int(port)) if host else (a, 443))
+            return specs
+        return [(urlparse(u).hostname, 443) for u in (self.urls or DEFAULT_PROBE_URLS) if urlparse(u).hostname]
+
+    def _learn_anchors(self):
+        """Resolve anchors while DNS is known to be honest (right after an HTTP success)."""
+        addrs = []
+        for host, port in self._anchor_specs():
+            try:
+                family, _, _, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+                addrs.append((family, sockaddr))
+            except (OSError, IndexError) as e:
+                logging.debug("[Liveness] 解析锚点 %s 失败: %s", host, e)
+        self._anchor_addrs = addrs
+
+    def _route(self) -> Optional[str]:
+        """Local source address of the default route, or None if there is no route."""
+        for family, target in ROUTE_CHECK_ADDRS:
+            try:
+                with socket.socket(family, socket.SOCK_DGRAM) as s:
+                    s.connect(target)
+                    return s.getsockname()[0]
+            except OSError:
+                continue
+        return None
+
+    def _tcp(self) -> bool:
+        for family, sockaddr in self._anchor_addrs:
+            try:
+                with socket.socket(family, socket.SOCK_STREAM) as s:
+                    s.settimeout(self.tcp_timeout)
+                    s.connect(sockaddr)
+                    return True
+            except OSError as e:
+                logging.debug("[Liveness] 锚点 %s 不可达: %s", sockaddr, e)
+        return False
+
+    def _decide(self, tier: str, online: bool) -> bool:
+        self.counts[tier] += 1
+        self.last_tier = tier
+        logging.debug("[Liveness] tier=%s online=%s", tier, online)
+        return online
+
+    def check(self) -> bool:
+        local = self._route()
+        if local is None:
+            self._online = False
+            return self._decide("route", False)
+
+        if self._online is not True:
+            reason = "not_confirmed_online"
+        elif local != self._local_addr:
+            reason = "local_address_changed"
+        elif not self._anchor_addrs:
+            reason = "no_anchors"
+        elif time.monotonic() - self._http_ok_at >= self.http_every:
+            reason = "periodic_audit"
+        elif not self._tcp():
+            reason = "anchors_unreachable"
+        else:
+            return self._decide("tcp", True)
+
+        self.escalations[reason] += 1
+        if reason != self._last_reason:
+            logging.info("[Liveness] 升级为 HTTP 探测，原因: %s", reason)
+        self._last_reason = reason
+        online = check_network_status(self.session, self.http_timeout, urls=self.urls)
+        if online:
+            self._http_ok_at = time.monotonic()
+            self._local_addr = local
+            self._learn_anchors()
+        self._online = online
+        return self._decide("http", online)
+
+    def invalidate(self):
+        """Forget the confirmed-online state: the next check goes straight to HTTP."""
+        self._online = None
+
+    def snapshot(self) -> dict:
+        return {"last_tier": self.last_tier, "counts": dict(self.counts), "escalations": dict(self.escalations)}
+
+
+# Canary names with the address ranges an honest resolver returns for them
+DNS_CANARIES = (
+    ("dns.alidns.com", ("223.5.5.0/24", "223.6.6.0/24", "2400:3200::/32")),
+    ("one.one.one.one", ("1.1.1.0/24", "1.0.0.0/24", "2606:4700::/32")),
+)
+# Random labels under this IANA-reserved domain must not resolve at all
+DNS_NX_DOMAIN = "example.com"
+DNS_HIJACK_TIMEOUT = 2.0
+# find_captive_portal runs the DNS check alongside the HTTP probes unless disabled
+DNS_HIJACK_CHECK = True
+
+
+def _resolve_all(names: Sequence[str], timeout: float) -> Dict[str, Optional[List[str]]]:
+    """Resolve ``names`` in parallel; None for names that failed or did not answer in time."""
+    answers: Dict[str, Optional[List[str]]] = {}
+
+    def run(name):
+        try:
+            infos = socket.getaddrinfo(name, None, type=socket.SOCK_STREAM)
+            answers[name] = sorted({info[4][0] for info in infos})
+        except OSError:
+            answers[name] = None
+
+    threads = [threading.Thread(target=run, args=(name,), daemon=True) for name in names]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    return {name: answers.get(name) for name in names}
+
+
+def _is_local_address(addr: str) -> bool:
+    ip = ipaddress.ip_address(addr.split("%", 1)[0])
+    return ip.is_private or ip.is_link_local or ip.is_loopback or ip in ipaddress.ip_network("100.64.0.0/10")
+
+
+def detect_dns_hijack(names: Sequence[str] = None, canaries=DNS_CANARIES, timeout: float = DNS_HIJACK_TIMEOUT) -> dict:
+    """
+    Detect a portal that answers every DNS query with its own address.
+
+    Resolves the canary names (whose honest answers are known), a random name
+    that must not exist, and ``names`` (e.g. the probe hosts). The network is
+    considered behind a portal when unrelated names all share one address, or
+    a name that must not exist / a canary outside its range resolves to a
+    private address. Returns ``{"behind_portal": True/False/None (unknown),
+    "portal_address", "reason", "answers"}``.
+    """
+    nx_name = f"nx-{secrets.token_hex(6)}.{DNS_NX_DOMAIN}"
+    expected = {name: [ipaddress.ip_network(n) for n in nets] for name, nets in canaries}
+    all_names = list(dict.fromkeys(list(expected) + list(names or []) + [nx_name]))
+    answers = _resolve_all(all_names, timeout)
+    result = {"behind_portal": None, "portal_address": None, "reason": None, "answers": answers}
+
+    resolved = {n: a for n, a in answers.items() if a}
+    if not resolved:
+        result["reason"] = "no_answers"
+        return result
+
+    suspicious: List[str] = []
+    shared = set.intersection(*(set(a) for a in resolved.values()))
+    if len(resolved) >= 3 and shared:
+        result["reason"] = "single_address"
+        suspicious = sorted(shared)
+    elif answers[nx_name] and any(_is_local_address(a) for a in answers[nx_name]):
+        result["reason"] = "nx_resolves_local"
+        suspicious = answers[nx_name]
+    else:
+        for name, nets in expected.items():
+            wrong = [a for a in resolved.get(name, [])
+                     if not any(ipaddress.ip_address(a.split("%", 1)[0]) in net for net in nets)]
+            if wrong and all(_is_local_address(a) for a in wrong):
+                result["reason"] = "canary_out_of_range"
+                suspicious = wrong
+                break
+
+    if suspicious:
+        # prefer IPv4: portals are reached over it far more often
+        suspicious.sort(key=lambda a: ":" in a)
+        result.update(behind_portal=True, portal_address=suspicious[0])
+    elif any(name in resolved for name in expected):
+        result.update(behind_portal=False, reason="canaries_ok")
+    else:
+        result["reason"] = "canaries_unresolved"
+    return result
 
 
-def find_captive_portal(session: requests.Session, probe_urls=None, timeout: float = 6.0):
+def _portal_url_from_address(addr: str) -> str:
+    return f"http://[{addr}]/" if ":" in addr else f"http://{addr}/"
+
+
+def find_captive_portal(session: requests.Session, probe_urls=None, timeout: float = 6.0, dns_check: bool = None,
+                        health: ProbeHealth = None):
+    """
+    Probe ``probe_urls`` for a portal redirect. Unless ``dns_check`` is False
+    (default: ``DNS_HIJACK_CHECK``), DNS hijack detection runs in parallel and
+    supplies the portal address when the HTTP probes only time out.
+    """
     probe_urls = probe_urls or DEFAULT_PROBE_URLS
-    for url in probe_urls:
+    health = health or PROBE_HEALTH
+    dns_future: Optional[Future] = None
+    if DNS_HIJACK_CHECK if dns_check is None else dns_check:
+        dns_future = Future()
+        hosts = [urlparse(u).hostname for u in probe_urls if urlparse(u).hostname]
+
+        def run_dns():
+            try:
+                dns_future.set_result(detect_dns_hijack(hosts))
+            except Exception as e:
+                dns_future.set_exception(e)
+
+        threading.Thread(target=run_dns, name="dns-hijack", daemon=True).start()
+
+    def dns_portal(wait: float) -> Optional[str]:
+        if dns_future is None:
+            return None
+        try:
+            r = dns_future.result(wait)
+        except Exception as e:
+            logging.debug("[DNS] 劫持检测未完成: %r", e)
+            return None
+        logging.debug("[DNS] behind_portal=%s reason=%s answers=%s", r["behind_portal"], r["reason"], r["answers"])
+        if not r["behind_portal"]:
+            return None
+        url = _portal_url_from_address(r["portal_address"])
+        logging.info("DNS 被认证网关劫持（%s），推断认证地址: %s", r["reason"], url)
+        return url
+
+    for url in health.order(probe_urls):
         try:
-            resp = session.get(url, timeout=timeout, allow_redirects=False, headers=HEADERS)
-            logging.info("Probe %s -> %s", url, resp.status_code)
-            if resp.is_redirect or resp.status_code in (301, 302, 303, 307, 308):
-                location = resp.headers.get("Location") or resp.headers.get("location")
-                if location:
-                    logging.info("Captured captive portal redirect: %s", location)
-                    return location
+            with session.get(url, timeout=timeout, allow_redirects=False, headers=HEADERS, stream=True) as resp:
+                health.record(url, True, resp.elapsed.total_seconds() * 1000)
+                logging.info("Probe %s -> %s", url, resp.status_code)
+                if resp.is_redirect or resp.status_code in (301, 302, 303, 307, 308):
+                    location = resp.headers.get("Location") or resp.headers.get("location")
+                    if location:
+                        logging.info("Captured captive portal redirect: %s", location)
+                        return location
+                elif resp.status_code == 200:
+                    location = sniff_portal_redirect(_read_head(resp), url)
+                    if location:
+                        logging.info("Captured captive portal meta/JS redirect: %s", location)
+                        return location
         except requests.RequestException as e:
+            health.record(url, False)
             logging.debug("Probe %s failed: %s", url, e)
-    return None
+            # no need to wait for the remaining probes to time out as well
+            if dns_future is not None and dns_future.done():
+                portal = dns_portal(0)
+                if portal:
+                    return portal
+    return dns_portal(DNS_HIJACK_TIMEOUT)
+
+
+# Happy Eyeballs (RFC 8305) head start given to IPv6 before IPv4 is attempted
+HAPPY_EYEBALLS_DELAY = 0.25
+ADDRESS_FAMILIES = (("ipv6", socket.AF_INET6), ("ipv4", socket.AF_INET))
+# connect errors meaning the family itself is unusable here, not that one server is down
+_NO_ROUTE_ERRNOS = {errno.ENETUNREACH, errno.EHOSTUNREACH, errno.EADDRNOTAVAIL, errno.EAFNOSUPPORT}
+
+
+def _probe_http_family(url: str, family: int, timeout: float, delay: float = 0.0) -> dict:
+    """
+    Plain-HTTP probe of ``url`` pinned to one address family (one small read).
+    ``final`` is set when the answer holds for the whole family: an HTTP
+    response, or no address / no route, which the next URL will not change.
+    """
+    result = {"online": False, "portal": None, "latency_ms": None, "address": None, "error": None,
+              "final": False}
+    if delay:
+        time.sleep(delay)
+    parsed = urlparse(url)
+    host, port = parsed.hostname, parsed.port or 80
+    try:
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    except OSError as e:
+        result["error"] = f"no address: {e}"
+        result["final"] = True
+        return result
+    addr = infos[0][4]
+    result["address"] = addr[0]
+    t0 = time.perf_counter()
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(addr)
+            path = parsed.path or "/"
+            if parsed.query:
+                path += "?" + parsed.query
+            req = (f"GET {path} HTTP/1.1\r\nHost: {parsed.netloc}\r\nUser-Agent: {HEADERS['User-Agent']}\r\n"
+                   "Accept: */*\r\nConnection: close\r\n\r\n")
+            sock.sendall(req.encode("ascii", "ignore"))
+            buf = b""
+            while len(buf) < PORTAL_SNIFF_BYTES:
+                chunk = sock.recv(PORTAL_SNIFF_BYTES - len(buf))
+                if not chunk:
+                    break
+                buf += chunk
+                if b"\r\n\r\n" in buf and not buf.startswith(b"HTTP/1.1 200") and not buf.startswith(b"HTTP/1.0 200"):
+                    break  # redirects only need the headers
+    except OSError as e:
+        result["error"] = str(e)
+        result["final"] = e.errno in _NO_ROUTE_ERRNOS
+        return result
+    result["latency_ms"] = (time.perf_counter() - t0) * 1000.0
+    head, _, body = buf.partition(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        result["error"] = "bad response"
+        return result
+    result["final"] = True
+    if 300 <= status < 400:
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"location":
+                result["portal"] = urljoin(url, value.strip().decode("utf-8", "replace"))
+                break
+    elif status in (200, 204):
+        result["portal"] = sniff_portal_redirect(body, url) if status == 200 else None
+        result["online"] = result["portal"] is None
+    return result
+
+
+def probe_dual_stack(url: str, timeout: float = 3.0) -> Dict[str, dict]:
+    """
+    Race IPv6 and IPv4 probes of ``url`` Happy Eyeballs style (IPv6 gets a short
+    head start) and report each family separately, so a broken family only
+    costs its own timeout, in parallel with the healthy one.
+    """
+    results: Dict[str, dict] = {}
+
+    def run(name, family, delay):
+        results[name] = _probe_http_family(url, family, timeout, delay)
+
+    threads = [threading.Thread(target=run, args=(name, fam, HAPPY_EYEBALLS_DELAY if name == "ipv4" else 0.0),
+                                daemon=True)
+               for name, fam in ADDRESS_FAMILIES]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout * 2 + HAPPY_EYEBALLS_DELAY)
+    for name, _ in ADDRESS_FAMILIES:
+        results.setdefault(name, {"online": False, "portal": None, "latency_ms": None,
+                                  "address": None, "error": "timeout", "final": False})
+        r = results[name]
+        logging.debug("[DualStack] %s %s (%s) -> online=%s portal=%s %s", url, name, r["address"],
+                      r["online"], r["portal"], r["error"] or "")
+    return results
+
+
+def dual_stack_status(urls: Sequence[str] = None, timeout: float = 3.0) -> Dict[str, dict]:
+    """
+    Per-family connectivity across the probe list; stops once every family has
+    a final answer (an HTTP response, or no address / no route for it).
+    """
+    merged: Dict[str, dict] = {}
+    for url in PROBE_HEALTH.order(urls or DEFAULT_PROBE_URLS):
+        for name, r in probe_dual_stack(url, timeout).items():
+            prev = merged.get(name)
+            if prev is None or (prev["error"] and not r["error"]):
+                merged[name] = r
+        if all(r["final"] for r in merged.values()):
+            break
+    return merged
 
 
 def pick_login_form(soup: BeautifulSoup):
@@ -145,12 +791,13 @@ def extract_form_data(form):
         if selected and selected.get("value") is not None:
             data[name] = selected.get("value")
 
-    # Keep a pretty-printed snapshot for debugging
-    try:
-        snippet = str(form)[:1000]
-        logging.debug("Form HTML snippet: %s", snippet)
-    except Exception:
-        pass
+    # Keep a pretty-printed snapshot for debugging (serialising the form is not free)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        try:
+            snippet = str(form)[:1000]
+            logging.debug("Form HTML snippet: %s", snippet)
+        except Exception:
+            pass
 
     return action, method, data
 
@@ -193,13 +840,601 @@ def merge_query_params_into_data(url: str, data: dict):
         pass
 
 
+class PasswordDigests:
+    """Per-login memo of password digests so each hash is computed only once."""
+
+    __slots__ = ("password", "_md5")
+
+    def __init__(self, password: str):
+        self.password = password
+        self._md5: Dict[str, str] = {}
+
+    def md5(self, text: str = None) -> str:
+        text = self.password if text is None else text
+        h = self._md5.get(text)
+        if h is None:
+            h = hashlib.md5(text.encode("utf-8")).hexdigest()
+            self._md5[text] = h
+        return h
+
+
+# Encoder signature: (digests, form_data) -> encoded password, or None when the
+# encoder does not apply (e.g. the challenge token it needs is missing).
+PasswordEncoder = Callable[[PasswordDigests, Dict[str, str]], Optional[str]]
+
+# name -> (encoder, tried by default)
+PASSWORD_ENCODERS: Dict[str, Tuple[PasswordEncoder, bool]] = {}
+
+
+def register_password_encoder(name: str, default: bool = True):
+    """Decorator registering a password encoder; order of registration is try order."""
+    def deco(func: PasswordEncoder) -> PasswordEncoder:
+        PASSWORD_ENCODERS[name] = (func, default)
+        return func
+    return deco
+
+
+@register_password_encoder("plain")
+def _enc_plain(dg, form):
+    return dg.password
+
+
+@register_password_encoder("md5")
+def _enc_md5(dg, form):
+    return dg.md5()
+
+
+@register_password_encoder("b64")
+def _enc_b64(dg, form):
+    return base64.b64encode(dg.password.encode("utf-8")).decode("ascii")
+
+
+@register_password_encoder("md5_pwd_echostr")
+def _enc_md5_pwd_echostr(dg, form):
+    echostr = str(form.get("echostr") or "")
+    return dg.md5(dg.password + echostr) if echostr else None
+
+
+@register_password_encoder("md5_md5pwd_echostr")
+def _enc_md5_md5pwd_echostr(dg, form):
+    echostr = str(form.get("echostr") or "")
+    return dg.md5(dg.md5() + echostr) if echostr else None
+
+
+@register_password_encoder("md5_pwd_distoken")
+def _enc_md5_pwd_distoken(dg, form):
+    distoken = str(form.get("distoken") or "")
+    return dg.md5(dg.password + distoken) if distoken else None
+
+
+@register_password_encoder("md5_upper")
+def _enc_md5_upper(dg, form):
+    return dg.md5().upper()
+
+
+# Not tried by default; select explicitly via ``encoders=[...]``
+@register_password_encoder("sha1", default=False)
+def _enc_sha1(dg, form):
+    return hashlib.sha1(dg.password.encode("utf-8")).hexdigest()
+
+
+def plan_login_attempts(data: dict, pass_field: str, password: str,
+                        encoders: Sequence[str] = None) -> Iterator[Tuple[str, dict]]:
+    """
+    Lazily yield ``(mode, payload)`` attempts: loginType variants x password encoders.
+    Payloads and digests are only built when the caller asks for the next attempt.
+    """
+    if encoders is None:
+        selected = [(n, f) for n, (f, default) in PASSWORD_ENCODERS.items() if default]
+    else:
+        selected = [(n, PASSWORD_ENCODERS[n][0]) for n in encoders if n in PASSWORD_ENCODERS]
+    digests = PasswordDigests(password)
+    missing = object()
+    seen_types = set()
+    for lt in (data.get("loginType"), "1", "0", ""):
+        # bases only differ by loginType, so dedup on its effective value
+        effective = data.get("loginType", missing) if lt is None else lt
+        if effective in seen_types:
+            continue
+        seen_types.add(effective)
+        for name, encode in selected:
+            try:
+                encoded = encode(digests, data)
+            except Exception as e:
+                logging.debug("Encoder %s failed: %s", name, e)
+                continue
+            if encoded is None:
+                continue
+            payload = data.copy()
+            if lt is not None:
+                payload["loginType"] = lt
+            payload[pass_field] = encoded
+            yield name, payload
+
+
+# Background writer set by enable_debug_capture(); None keeps captures off
+DEBUG_CAPTURE = None
+
+
+def enable_debug_capture(directory: str = None, **kwargs):
+    """Start capturing portal responses (redacted, gzipped, rotated) to ``directory``."""
+    global DEBUG_CAPTURE
+    import debug_capture
+    if DEBUG_CAPTURE is None:
+        DEBUG_CAPTURE = debug_capture.DebugCapture(directory, redact=redact_payload, **kwargs)
+        # flush the last archive on normal exit / Ctrl-C
+        atexit.register(disable_debug_capture)
+        logging.info("Debug capture enabled: %s", DEBUG_CAPTURE.directory)
+    return DEBUG_CAPTURE
+
+
+def disable_debug_capture():
+    global DEBUG_CAPTURE
+    capture, DEBUG_CAPTURE = DEBUG_CAPTURE, None
+    if capture:
+        capture.close()
+
+
+# Phase profiler set by enable_profiling(); None keeps profile_section() a shared no-op
+PROFILER = None
+_NO_PROFILE = contextlib.nullcontext()
+
+
+def enable_profiling(path: str = None, cpu: bool = True, alloc: bool = False):
+    """Profile the probe/discover/login phases; the report is written at exit."""
+    global PROFILER
+    import phase_profiler
+    if PROFILER is None:
+        PROFILER = phase_profiler.PhaseProfiler(path, cpu=cpu, alloc=alloc)
+        atexit.register(write_profile_report)
+        logging.info("Profiling enabled (cpu=%s, alloc=%s), report: %s", cpu, alloc, PROFILER.path)
+    return PROFILER
+
+
+def write_profile_report() -> Optional[str]:
+    if PROFILER is None:
+        return None
+    try:
+        path = PROFILER.write_report()
+    except OSError as e:
+        logging.warning("[Profile] 写入性能报告失败: %s", e)
+        return None
+    logging.info("性能报告已写入: %s", path)
+    return path
+
+
+def profile_section(name: str):
+    """Context manager timing/profiling one phase (``probe``, ``discover``, ``login``)."""
+    return PROFILER.section(name) if PROFILER is not None else _NO_PROFILE
+
+
+def use_cassette(session: requests.Session, path: str, mode: str, realtime: bool = False):
+    """Record this session's HTTP traffic to, or replay it from, a cassette file."""
+    import http_cassette
+    cassette = http_cassette.Cassette(path, mode, redact=redact_payload, realtime=realtime)
+    cassette.mount(session)
+    if mode == "record":
+        atexit.register(cassette.save)
+    logging.info("Cassette %s mode: %s", mode, path)
+    return cassette
+
+
 def _save_debug_response(resp, suffix: str = ""):
-    """Save response HTML and brief meta to local files for debugging (disabled by default)."""
-    # Disabled to avoid cluttering workspace; re-enable if troubleshooting is needed
-    pass
+    """Queue the response for the debug capture writer (no-op unless enabled)."""
+    capture = DEBUG_CAPTURE
+    if capture is not None:
+        capture.capture(resp, suffix.lstrip("_"))
+
+
+# Only the head of the portal page is inspected when fingerprinting vendors
+FINGERPRINT_BYTES = 4096
+
+
+class PortalThrottled(Exception):
+    """A driver's request was answered 429/503; carries the response for its Retry-After."""
+
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _raise_if_throttled(resp: requests.Response):
+    if resp.status_code in THROTTLE_STATUSES:
+        raise PortalThrottled(resp)
+
+
+class PortalDriver:
+    """
+    Vendor-specific login driver. ``login`` returns True when the portal accepted
+    the credentials, False when it rejected them, or None if this driver cannot
+    handle the page (the generic form path is then used). A 429/503 answer is
+    reported with ``_raise_if_throttled`` so the caller can honour Retry-After.
+    """
+    name = "base"
+    url_patterns: Tuple["re.Pattern", ...] = ()
+    body_patterns: Tuple["re.Pattern", ...] = ()
+
+    def matches(self, url: str, head: str = "") -> bool:
+        if any(p.search(url) for p in self.url_patterns):
+            return True
+        return bool(head) and any(p.search(head) for p in self.body_patterns)
+
+    def login(self, session: requests.Session, portal_url: str, username: str, password: str,
+              extra_params: Dict[str, str] = None, timeout: float = 8.0) -> Optional[bool]:
+        raise NotImplementedError
+
+    def keepalive_url(self, portal_url: str) -> Optional[str]:
+        """Cheap authenticated endpoint that refreshes the portal's idle timer."""
+        return None
+
 
+PORTAL_DRIVERS: List[PortalDriver] = []
 
-def try_direct_submit_without_form(session: requests.Session, page_url: str, username: str, password: str, timeout: float = 8.0):
+
+def register_portal_driver(cls):
+    """Class decorator adding a driver instance to the fingerprint registry."""
+    PORTAL_DRIVERS.append(cls())
+    return cls
+
+
+def get_portal_driver(name: str) -> Optional[PortalDriver]:
+    for drv in PORTAL_DRIVERS:
+        if drv.name == name:
+            return drv
+    return None
+
+
+def portal_driver_names() -> List[str]:
+    """Valid ``driver`` arguments: auto, generic and every registered driver."""
+    return ["auto", "generic"] + [drv.name for drv in PORTAL_DRIVERS]
+
+
+def detect_portal_driver(url: str, head: str = "") -> Optional[PortalDriver]:
+    for drv in PORTAL_DRIVERS:
+        if drv.matches(url, head):
+            logging.info("Portal fingerprint matched driver: %s", drv.name)
+            return drv
+    return None
+
+
+def _origin(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+@register_portal_driver
+class RuijieEportalDriver(PortalDriver):
+    """Ruijie ePortal: one POST to InterFace.do carrying the redirect query string."""
+    name = "ruijie"
+    url_patterns = (re.compile(r"/eportal/index\.jsp\?", re.I),)
+    body_patterns = (re.compile(r"eportal/InterFace\.do", re.I),)
+
+    def login(self, session, portal_url, username, password, extra_params=None, timeout=8.0):
+        query = urlparse(portal_url).query
+        if not query:
+            return None
+        api = _origin(portal_url) + "/eportal/InterFace.do?method=login"
+        data = {
+            "userId": username,
+            "password": password,
+            "service": "",
+            "queryString": quote(query),
+            "operatorPwd": "",
+            "operatorUserId": "",
+            "validcode": "",
+            "passwordEncrypt": "false",
+        }
+        if extra_params:
+            data.update(extra_params)
+        headers = HEADERS.copy()
+        headers["Referer"] = portal_url
+        resp = session.post(api, data=data, timeout=timeout, headers=headers)
+        _save_debug_response(resp, suffix="_driver_ruijie")
+        _raise_if_throttled(resp)
+        try:
+            result = resp.json()
+        except ValueError:
+            return None
+        if not isinstance(result, dict):
+            # e.g. a bare string or list from a proxy/error page: not the InterFace.do API
+            return None
+        if str(result.get("result", "")).lower() == "success":
+            return True
+        logging.warning("Ruijie portal rejected login: %s", result.get("message"))
+        return False
+
+    def keepalive_url(self, portal_url):
+        return _origin(portal_url) + "/eportal/InterFace.do?method=getOnlineUserInfo"
+
+
+@register_portal_driver
+class DrcomEportalDriver(PortalDriver):
+    """Dr.COM ePortal (port 801 JSONP API); classic DDDDD/upass pages use the form path."""
+    name = "drcom"
+    url_patterns = (re.compile(r":801/eportal/", re.I),)
+    body_patterns = (re.compile(r"/eportal/portal/login|dr1003", re.I),)
+    _result_re = re.compile(r'"result"\s*:\s*"?(\d+)')
+    _msg_re = re.compile(r'"msg"\s*:\s*"([^"]*)"')
+
+    def login(self, session, portal_url, username, password, extra_params=None, timeout=8.0):
+        parsed = urlparse(portal_url)
+        if not parsed.hostname:
+            return None
+        api = f"{parsed.scheme}://{parsed.hostname}:801/eportal/portal/login"
+        params = {
+            "callback": "dr1003",
+            "login_method": "1",
+            "user_account": f",0,{username}",
+            "user_password": password,
+        }
+        # wlan_user_ip and friends ride along in the redirect query
+        merge_query_params_into_data(portal_url, params)
+        if extra_params:
+            params.update(extra_params)
+        headers = HEADERS.copy()
+        headers["Referer"] = portal_url
+        resp = session.get(api, params=params, timeout=timeout, headers=headers)
+        _save_debug_response(resp, suffix="_driver_drcom")
+        _raise_if_throttled(resp)
+        m = self._result_re.search(resp.text)
+        if not m:
+            return None
+        if m.group(1) == "1":
+            return True
+        msg = self._msg_re.search(resp.text)
+        logging.warning("Dr.COM portal rejected login: %s", msg.group(1) if msg else resp.text[:200])
+        return False
+
+
+def _login_with_driver(driver: PortalDriver, session: requests.Session, portal_url: str, username: str,
+                       password: str, extra_params: Dict[str, str] = None, timeout: float = 8.0,
+                       verify_urls: Sequence[str] = None, health: ProbeHealth = None,
+                       verify_family: int = None, stats: dict = None) -> Optional[bool]:
+    """
+    Run a vendor driver; None means fall back to the generic form path. A
+    throttled portal counts as a failure, with Retry-After noted in ``stats``.
+    """
+    logging.info("Logging in via %s driver: %s", driver.name, portal_url)
+    try:
+        accepted = driver.login(session, portal_url, username, password, extra_params=extra_params, timeout=timeout)
+    except PortalThrottled as e:
+        _note_throttle(e.response, {} if stats is None else stats)
+        return False
+    except requests.RequestException as e:
+        logging.warning("Driver %s request failed: %s", driver.name, e)
+        return None
+    if accepted is None:
+        logging.debug("Driver %s could not handle portal, falling back", driver.name)
+        return None
+    if not accepted:
+        return False
+    if verify_online(session, verify_urls, health=health, family=verify_family):
+        logging.info("Login successful via %s driver", driver.name)
+        return True
+    logging.warning("Driver %s reported success but network is still down, falling back", driver.name)
+    return None
+
+
+class PortalKeepalive:
+    """
+    Remembers the portal that logged us in and touches it before the idle timeout.
+
+    The interval is learned: every time the portal logs us out it shrinks (the
+    portal evidently dropped us sooner), and a long run of healthy pings lets it
+    grow back slowly. Outages without a portal behind them (upstream down, no
+    route) say nothing about the idle timeout and must not be recorded.
+    """
+
+    def __init__(self, session: requests.Session, interval: float = 120.0,
+                 min_interval: float = 15.0, max_interval: float = 900.0, timeout: float = 3.0):
+        self.session = session
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.url: Optional[str] = None
+        self.last_activity = 0.0
+        self._healthy_pings = 0
+
+    def remember(self, portal_url: str):
+        drv = detect_portal_driver(portal_url)
+        self.url = (drv.keepalive_url(portal_url) if drv else None) or (_origin(portal_url) + "/")
+        self.last_activity = time.monotonic()
+        logging.info("[Keepalive] 会话保活地址 %s，间隔 %.0f 秒", self.url, self.interval)
+
+    def seconds_until_due(self) -> float:
+        if not self.url:
+            return float("inf")
+        return max(0.0, self.last_activity + self.interval - time.monotonic())
+
+    def ping(self) -> bool:
+        if not self.url:
+            return False
+        try:
+            r = self.session.get(self.url, timeout=self.timeout, headers=HEADERS, allow_redirects=False)
+            ok = r.status_code < 400
+        except requests.RequestException as e:
+            logging.debug("[Keepalive] %s failed: %s", self.url, e)
+            ok = False
+        self.last_activity = time.monotonic()
+        if ok:
+            self._healthy_pings += 1
+            # grow back by a quarter after a sustained healthy run
+            if self._healthy_pings >= 10 and self.interval < self.max_interval:
+                self.interval = min(self.max_interval, self.interval * 1.25)
+                self._healthy_pings = 0
+        logging.debug("[Keepalive] ping %s -> %s (interval %.0fs)", self.url, ok, self.interval)
+        return ok
+
+    def record_drop(self):
+        """Called when the portal logged us out despite keepalive: tighten the schedule."""
+        if not self.url:
+            return
+        self.interval = max(self.min_interval, self.interval / 2)
+        self._healthy_pings = 0
+        logging.info("[Keepalive] 会话被断开，保活间隔缩短为 %.0f 秒", self.interval)
+
+    def tick(self) -> float:
+        """Ping if due; return how long the caller may sleep before the next ping."""
+        if self.seconds_until_due() <= 0:
+            self.ping()
+        return self.seconds_until_due()
+
+
+# Remaining-time patterns seen on common portal status pages; group 1 is the duration
+DEFAULT_EXPIRY_PATTERNS = [
+    r"剩余(?:时长|时间|在线时长)\s*[:：]?\s*([0-9:天小时分钟秒\s]+)",
+    r"(?:强制)?下线时间\s*[:：]?\s*(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?)",
+    r"remain(?:ing)?[_ ]?(?:time|seconds)\W{0,3}\s*([0-9:]+)",
+]
+DEFAULT_EXPIRY_JSON_PATHS = [
+    "remain_seconds", "remainTime", "leftTime", "sessionTimeout",
+    "data.remain_seconds", "data.remainTime", "data.leftTime",
+]
+
+_UNIT_SECONDS = {"天": 86400, "d": 86400, "day": 86400, "days": 86400,
+                 "小时": 3600, "时": 3600, "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+                 "分钟": 60, "分": 60, "m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+                 "秒": 1, "s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+                 "毫秒": 0.001, "ms": 0.001}
+# A Latin unit must be a whole word ("5 ms" is milliseconds, not 5 minutes followed by "s")
+_DURATION_UNITS = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(毫秒|天|小时|时|分钟|分|秒|(?:"
+    + "|".join(sorted((u for u in _UNIT_SECONDS if u.isascii()), key=len, reverse=True))
+    + r")(?![a-z]))", re.I)
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """
+    Parse a remaining-time value into seconds: plain seconds, epoch timestamps,
+    ``HH:MM:SS``, ``1天2小时3分`` style durations or an absolute ``YYYY-MM-DD HH:MM`` deadline.
+    """
+    text = str(text).strip()
+    if not text:
+        return None
+    try:
+        num = float(text)
+    except ValueError:
+        num = None
+    if num is not None:
+        if num > 1e12:  # epoch milliseconds
+            return num / 1000.0 - time.time()
+        if num > 1e9:  # epoch seconds
+            return num - time.time()
+        return num
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M"):
+        try:
+            return datetime.strptime(text, fmt).timestamp() - time.time()
+        except ValueError:
+            pass
+    if re.fullmatch(r"\d+(?::\d{1,2}){1,2}", text):
+        total = 0
+        for part in text.split(":"):
+            total = total * 60 + int(part)
+        return float(total)
+    units = _DURATION_UNITS.findall(text)
+    if units:
+        return float(sum(float(v) * _UNIT_SECONDS[u.lower() if u.isascii() else u] for v, u in units))
+    return None
+
+
+def _json_path(obj, path: str):
+    for key in path.split("."):
+        if isinstance(obj, dict) and key in obj:
+            obj = obj[key]
+        else:
+            return None
+    return obj
+
+
+def extract_session_remaining(text: str, patterns: Sequence[str] = None,
+                              json_paths: Sequence[str] = None) -> Optional[float]:
+    """Return the seconds left in the portal session described by ``text``, if found."""
+    json_paths = DEFAULT_EXPIRY_JSON_PATHS if json_paths is None else json_paths
+    body = text.strip()
+    # tolerate JSONP wrappers such as dr1003({...})
+    m = re.match(r"^[\w$.]+\((.*)\)\s*;?$", body, re.S)
+    if m:
+        body = m.group(1)
+    if body.startswith("{"):
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            obj = None
+        for path in json_paths:
+            value = _json_path(obj, path)
+            if value not in (None, ""):
+                secs = parse_duration(value)
+                if secs is not None:
+                    return secs
+    for pat in (DEFAULT_EXPIRY_PATTERNS if patterns is None else patterns):
+        m = re.search(pat, text, re.I)
+        if m:
+            secs = parse_duration(m.group(1))
+            if secs is not None:
+                return secs
+    return None
+
+
+class SessionExpiry:
+    """
+    Tracks the portal session deadline so the watcher can renew the login a few
+    seconds before the portal forces us offline.
+    """
+
+    def __init__(self, session: requests.Session, status_url: str = None, patterns: Sequence[str] = None,
+                 json_paths: Sequence[str] = None, renew_before: float = 10.0, timeout: float = 5.0):
+        self.session = session
+        self.status_url = status_url
+        self.patterns = patterns or None
+        self.json_paths = json_paths or None
+        self.renew_before = renew_before
+        self.timeout = timeout
+        self.deadline: Optional[float] = None  # time.monotonic() based
+
+    def refresh(self, portal_url: str) -> Optional[float]:
+        """Fetch the status page after a login and learn the remaining session time."""
+        url = self.status_url or (_origin(portal_url) + "/")
+        self.deadline = None
+        try:
+            r = self.session.get(url, timeout=self.timeout, headers=HEADERS)
+        except requests.RequestException as e:
+            logging.debug("[Expiry] status page %s failed: %s", url, e)
+            return None
+        remaining = extract_session_remaining(r.text, self.patterns, self.json_paths)
+        if remaining is not None and remaining > self.renew_before:
+            self.deadline = time.monotonic() + remaining
+            logging.info("[Expiry] 会话剩余 %.0f 秒，将提前 %.0f 秒续期", remaining, self.renew_before)
+        elif remaining is not None and remaining > 0:
+            # already inside the renewal window: renewing now would only repeat itself
+            logging.info("[Expiry] 会话剩余 %.0f 秒，不足以提前续期", remaining)
+        return remaining
+
+    def renewed(self, portal_url: str) -> bool:
+        """
+        Re-learn the deadline after a renewal login. True only if it moved
+        forward; a fixed deadline (e.g. a nightly forced logout) that a login
+        does not extend is dropped, so the renewal is not repeated.
+        """
+        previous = self.deadline
+        self.refresh(portal_url)
+        if self.deadline is not None and (previous is None or self.deadline > previous + 1.0):
+            return True
+        if self.deadline is not None:
+            logging.info("[Expiry] 续期后会话到期时间未延后，停止提前续期")
+        self.deadline = None
+        return False
+
+    def seconds_until_renewal(self) -> float:
+        if self.deadline is None:
+            return float("inf")
+        return max(0.0, self.deadline - self.renew_before - time.monotonic())
+
+    def renewal_due(self) -> bool:
+        return self.deadline is not None and self.seconds_until_renewal() <= 0
+
+
+def try_direct_submit_without_form(session: requests.Session, page_url: str, username: str, password: str, timeout: float = 8.0, verify_urls: Sequence[str] = None, health: ProbeHealth = None, verify_family: int = None):
     # Common fallback pairs
     candidates = [
         ("username", "password"),
@@ -217,45 +1452,276 @@ def try_direct_submit_without_form(session: requests.Session, page_url: str, use
             logging.info("Fallback submit with fields (%s, %s) to %s", uf, pf, page_url)
             resp = session.post(page_url, data=data, timeout=timeout, headers=headers, allow_redirects=True)
             _save_debug_response(resp, suffix=f"_fallback_{uf}_{pf}")
-            if internet_ok(session):
-                logging.info("Login successful via fallback (%s, %s)", uf, pf)
-                return True
             text_low = resp.text.lower()
             failure_keywords = ["error", "failed", "密码", "错误", "失败", "invalid", "认证失败", "请重试"]
-            if any(k in text_low for k in failure_keywords):
-                continue
-            time.sleep(1.0)
-            if internet_ok(session):
+            rejected = any(k in text_low for k in failure_keywords)
+            if verify_online(session, verify_urls, total=VERIFY_TOTAL_ON_FAILURE if rejected else VERIFY_TOTAL,
+                             health=health, family=verify_family):
+                logging.info("Login successful via fallback (%s, %s)", uf, pf)
                 return True
         except requests.RequestException:
             continue
     return False
 
 
-def perform_login(session: requests.Session, login_url: str, username: str, password: str, user_field_override: str = None, pass_field_override: str = None, extra_params: Dict[str, str] = None, timeout: float = 8.0) -> bool:
+class PortalPageCache:
+    """
+    Conditional-GET validators per login URL plus parsed forms keyed by content hash.
+
+    A portal that sends ``ETag``/``Last-Modified`` answers repeat fetches with a
+    304 and the remembered body is reused; an unchanged body (same hash) skips
+    the BeautifulSoup parse and field guessing entirely.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[str, dict]" = OrderedDict()
+        self._forms: "OrderedDict[str, Optional[tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, table: OrderedDict, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        with self._lock:
+            entry = self._pages.get(url)
+        if not entry:
+            return {}
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def page_text(self, url: str, resp: requests.Response) -> Optional[str]:
+        """Body for ``resp``: the cached one on 304, None if a 304 cannot be served from cache."""
+        with self._lock:
+            entry = self._pages.get(url)
+            if resp.status_code == 304:
+                # the redirect chain must end where it did when the body was cached
+                if entry and entry["final_url"] == resp.url:
+                    self._pages.move_to_end(url)
+                    return entry["text"]
+                self._pages.pop(url, None)
+                return None
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            # never keep a throttling/error page as the portal page
+            if resp.status_code == 200 and (etag or last_modified):
+                self._remember(self._pages, url, {"etag": etag, "last_modified": last_modified,
+                                                  "final_url": resp.url, "text": resp.text})
+            else:
+                self._pages.pop(url, None)
+        return resp.text
+
+    def parse(self, text: str) -> Tuple[Optional[tuple], bool]:
+        """
+        ``((action, method, data, user_field, pass_field), cache_hit)``; the form
+        is None when the page has none. ``data`` is a fresh copy on every call.
+        """
+        digest = hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+        with self._lock:
+            hit = digest in self._forms
+            if hit:
+                self._forms.move_to_end(digest)
+                parsed = self._forms[digest]
+        if not hit:
+            form = pick_login_form(BeautifulSoup(text, "html.parser"))
+            parsed = None
+            if form:
+                action, method, data = extract_form_data(form)
+                names = list(data.keys())
+                parsed = (action, method, data, guess_field_name(COMMON_USER_FIELDS, names),
+                          guess_field_name(COMMON_PASS_FIELDS, names))
+            with self._lock:
+                self._remember(self._forms, digest, parsed)
+        if parsed is None:
+            return None, hit
+        action, method, data, user_field, pass_field = parsed
+        return (action, method, dict(data), user_field, pass_field), hit
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._forms.clear()
+
+
+PORTAL_PAGE_CACHE = PortalPageCache()
+
+
+def _add_phase(stats: dict, phase: str, t0: float):
+    """Accumulate the elapsed milliseconds since ``t0`` into ``stats['phases'][phase]``."""
+    phases = stats["phases"]
+    phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - t0) * 1000.0
+
+
+# Statuses a portal uses to say "too many logins right now"
+THROTTLE_STATUSES = (429, 503)
+# Fraction by which fixed watch cadences are randomized, so machines that lost
+# the network together do not keep probing in lockstep
+WATCH_JITTER = 0.1
+# Default upper bound of the random delay before a watcher's first login attempt
+LOGIN_SPLAY = 5.0
+LOGIN_BACKOFF_CAP = 300.0
+
+
+def jittered(seconds: float, spread: float = WATCH_JITTER) -> float:
+    """``seconds`` randomized by +/- ``spread`` (a fraction)."""
+    return seconds * random.uniform(1.0 - spread, 1.0 + spread) if seconds > 0 and spread > 0 else seconds
+
+
+def parse_retry_after(resp: requests.Response) -> Optional[float]:
+    """Seconds the portal asked us to wait (429/503 + Retry-After), or None."""
+    if resp is None or resp.status_code not in THROTTLE_STATUSES:
+        return None
+    value = (resp.headers.get("Retry-After") or "").strip()
+    if not value:
+        return 0.0  # throttled without a hint: the caller's backoff decides
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return 0.0
+
+
+class LoginBackoff:
+    """
+    Delays between login attempts: decorrelated jitter exponential backoff
+    (each delay is random between ``base`` and three times the previous one,
+    capped at ``cap``), never shorter than a portal's Retry-After. Spreads a
+    fleet of watchers out instead of letting them retry in waves.
+    """
+
+    def __init__(self, base: float, cap: float = LOGIN_BACKOFF_CAP):
+        self.base = max(0.0, base)
+        self.cap = max(self.base, cap)
+        self._delay = self.base
+
+    def next_delay(self, retry_after: float = None) -> float:
+        if self.base <= 0 and retry_after is None:
+            return 0.0
+        self._delay = min(self.cap, random.uniform(self.base, max(self.base, self._delay * 3)))
+        if retry_after is not None:
+            # jitter on top, or everyone told "60" comes back at the same instant
+            self._delay = max(self._delay, retry_after + random.uniform(0.0, max(self.base, 0.2 * retry_after)))
+        return self._delay
+
+    def reset(self):
+        self._delay = self.base
+
+
+def _note_throttle(resp: requests.Response, stats: dict) -> bool:
+    """Record a portal throttling answer in ``stats['retry_after']``; True if throttled."""
+    retry_after = parse_retry_after(resp)
+    if retry_after is None:
+        return False
+    stats["retry_after"] = retry_after
+    logging.warning("Portal is throttling logins (HTTP %s, Retry-After %.0fs)", resp.status_code, retry_after)
+    return True
+
+
+def perform_login(session: requests.Session, login_url: str, username: str, password: str, user_field_override: str = None, pass_field_override: str = None, extra_params: Dict[str, str] = None, timeout: float = 8.0, encoders: Sequence[str] = None, driver: str = "auto", stats: dict = None, verify_urls: Sequence[str] = None, page_cache: PortalPageCache = None, health: ProbeHealth = None, verify_family: int = None) -> bool:
+    """
+    Log in through ``login_url``. ``driver`` is "auto" (fingerprint the portal),
+    "generic" (form scraping only) or a registered vendor driver name.
+
+    If ``stats`` is given it is filled with the winning ``mode``, the number of
+    ``attempts``, per-phase durations in milliseconds under ``phases`` and how
+    the portal page was obtained under ``page_cache`` ("miss", "304" or "hash",
+    see PortalPageCache). If the portal answered 429/503, the requested delay
+    is stored under ``retry_after`` (0 when no Retry-After was sent) and no
+    further submissions are made.
+
+    Each submission is confirmed with ``verify_online`` against ``verify_urls``
+    (default: the probe list), pinned to ``verify_family`` when given.
+    ``page_cache`` and ``health`` default to the process-wide PORTAL_PAGE_CACHE
+    and PROBE_HEALTH.
+    """
+    page_cache = page_cache or PORTAL_PAGE_CACHE
+    stats = {} if stats is None else stats
+    stats.setdefault("phases", {})
+    stats.setdefault("attempts", 0)
+    stats["mode"] = None
+    stats.pop("retry_after", None)
+
+    tried_driver = None
+    if driver != "generic":
+        drv = get_portal_driver(driver) if driver != "auto" else detect_portal_driver(login_url)
+        if drv:
+            tried_driver = drv
+            t0 = time.perf_counter()
+            result = _login_with_driver(drv, session, login_url, username, password, extra_params, timeout,
+                                        verify_urls, health, verify_family, stats)
+            _add_phase(stats, "driver", t0)
+            if result is not None:
+                stats["mode"] = f"driver:{drv.name}" if result else None
+                return result
+
     logging.info("Opening login page: %s", login_url)
+    t0 = time.perf_counter()
     try:
-        page = session.get(login_url, timeout=timeout, headers=HEADERS)
+        page = session.get(login_url, timeout=timeout,
+                           headers={**HEADERS, **page_cache.conditional_headers(login_url)})
+        page_text = page_cache.page_text(login_url, page)
+        if page_text is None:
+            # 304 we cannot serve from cache: fetch the page unconditionally
+            page = session.get(login_url, timeout=timeout, headers=HEADERS)
+            page_text = page_cache.page_text(login_url, page)
     except requests.RequestException as e:
         logging.error("Failed to open login page: %s", e)
         return False
+    finally:
+        _add_phase(stats, "page", t0)
+    stats["page_cache"] = "304" if page.status_code == 304 else "miss"
+    if _note_throttle(page, stats):
+        return False
 
-    soup = BeautifulSoup(page.text, "html.parser")
-    _save_debug_response(page, suffix="_page")
-    form = pick_login_form(soup)
-    if not form:
+    if driver == "auto" and tried_driver is None:
+        drv = detect_portal_driver(page.url, page_text[:FINGERPRINT_BYTES])
+        if drv:
+            t0 = time.perf_counter()
+            result = _login_with_driver(drv, session, page.url, username, password, extra_params, timeout,
+                                        verify_urls, health, verify_family, stats)
+            _add_phase(stats, "driver", t0)
+            if result is not None:
+                stats["mode"] = f"driver:{drv.name}" if result else None
+                return result
+
+    t0 = time.perf_counter()
+    if page.status_code != 304:
+        _save_debug_response(page, suffix="_page")
+    parsed, parse_hit = page_cache.parse(page_text)
+    if parse_hit and stats["page_cache"] == "miss":
+        stats["page_cache"] = "hash"
+    if not parsed:
+        _add_phase(stats, "parse", t0)
         logging.warning("No form found on portal page, trying fallback direct submit")
-        return try_direct_submit_without_form(session, page.url, username, password, timeout=timeout)
+        t0 = time.perf_counter()
+        ok = try_direct_submit_without_form(session, page.url, username, password, timeout=timeout,
+                                            verify_urls=verify_urls, health=health,
+                                            verify_family=verify_family)
+        _add_phase(stats, "submit", t0)
+        stats["mode"] = "fallback" if ok else None
+        return ok
 
-    action, method, data = extract_form_data(form)
+    action, method, data, user_field, pass_field = parsed
+    _add_phase(stats, "parse", t0)
 
     # Log form fields for troubleshooting
-    logging.debug("Form action=%s method=%s fields=%s", action, method, list(data.keys()))
+    logging.debug("Form action=%s method=%s fields=%s (cache=%s)", action, method, list(data.keys()),
+                  stats["page_cache"])
 
     # Determine username/password field names
     all_names = list(data.keys())
-    user_field = user_field_override or guess_field_name(COMMON_USER_FIELDS, all_names)
-    pass_field = pass_field_override or guess_field_name(COMMON_PASS_FIELDS, all_names)
+    user_field = user_field_override or user_field
+    pass_field = pass_field_override or pass_field
 
     if not user_field or not pass_field:
         logging.error("Could not identify username/password fields. Found fields: %s", all_names)
@@ -283,71 +1749,13 @@ def perform_login(session: requests.Session, login_url: str, username: str, pass
     logging.debug("Payload keys=%s", list(data.keys()))
     logging.debug("Payload sample=%s", redact_payload(data))
 
-    # Try multiple password encodings and loginType variants if needed
-    attempts = []
-
-    def add_attempt(name, base):
-        attempts.append((name, base.copy()))
-
-    # base variants for loginType
-    base_variants = []
-    for lt in [data.get("loginType"), "1", "0", ""]:
-        d0 = data.copy()
-        if lt is not None:
-            d0["loginType"] = lt
-        base_variants.append(d0)
-
-    # tokens possibly required by portal JS
-    echostr = str(data.get("echostr") or "")
-    distoken = str(data.get("distoken") or "")
-
-    # assemble attempts
-    for base in base_variants:
-        add_attempt("plain", base)
-        # md5(password)
-        try:
-            d = base.copy(); d[pass_field] = hashlib.md5(password.encode("utf-8")).hexdigest(); add_attempt("md5", d)
-        except Exception:
-            pass
-        # base64(password)
-        try:
-            d = base.copy(); d[pass_field] = base64.b64encode(password.encode("utf-8")).decode("ascii"); add_attempt("b64", d)
-        except Exception:
-            pass
-        # md5(password+echostr)
-        if echostr:
-            try:
-                d = base.copy(); d[pass_field] = hashlib.md5((password + echostr).encode("utf-8")).hexdigest(); add_attempt("md5_pwd_echostr", d)
-            except Exception:
-                pass
-            try:
-                d = base.copy(); d[pass_field] = hashlib.md5((hashlib.md5(password.encode()).hexdigest() + echostr).encode()).hexdigest(); add_attempt("md5_md5pwd_echostr", d)
-            except Exception:
-                pass
-        # md5(password+distoken)
-        if distoken:
-            try:
-                d = base.copy(); d[pass_field] = hashlib.md5((password + distoken).encode("utf-8")).hexdigest(); add_attempt("md5_pwd_distoken", d)
-            except Exception:
-                pass
-        # uppercase MD5 variants
-        try:
-            d = base.copy(); d[pass_field] = hashlib.md5(password.encode("utf-8")).hexdigest().upper(); add_attempt("md5_upper", d)
-        except Exception:
-            pass
-
-    # De-duplicate attempts by payload keys+hash
-    seen = set()
-    uniq_attempts = []
-    for name, pl in attempts:
-        key = (name, tuple(sorted(pl.items())))
-        if key in seen:
-            continue
-        seen.add(key)
-        uniq_attempts.append((name, pl))
+    # Try multiple password encodings and loginType variants lazily
+    attempts = plan_login_attempts(data, pass_field, password, encoders=encoders)
 
-    for mode, payload in uniq_attempts:
+    for mode, payload in attempts:
         logging.debug("Trying mode=%s loginType=%s", mode, payload.get("loginType"))
+        stats["attempts"] += 1
+        t0 = time.perf_counter()
         try:
             if method == "post":
                 resp = session.post(submit_url, data=payload, timeout=timeout, headers=headers, allow_redirects=True)
@@ -356,6 +1764,8 @@ def perform_login(session: requests.Session, login_url: str, username: str, pass
         except requests.RequestException as e:
             logging.error("Login submit failed (mode=%s): %s", mode, e)
             continue
+        finally:
+            _add_phase(stats, "submit", t0)
 
         # log brief response clue
         try:
@@ -366,42 +1776,720 @@ def perform_login(session: requests.Session, login_url: str, username: str, pass
             pass
 
         _save_debug_response(resp, suffix=f"_{mode}")
-        if internet_ok(session):
-            logging.info("Login successful: internet access restored (mode=%s)", mode)
-            return True
-
+        if _note_throttle(resp, stats):
+            # the remaining encodings would only add to the overload
+            break
+        t0 = time.perf_counter()
         text_low = resp.text.lower()
         failure_keywords = ["error", "failed", "密码", "错误", "失败", "invalid", "login again", "认证失败", "请重试"]
-        if any(k in text_low for k in failure_keywords):
-            logging.debug("Portal suggests failure (mode=%s)", mode)
-            continue
-        time.sleep(1.0)
-        if internet_ok(session):
-            logging.info("Login likely successful after delay (mode=%s).", mode)
+        rejected = any(k in text_low for k in failure_keywords)
+        # a page that looks like a rejection only gets a quick look (some success pages mention "error")
+        ok = verify_online(session, verify_urls, total=VERIFY_TOTAL_ON_FAILURE if rejected else VERIFY_TOTAL,
+                           health=health, family=verify_family)
+        _add_phase(stats, "verify", t0)
+        if ok:
+            logging.info("Login successful: internet access restored (mode=%s)", mode)
+            stats["mode"] = mode
             return True
+        if rejected:
+            logging.debug("Portal suggests failure (mode=%s)", mode)
 
-    logging.warning("All login attempts failed with multiple modes and variants.")
+    if "retry_after" not in stats:
+        logging.warning("All login attempts failed with multiple modes and variants.")
     return False
 
 
+def _driver_name(value) -> str:
+    if value not in portal_driver_names():
+        raise ValueError(f"unknown driver {value!r}")
+    return value
+
+
+# login_config.json key -> (argparse dest, converter); shared format with the GUI
+CONFIG_ARG_MAP = {
+    "username": ("username", str),
+    "password": ("password", str),
+    "retry": ("retries", int),
+    "retries": ("retries", int),
+    "interval": ("interval", float),
+    "watch_interval": ("watch_interval", float),
+    "splay": ("splay", float),
+    "probe_urls": ("probe", url_list),
+    "portal": ("portal", str),
+    "driver": ("driver", _driver_name),
+    "keepalive": ("keepalive", float),
+    "renew_before": ("renew_before", float),
+}
+
+
+def _explicit_arg_dests(parser: argparse.ArgumentParser, argv: List[str] = None) -> set:
+    """Config-mapped dests that were given explicitly on the command line."""
+    sentinel = object()
+    ns = argparse.Namespace(**{dest: sentinel for dest, _ in CONFIG_ARG_MAP.values()})
+    parser.parse_args(argv, namespace=ns)
+    return {dest for dest, _ in CONFIG_ARG_MAP.values() if getattr(ns, dest) is not sentinel}
+
+
+def apply_config_to_args(config: dict, args: argparse.Namespace, explicit: set) -> List[str]:
+    """Overlay config values onto ``args`` (command-line flags win); returns changed dests."""
+    changed = []
+    for key, (dest, conv) in CONFIG_ARG_MAP.items():
+        if key not in config or dest in explicit or config[key] in (None, ""):
+            continue
+        try:
+            value = conv(config[key])
+        except (TypeError, ValueError):
+            logging.warning("配置项 %s 的值无效: %r", key, config[key])
+            continue
+        if getattr(args, dest, None) != value:
+            setattr(args, dest, value)
+            changed.append(dest)
+    return changed
+
+
+# How often a follower watcher retries the leader lock (takeover latency)
+FOLLOWER_POLL_INTERVAL = 2.0
+
+# Outcomes reported by LoginCoordinator.ensure_login
+LOGIN_OK = "ok"
+LOGIN_FAILED = "failed"
+LOGIN_ALREADY_ONLINE = "online"
+LOGIN_NO_PORTAL = "no_portal"
+# CampusLoginClient.ensure_online only: the wait ran out, the login may still finish
+LOGIN_TIMEOUT = "timeout"
+
+
+class LoginCoordinator:
+    """
+    Owns the shared session and serializes login flows on it.
+
+    ``ensure_login`` coalesces concurrent requests: while a login is in flight,
+    further callers receive the same Future and therefore the same outcome, so
+    the portal only ever sees one submission sequence. Background work runs on
+    a small bounded thread pool.
+    """
+
+    def __init__(self, session: requests.Session = None, max_workers: int = 2,
+                 connectivity: ConnectivityState = None, probe_urls: List[str] = None,
+                 health: ProbeHealth = None):
+        self.session = session or requests.Session()
+        self.probe_urls = probe_urls
+        self.health = health
+        self.dns_check: Optional[bool] = None  # None: DNS_HIJACK_CHECK
+        self.connectivity = connectivity or ConnectivityState(self.session, urls=probe_urls, health=health)
+        self.history = None  # optional login_history.HistoryStore
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="campus-login")
+        self._lock = threading.Lock()
+        self._inflight: Optional[Future] = None
+        # Retry-After of the portal's last throttling answer (None if it was not throttling)
+        self.retry_after: Optional[float] = None
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Run ``fn`` on the bounded worker pool."""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def ensure_login(self, username: str, password: str, portal_url: str = None, retries: int = 1,
+                     probe_urls: List[str] = None, check_first: bool = True, interval: float = 0.0,
+                     **login_kwargs) -> Future:
+        """
+        Start (or join) a login flow. The Future resolves to ``(outcome, portal_url)``
+        where outcome is one of the ``LOGIN_*`` constants.
+        """
+        with self._lock:
+            if self._inflight is not None and not self._inflight.done():
+                logging.info("已有登录流程进行中，合并本次登录请求")
+                return self._inflight
+            fut = self._executor.submit(self._run, username, password, portal_url, retries,
+                                        probe_urls, check_first, interval, login_kwargs)
+            self._inflight = fut
+            return fut
+
+    def _run(self, username, password, portal_url, retries, probe_urls, check_first, interval, login_kwargs):
+        if check_first:
+            with profile_section("probe"):
+                online = self.connectivity.check()
+            if online:
+                return LOGIN_ALREADY_ONLINE, None
+        discover_ms = 0.0
+        if not portal_url:
+            t0 = time.perf_counter()
+            with profile_section("discover"):
+                portal_url = find_captive_portal(self.session, probe_urls=probe_urls or self.probe_urls or DEFAULT_PROBE_URLS,
+                                                 dns_check=self.dns_check, health=self.health)
+            discover_ms = (time.perf_counter() - t0) * 1000.0
+            if not portal_url:
+                return LOGIN_NO_PORTAL, None
+        backoff = LoginBackoff(interval)
+        self.retry_after = None
+        for attempt in range(1, max(1, retries) + 1):
+            logging.info("开始登录尝试 %d/%d", attempt, retries)
+            stats = {"phases": {"discover": discover_ms}} if attempt == 1 and discover_ms else {}
+            login_kwargs.setdefault("verify_urls", probe_urls or self.probe_urls)
+            login_kwargs.setdefault("health", self.health)
+            with profile_section("login"):
+                ok = perform_login(self.session, portal_url, username, password, stats=stats, **login_kwargs)
+            if self.history:
+                self.history.record_login(ok, stats, portal_url)
+            self.retry_after = stats.get("retry_after")
+            if ok:
+                self.connectivity.set(True)
+                return LOGIN_OK, portal_url
+            if attempt < retries:
+                time.sleep(backoff.next_delay(self.retry_after))
+        self.connectivity.invalidate()
+        return LOGIN_FAILED, portal_url
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
+
+
+class CampusLoginClient:
+    """
+    Embeddable, thread-safe login client.
+
+    Owns everything a login needs: the HTTP session (and its pooled
+    connections), probe health, the portal page/form cache, the probe list and
+    the last portal that worked. Keep one instance alive and call
+    ``ensure_online()`` whenever the host application needs the network; warm
+    calls cost at most one probe (none within ``connectivity_ttl`` seconds),
+    concurrent callers share one login, and the remembered portal skips
+    discovery::
+
+        client = CampusLoginClient("user", "pass")
+        if not client.ensure_online():
+            raise RuntimeError(client.last_outcome)
+    """
+
+    def __init__(self, username: str, password: str, probe_urls: Sequence[str] = None, portal_url: str = None,
+                 driver: str = "auto", user_field: str = None, pass_field: str = None,
+                 extra_params: Dict[str, str] = None, encoders: Sequence[str] = None, retries: int = 1,
+                 interval: float = 3.0, timeout: float = 8.0, connectivity_ttl: float = 3.0,
+                 dns_check: bool = None, session: requests.Session = None, max_workers: int = 2):
+        self.username = username
+        self.password = password
+        self.probe_urls = list(probe_urls) if probe_urls else list(DEFAULT_PROBE_URLS)
+        self.portal_url = portal_url
+        self.driver = driver
+        self.user_field = user_field
+        self.pass_field = pass_field
+        self.extra_params = dict(extra_params or {})
+        self.encoders = encoders
+        self.retries = retries
+        self.interval = interval
+        self.timeout = timeout
+        self.health = ProbeHealth()
+        self.page_cache = PortalPageCache()
+        session = session or requests.Session()
+        self.connectivity = ConnectivityState(session, ttl=connectivity_ttl, urls=self.probe_urls, health=self.health)
+        self.coordinator = LoginCoordinator(session, max_workers=max_workers, connectivity=self.connectivity,
+                                            probe_urls=self.probe_urls, health=self.health)
+        self.coordinator.dns_check = dns_check
+        self.last_outcome: Optional[str] = None
+        self._lock = threading.Lock()
+        # a portal passed in explicitly is never forgotten; discovered ones are re-discovered on failure
+        self._fixed_portal = portal_url is not None
+
+    @property
+    def session(self) -> requests.Session:
+        return self.coordinator.session
+
+    def is_online(self, max_age: float = None) -> bool:
+        """Connectivity, reusing a result younger than ``max_age`` (default: ``connectivity_ttl``)."""
+        return self.connectivity.check(max_age)
+
+    def _login_kwargs(self) -> dict:
+        return {"user_field_override": self.user_field, "pass_field_override": self.pass_field,
+                "extra_params": self.extra_params, "timeout": self.timeout, "encoders": self.encoders,
+                "driver": self.driver, "verify_urls": self.probe_urls, "page_cache": self.page_cache,
+                "health": self.health}
+
+    def ensure_online_async(self, force: bool = False) -> Future:
+        """
+        Start (or join) the check -> discover -> login flow without blocking.
+        The Future resolves to ``(outcome, portal_url)`` like
+        ``LoginCoordinator.ensure_login``.
+        """
+        with self._lock:
+            portal_url = self.portal_url
+        return self.coordinator.ensure_login(self.username, self.password, portal_url=portal_url,
+                                             retries=self.retries, probe_urls=self.probe_urls,
+                                             check_first=not force, interval=self.interval,
+                                             **self._login_kwargs())
+
+    def ensure_online(self, timeout: float = None, force: bool = False) -> bool:
+        """
+        Make sure the network is usable, logging in if necessary; True when
+        online. ``force`` skips the connectivity check (e.g. the host knows the
+        session was dropped). ``timeout`` bounds the whole wait, not the login
+        itself: when it runs out the result is False with ``last_outcome``
+        LOGIN_TIMEOUT, and the flow keeps running for the next caller to join.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            remembered = self.portal_url
+        try:
+            outcome, portal_url = self.ensure_online_async(force).result(timeout)
+            if (outcome == LOGIN_FAILED and remembered and portal_url == remembered and not self._fixed_portal
+                    and self.coordinator.retry_after is None):
+                # the remembered portal may have moved: discover it again, once
+                # (not when it was throttling us -- it is there, just busy)
+                with self._lock:
+                    if self.portal_url == portal_url:
+                        self.portal_url = None
+                logging.info("记住的认证入口登录失败，重新探测认证页")
+                outcome, portal_url = self.ensure_online_async(force=True).result(
+                    None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            logging.warning("等待登录结果超时 (%.1f 秒)", timeout)
+            outcome, portal_url = LOGIN_TIMEOUT, None
+        with self._lock:
+            self.last_outcome = outcome
+            if outcome == LOGIN_OK and portal_url:
+                self.portal_url = portal_url
+        return outcome in (LOGIN_OK, LOGIN_ALREADY_ONLINE)
+
+    def forget_portal(self):
+        """Drop the remembered portal (and its cached pages) so the next login discovers it again."""
+        with self._lock:
+            if not self._fixed_portal:
+                self.portal_url = None
+        self.page_cache.clear()
+
+    def invalidate(self):
+        """Forget the cached connectivity result (e.g. after a network change)."""
+        self.connectivity.invalidate()
+
+    def close(self):
+        self.coordinator.shutdown()
+        self.session.close()
+
+    def __enter__(self) -> "CampusLoginClient":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Results of WatchLoop.step
+WATCH_ONLINE = "online"
+WATCH_SUSPECT = "suspect"
+WATCH_NO_PORTAL = "no_portal"
+WATCH_LOGGED_IN = "logged_in"
+WATCH_LOGIN_FAILED = "login_failed"
+
+
+class WatchLoop:
+    """
+    The watch loop's probe -> outage -> login path, shared by the CLI and the
+    fleet load test so the two cannot drift apart.
+
+    ``step`` probes once. ``failures`` failed probes in a row (``recheck``
+    seconds apart) confirm an outage; then it waits a random splay, calls
+    ``discover() -> (portal_url, redirected)`` and then
+    ``login(portal_url) -> (ok, retry_after)``, which does its own retries.
+    ``on_logout`` is called only when ``redirected`` says discovery just saw
+    the portal capture us, i.e. the portal itself dropped the session (a
+    configured portal URL proves nothing about why we are offline). Failed rounds back off from
+    ``watch_interval``, honouring the portal's Retry-After. ``step`` only
+    sleeps (through ``nap``) when it wants to be called again soon; after
+    WATCH_ONLINE and WATCH_LOGGED_IN the caller schedules the next tick.
+    ``cadence`` spreads the fixed waits (``jittered``; identity for the old
+    fixed cadence).
+    """
+
+    def __init__(self, probe: Callable[[], bool], discover: Callable[[], Tuple[Optional[str], bool]],
+                 login: Callable[[str], Tuple[bool, Optional[float]]], nap: Callable[[float], None] = time.sleep,
+                 watch_interval: float = 20.0, splay: float = LOGIN_SPLAY, failures: int = 3,
+                 recheck: float = 5.0, cadence: Callable[[float], float] = jittered, round_backoff=None,
+                 on_logout: Callable[[], None] = None):
+        self.probe = probe
+        self.discover = discover
+        self.login = login
+        self.nap = nap
+        self.splay = splay
+        self.failures = failures
+        self.recheck = recheck
+        self.cadence = cadence
+        self.round_backoff = round_backoff or LoginBackoff(watch_interval)
+        self.on_logout = on_logout
+        self.fail_count = 0
+        self.portal_url: Optional[str] = None  # portal of the last login round
+
+    def step(self) -> str:
+        if self.probe():
+            if self.fail_count > 0:
+                logging.info("[Network] 网络恢复，重置失败计数")
+            self.fail_count = 0
+            self.round_backoff.reset()
+            logging.debug("[Network] 网络正常，无需登录")
+            return WATCH_ONLINE
+
+        # 网络检测失败，增加失败计数
+        self.fail_count += 1
+        logging.debug("[Probe] 网络检测失败，连续失败次数: %d/%d", self.fail_count, self.failures)
+
+        # 只有连续多次失败才触发重连
+        if self.fail_count < self.failures:
+            self.nap(self.cadence(self.recheck))
+            return WATCH_SUSPECT
+
+        logging.warning("[Network] 连续%d次检测失败，触发重新登录", self.failures)
+        self.fail_count = 0  # 触发重连后重置失败计数
+        if self.splay > 0:
+            # 同一网段的机器往往同时掉线：错开各自的登录时刻
+            delay = random.uniform(0, self.splay)
+            logging.info("[Network] 随机等待 %.1f 秒后登录", delay)
+            self.nap(delay)
+        portal_url, redirected = self.discover()
+        if not portal_url:
+            logging.warning("[Network] 未捕获到认证重定向，稍后重试")
+            self.nap(self.cadence(self.recheck))
+            return WATCH_NO_PORTAL
+
+        # redirected to the portal: it logged us out, not just a network outage
+        if redirected and self.on_logout:
+            self.on_logout()
+        self.portal_url = portal_url
+        ok, retry_after = self.login(portal_url)
+        if ok:
+            self.round_backoff.reset()
+            logging.info("[Network] 登录流程结束，进入下一轮监控")
+            return WATCH_LOGGED_IN
+        wait = self.round_backoff.next_delay(retry_after)
+        logging.warning("[Network] 本轮登录失败，将在 %.1f 秒后重试", wait)
+        self.nap(wait)
+        return WATCH_LOGIN_FAILED
+
+
+class CliWatcher:
+    """
+    State and steps of one CLI run (``main`` only parses options and wires the
+    optional pieces together): probing, portal discovery, logins with retries
+    and, with ``--watch``, the loop around ``WatchLoop`` with leader election,
+    control requests, keepalive, session renewal and ``--config`` hot reload.
+    ``args`` is read on every use, so hot-reloaded options take effect.
+    """
+
+    def __init__(self, args: argparse.Namespace, session: requests.Session, extras: Dict[str, str],
+                 leader=None, control=None, history=None, nap: Callable[[float], None] = time.sleep):
+        self.args = args
+        self.session = session
+        self.extras = extras
+        self.leader = leader
+        self.control = control
+        self.history = history
+        self.nap = nap
+        self.liveness = None
+        if args.watch and args.tiered and not args.dual_stack:
+            self.liveness = LivenessPipeline(session, urls=args.probe, anchors=args.anchor,
+                                             http_every=args.http_every or args.watch_interval * LIVENESS_AUDIT_PERIODS)
+        # portal URL and address family of the first family found behind a portal (--dual-stack)
+        self.dual_portal: Optional[str] = None
+        self.dual_family: Optional[int] = None
+        self.discover_ms = 0.0
+        # Retry-After of the portal's last throttling answer, for the watch loop's round backoff
+        self.retry_after: Optional[float] = None
+        self.last_portal: Optional[str] = args.portal
+        self.keepalive: Optional[PortalKeepalive] = None
+        self.expiry: Optional[SessionExpiry] = None
+        self.watch: Optional[WatchLoop] = None
+        # keepalive / renew_before as last applied; --config may change them while we run
+        self._applied: Dict[str, float] = {}
+
+    def _probe_families(self) -> bool:
+        families = dual_stack_status(self.args.probe)
+        self.dual_portal = self.dual_family = None
+        for name, r in families.items():
+            if r["portal"]:
+                logging.info("[DualStack] %s 处于认证页之后: %s", name, r["portal"])
+                if not self.dual_portal:
+                    self.dual_portal, self.dual_family = r["portal"], dict(ADDRESS_FAMILIES)[name]
+        return any(r["online"] for r in families.values()) and not self.dual_portal
+
+    def probe(self) -> bool:
+        args = self.args
+        t0 = time.perf_counter()
+        with profile_section("probe"):
+            if args.dual_stack:
+                ok = self._probe_families()
+            elif self.liveness:
+                self.liveness.urls = args.probe  # may be hot-reloaded from --config
+                ok = self.liveness.check()
+            else:
+                ok = check_network_status(self.session, urls=args.probe)
+        latency_ms = (time.perf_counter() - t0) * 1000.0
+        if self.history:
+            self.history.record_probe(ok, latency_ms)
+        if self.leader:
+            self.leader.publish(online=ok, latency_ms=latency_ms, source="cli")
+        if self.control:
+            self.control.record_probe(ok, latency_ms)
+            if self.liveness:
+                self.control.update(liveness=self.liveness.snapshot())
+        return ok
+
+    def discover_portal(self) -> Tuple[Optional[str], bool]:
+        """Portal URL, and whether a redirect to it was seen just now (not --portal / dual-stack)."""
+        t0 = time.perf_counter()
+        with profile_section("discover"):
+            url = self.args.portal or self.dual_portal
+            redirected = False
+            if not url:
+                url = find_captive_portal(self.session, probe_urls=self.args.probe or DEFAULT_PROBE_URLS)
+                redirected = url is not None
+        self.discover_ms = (time.perf_counter() - t0) * 1000.0
+        return url, redirected
+
+    def discover(self) -> Optional[str]:
+        return self.discover_portal()[0]
+
+    def login_with_retries(self, portal_url: str, tag: str = "") -> bool:
+        args = self.args
+        backoff = LoginBackoff(args.interval)
+        self.retry_after = None
+        for attempt in range(1, args.retries + 1):
+            logging.info("%s开始登录尝试 %d/%d", tag, attempt, args.retries)
+            stats = {"phases": {"discover": self.discover_ms}} if attempt == 1 and self.discover_ms else {}
+            with profile_section("login"):
+                ok = perform_login(
+                    self.session,
+                    portal_url,
+                    args.username,
+                    args.password,
+                    user_field_override=args.user_field,
+                    pass_field_override=args.pass_field,
+                    extra_params=self.extras,
+                    driver=args.driver,
+                    stats=stats,
+                    verify_urls=args.probe,
+                    # the other family may already be online; confirm over the one that was blocked
+                    verify_family=self.dual_family,
+                )
+            if self.history:
+                self.history.record_login(ok, stats, portal_url)
+            if self.control:
+                self.control.update(last_login={"ts": time.time(), "success": ok, "mode": stats.get("mode"),
+                                                "portal": portal_url})
+            self.retry_after = stats.get("retry_after")
+            if self.liveness:
+                # a login changes what the portal lets through; re-confirm over HTTP
+                self.liveness.invalidate()
+            if ok:
+                return True
+            if attempt < args.retries:
+                self.nap(backoff.next_delay(self.retry_after))
+        return False
+
+    def run_once(self) -> int:
+        """One-shot mode: log in if offline; exit status for ``main``."""
+        try:
+            if self.probe():
+                logging.info("已联网，无需登录。")
+                return 0
+
+            portal_url = self.discover()
+            if not portal_url:
+                logging.error("未捕获到认证重定向。可尝试指定 --probe 自定义探测URL。")
+                return 1
+
+            ok = self.login_with_retries(portal_url)
+            if ok and self.history:
+                self.probe()  # 记录恢复时刻，闭合本次断网区间
+            return 0 if ok else 1
+        finally:
+            if self.history:
+                self.history.close()
+
+    def _after_login(self, portal_url: str):
+        self.last_portal = portal_url
+        if self.keepalive:
+            self.keepalive.remember(portal_url)
+        self.expiry.refresh(portal_url)
+
+    def _record_drop(self):
+        if self.keepalive:
+            self.keepalive.record_drop()
+
+    def _sync_config(self):
+        """Pick up watch options changed by a --config hot reload."""
+        args, applied = self.args, self._applied
+        if args.keepalive != applied["keepalive"]:
+            applied["keepalive"] = args.keepalive
+            if args.keepalive <= 0:
+                self.keepalive = None
+                logging.info("[Keepalive] 已关闭会话保活")
+            elif self.keepalive is None:
+                self.keepalive = PortalKeepalive(self.session, interval=args.keepalive)
+                if self.last_portal:
+                    self.keepalive.remember(self.last_portal)
+            else:
+                # restart learning from the new base interval
+                self.keepalive.interval = args.keepalive
+                self.keepalive._healthy_pings = 0
+                logging.info("[Keepalive] 保活间隔调整为 %.0f 秒", args.keepalive)
+        if args.renew_before != applied["renew_before"]:
+            applied["renew_before"] = self.expiry.renew_before = args.renew_before
+            logging.info("[Expiry] 提前续期时间调整为 %.0f 秒", args.renew_before)
+        self.watch.splay = args.splay
+        if self.watch.round_backoff.base != args.watch_interval:
+            self.watch.round_backoff = LoginBackoff(args.watch_interval)
+
+    def _follow(self, following: bool):
+        """Another process leads: mirror its shared state instead of probing."""
+        args, control = self.args, self.control
+        state = self.leader.read_state(max_age=args.watch_interval * 3)
+        if not following:
+            logging.info("[Leader] 已有主探测进程 (PID %s)，本进程转为跟随模式",
+                         state.get("pid") if state else "?")
+        elif state:
+            logging.debug("[Leader] 主进程状态: online=%s latency=%.0fms",
+                          state.get("online"), state.get("latency_ms") or 0)
+        if control:
+            control.update(role="follower", online=state.get("online") if state else None,
+                           latency_ms=state.get("latency_ms") if state else None,
+                           last_probe_ts=state.get("ts") if state else None)
+        self.nap(min(args.watch_interval, FOLLOWER_POLL_INTERVAL))
+
+    def run_watch(self):
+        """Watch mode: runs until interrupted."""
+        args, control, nap = self.args, self.control, self.nap
+        logging.info("进入监控模式：每 %.1f 秒检测一次网络可达性", args.watch_interval)
+        self.keepalive = PortalKeepalive(self.session, interval=args.keepalive) if args.keepalive > 0 else None
+        if self.keepalive and args.portal:
+            self.keepalive.remember(args.portal)
+        self.expiry = SessionExpiry(self.session, status_url=args.expiry_url, patterns=args.expiry_pattern,
+                                    json_paths=args.expiry_json, renew_before=args.renew_before)
+        self._applied = {"keepalive": args.keepalive, "renew_before": args.renew_before}
+        # failed rounds back off from the watch interval, so an overloaded portal gets room
+        self.watch = WatchLoop(self.probe, self.discover_portal,
+                               lambda url: (self.login_with_retries(url, "[Login] "), self.retry_after),
+                               nap=nap, watch_interval=args.watch_interval, splay=args.splay,
+                               on_logout=self._record_drop)
+        following = False
+        while True:
+            try:
+                if self.leader and not self.leader.try_acquire():
+                    # 其他进程正在负责探测：读取共享状态，不产生额外流量
+                    self._follow(following)
+                    following = True
+                    continue
+                if following:
+                    logging.info("[Leader] 主探测进程已退出，本进程接管探测")
+                    following = False
+                    if control:
+                        control.update(role="leader")
+                        if control.take_login_request():
+                            logging.info("[Control] 丢弃接管前排队的登录请求")
+                self._sync_config()
+
+                if control and control.take_login_request():
+                    logging.info("[Control] 收到登录请求，立即执行登录")
+                    portal_url = self.last_portal or self.discover()
+                    if not portal_url:
+                        logging.warning("[Network] 未捕获到认证重定向")
+                    elif self.login_with_retries(portal_url, "[Login] "):
+                        self._after_login(portal_url)
+                    continue
+
+                if control and control.paused:
+                    nap(jittered(args.watch_interval))
+                    continue
+
+                self.discover_ms = 0.0
+                if self.last_portal and self.expiry.renewal_due():
+                    logging.info("[Expiry] 会话即将到期，提前重新登录")
+                    if self.login_with_retries(self.last_portal, "[Login] "):
+                        if self.keepalive:
+                            self.keepalive.remember(self.last_portal)
+                        self.expiry.renewed(self.last_portal)
+                    else:
+                        self.expiry.deadline = None  # 续期失败，交由常规探测兜底
+                    # 两次续期之间至少间隔一个检测周期
+                    nap(jittered(args.watch_interval))
+                    continue
+
+                result = self.watch.step()
+                if result == WATCH_ONLINE:
+                    wait = min(jittered(args.watch_interval), self.expiry.seconds_until_renewal())
+                    if self.keepalive:
+                        wait = min(wait, self.keepalive.tick())
+                    nap(wait)
+                elif result == WATCH_LOGGED_IN:
+                    self._after_login(self.watch.portal_url)
+                    nap(jittered(args.watch_interval))
+            except Exception as e:
+                logging.error("[Network] 监控循环异常：%s", e)
+                nap(jittered(args.watch_interval))
+
+
 def main():
-    parser = argparse.ArgumentParser(description="校园网 Web 认证自动登录脚本")
+    # 子命令：history 查看历史统计
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        import login_history
+        return login_history.main(sys.argv[2:])
+    # 子命令：analyze 离线批量分析保存的认证页面
+    if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+        import portal_corpus
+        return portal_corpus.main(sys.argv[2:])
+    # 子命令：loadtest 模拟大批监控进程同时重新登录
+    if len(sys.argv) > 1 and sys.argv[1] == "loadtest":
+        import fleet_loadtest
+        return fleet_loadtest.main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="校园网 Web 认证自动登录脚本（子命令：history 查看历史统计，analyze 离线分析认证页面，loadtest 多机同时登录压测）")
     parser.add_argument("-u", "--username", default=os.getenv(USER_ENV), help=f"用户名（也可用环境变量 {USER_ENV}）")
     parser.add_argument("-p", "--password", default=os.getenv(PASS_ENV), help=f"密码（也可用环境变量 {PASS_ENV}）")
     parser.add_argument("--user-field", dest="user_field", default=None, help="表单中用户名字段名覆盖，如 username")
     parser.add_argument("--pass-field", dest="pass_field", default=None, help="表单中密码字段名覆盖，如 password")
-    parser.add_argument("--probe", nargs="*", default=None, help="探测URL（空格分隔），默认使用内置列表")
+    parser.add_argument("--probe", nargs="*", default=None, help="探测URL（空格分隔），默认使用内置列表；按各站点延迟/失败率动态排序，持续失败的站点会被暂时隔离")
     parser.add_argument("--portal", dest="portal", default=None, help="指定固定认证入口URL，跳过探测")
+    parser.add_argument("--driver", default="auto", choices=portal_driver_names(), help="认证厂商驱动：auto（按指纹识别）、generic（仅通用表单）或驱动名，如 ruijie/drcom")
     parser.add_argument("--extra", dest="extra", action="append", default=[], help="附加表单字段，格式 k=v，可重复")
     parser.add_argument("--retries", type=int, default=3, help="登录重试次数")
     parser.add_argument("--interval", type=float, default=3.0, help="重试间隔秒")
     parser.add_argument("--watch", action="store_true", help="监控网络：当检测到无法联网时自动尝试登录")
     parser.add_argument("--watch-interval", type=float, default=20.0, help="监控模式下检测间隔秒")
+    parser.add_argument("--splay", type=float, default=LOGIN_SPLAY, help="监控模式下检测到断网后，首次登录前随机等待 0~N 秒，避免大批机器同时登录压垮认证服务器（0 表示不等待）")
+    parser.add_argument("--keepalive", type=float, default=0.0, help="监控模式下会话保活的初始间隔秒（0 表示关闭），会根据掉线情况自动调整")
+    parser.add_argument("--expiry-url", default=None, help="查询会话剩余时长的状态页URL，默认为认证入口根路径")
+    parser.add_argument("--expiry-pattern", action="append", default=[], help="提取剩余时长的正则（第1分组为时长），可重复")
+    parser.add_argument("--expiry-json", action="append", default=[], help="状态页JSON中剩余时长的路径，如 data.leftTime，可重复")
+    parser.add_argument("--renew-before", type=float, default=10.0, help="会话到期前提前多少秒重新登录")
+    parser.add_argument("--history", nargs="?", const="", default=None, metavar="DB", help="记录探测/断网/登录历史到 SQLite（默认程序目录下 login_history.db）")
+    parser.add_argument("--standalone", action="store_true", help="监控模式下不参与多进程选主（默认同一时间只有一个 CLI/GUI 进程负责探测和登录）")
+    parser.add_argument("--control", nargs="?", const="127.0.0.1:8765", default=None, metavar="ADDR", help="监控模式下开启本地控制接口（host:port 或 unix:/path，默认 127.0.0.1:8765）")
+    parser.add_argument("--no-tiered", dest="tiered", action="store_false", help="监控模式下每次都做完整 HTTP 探测（默认先检查路由和锚点 TCP 连接，异常时才升级为 HTTP 探测）")
+    parser.add_argument("--anchor", action="append", default=[], metavar="HOST:PORT", help="分层探测使用的 TCP 锚点，可重复；默认使用探测站点的 443 端口")
+    parser.add_argument("--http-every", type=float, default=None, help=f"分层探测时至少每隔多少秒做一次完整 HTTP 探测（默认检测间隔的 {LIVENESS_AUDIT_PERIODS} 倍）")
+    parser.add_argument("--no-dns-check", dest="dns_check", action="store_false", help="探测认证页时不做 DNS 劫持检测（默认与 HTTP 探测并行，HTTP 探测超时时由被劫持的 DNS 应答推断认证地址）")
+    parser.add_argument("--dual-stack", action="store_true", help="分别探测 IPv4/IPv6 连通性（Happy Eyeballs 并发），对处于认证页后的协议族单独登录")
+    parser.add_argument("--config", nargs="?", const="", default=None, metavar="PATH", help="读取 JSON 配置文件（与 GUI 的 login_config.json 格式相同，默认程序目录下），监控模式下修改后自动生效；命令行参数优先")
+    parser.add_argument("--capture", nargs="?", const="", default=None, metavar="DIR", help="在后台抓取认证页面和登录响应（密码已脱敏，gzip 压缩并按大小轮转，默认程序目录下 debug_captures/），用于排查认证页变化")
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument("--record", default=None, metavar="FILE", help="把探测/认证/登录的完整 HTTP 交互录制到 cassette 文件（密码已脱敏）")
+    cassette_group.add_argument("--replay", default=None, metavar="FILE", help="从 cassette 文件回放 HTTP 交互，不访问网络，用于离线复现和性能分析")
+    parser.add_argument("--replay-realtime", action="store_true", help="回放时按录制时的耗时等待（默认全速回放）")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="FILE", help="用 cProfile 分别统计探测/认证页发现/登录各阶段的耗时函数，退出时写入报告（默认程序目录下 campus_profile.txt），可附在问题反馈中")
+    parser.add_argument("--trace-alloc", action="store_true", help="用 tracemalloc 统计各阶段的内存峰值和分配位置，写入同一份报告")
     parser.add_argument("-v", action="count", default=0, help="日志详细程度，-v 或 -vv")
 
     args = parser.parse_args()
     setup_logger(args.v)
 
+    config_store = None
+    if args.config is not None:
+        import campus_config
+        config_store = campus_config.ConfigStore(args.config or None)
+        explicit = _explicit_arg_dests(parser)
+        apply_config_to_args(config_store.data(), args, explicit)
+        if args.watch:
+            def on_config_change(old, new):
+                changed = apply_config_to_args(new, args, explicit)
+                if changed:
+                    logging.info("[Config] 已热更新: %s", ", ".join(changed))
+            config_store.subscribe(on_config_change)
+            config_store.start_watching()
+
     if not args.username or not args.password:
         logging.error("缺少用户名或密码。请使用 -u/-p 或设置环境变量 %s/%s", USER_ENV, PASS_ENV)
         return 2
@@ -413,91 +2501,50 @@ def main():
             k, v = item.split("=", 1)
             extras[k] = v
 
-    session = requests.Session()
+    global DNS_HIJACK_CHECK
+    # replayed sessions must not depend on the live resolver
+    DNS_HIJACK_CHECK = args.dns_check and not args.replay
 
+    session = requests.Session()
+    if args.record or args.replay:
+        use_cassette(session, args.record or args.replay, "record" if args.record else "replay", args.replay_realtime)
+        if args.dual_stack:
+            logging.warning("--dual-stack 使用原始 socket 探测，不会被录制/回放")
+
+    leader = None
+    if args.watch and not args.standalone:
+        import process_leader
+        leader = process_leader.LeaderLock()
+
+    control = None
+    nap = time.sleep
+    if args.watch and args.control:
+        import local_control
+        control = local_control.ControlState(source="cli")
+        try:
+            local_control.start_control_server(control, args.control)
+        except (OSError, ValueError) as e:
+            logging.error("[Control] 无法启动本地控制接口 %s: %s", args.control, e)
+            return 2
+        nap = control.sleep  # 控制请求可提前唤醒
+
+    history = None
+    if args.history is not None:
+        import login_history
+        history = login_history.HistoryStore(args.history or None, source="cli")
+        # the watch loop only ends by signal/exception: flush queued rows on the way out
+        atexit.register(history.close)
+
+    if args.capture is not None:
+        enable_debug_capture(args.capture or None)
+
+    if args.profile is not None or args.trace_alloc:
+        enable_profiling(args.profile or None, cpu=args.profile is not None, alloc=args.trace_alloc)
+
+    watcher = CliWatcher(args, session, extras, leader=leader, control=control, history=history, nap=nap)
     if args.watch:
-        logging.info("进入监控模式：每 %.1f 秒检测一次网络可达性", args.watch_interval)
-        fail_count = 0
-        while True:
-            try:
-                if check_network_status(session):
-                    if fail_count > 0:
-                        logging.info("[Network] 网络恢复，重置失败计数")
-                    fail_count = 0
-                    logging.debug("[Network] 网络正常，无需登录")
-                    time.sleep(args.watch_interval)
-                    continue
-
-                # 网络检测失败，增加失败计数
-                fail_count += 1
-                logging.debug("[Probe] 网络检测失败，连续失败次数: %d/3", fail_count)
-
-                # 只有连续3次失败才触发重连
-                if fail_count < 3:
-                    time.sleep(5)  # 等待5秒后重新检测
-                    continue
-
-                logging.warning("[Network] 连续3次检测失败，触发重新登录")
-                fail_count = 0  # 触发重连后重置失败计数
-                portal_url = args.portal or find_captive_portal(session, probe_urls=args.probe or DEFAULT_PROBE_URLS)
-                if not portal_url:
-                    logging.warning("[Network] 未捕获到认证重定向，稍后重试")
-                    time.sleep(5)  # 等待5秒后重新检测
-                    continue
-
-                success = False
-                for attempt in range(1, args.retries + 1):
-                    logging.info("[Login] 开始登录尝试 %d/%d", attempt, args.retries)
-                    ok = perform_login(
-                        session,
-                        portal_url,
-                        args.username,
-                        args.password,
-                        user_field_override=args.user_field,
-                        pass_field_override=args.pass_field,
-                        extra_params=extras,
-                    )
-                    if ok:
-                        success = True
-                        fail_count = 0  # 登录成功后重置失败计数
-                        break
-                    if attempt < args.retries:
-                        time.sleep(args.interval)
-
-                if success:
-                    logging.info("[Network] 登录流程结束，进入下一轮监控")
-                else:
-                    logging.warning("[Network] 本轮登录失败，将在 %.1f 秒后重试", args.watch_interval)
-                time.sleep(args.watch_interval)
-            except Exception as e:
-                logging.error("[Network] 监控循环异常：%s", e)
-                time.sleep(args.watch_interval)
-    else:
-        if internet_ok(session):
-            logging.info("已联网，无需登录。")
-            return 0
-
-        portal_url = args.portal or find_captive_portal(session, probe_urls=args.probe or DEFAULT_PROBE_URLS)
-        if not portal_url:
-            logging.error("未捕获到认证重定向。可尝试指定 --probe 自定义探测URL。")
-            return 1
-
-        for attempt in range(1, args.retries + 1):
-            logging.info("开始登录尝试 %d/%d", attempt, args.retries)
-            ok = perform_login(
-                session,
-                portal_url,
-                args.username,
-                args.password,
-                user_field_override=args.user_field,
-                pass_field_override=args.pass_field,
-                extra_params=extras,
-            )
-            if ok:
-                return 0
-            if attempt < args.retries:
-                time.sleep(args.interval)
-        return 1
+        return watcher.run_watch()
+    return watcher.run_once()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared configuration store for the CLI and GUI
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+``login_config.json`` is parsed once and cached in memory, written atomically
+(temp file + rename, so a crash never leaves a half-written file), and watched
+for changes (inotify on Linux, mtime polling elsewhere) so long-running
+watchers pick up new settings without a restart.
+"""
+import os
+import sys
+import json
+import time
+import copy
+import select
+import struct
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+CONFIG_FILE = "login_config.json"
+
+
+def app_dir() -> str:
+    """Directory next to the program (the exe directory when frozen) where its files live."""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def default_config_path() -> str:
+    return os.path.join(app_dir(), CONFIG_FILE)
+
+
+def url_list(value) -> List[str]:
+    """A single URL or a list of URLs; anything else is rejected, not split into characters."""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise TypeError(f"expected a URL or a list of URLs, got {type(value).__name__}")
+    return list(value)
+
+
+class _Inotify:
+    """Minimal ctypes inotify wrapper watching one directory for a file name."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory: str):
+        # only the Linux watcher needs ctypes; keep it off the GUI startup path
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, name: str, timeout: float) -> bool:
+        """True if an event for ``name`` arrived within ``timeout`` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        target = os.fsencode(name)
+        offset = 0
+        while offset + 16 <= len(data):
+            _, _, _, length = struct.unpack_from("iIII", data, offset)
+            ev_name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            if ev_name == target:
+                return True
+            offset += 16 + length
+        return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigStore:
+    """
+    Cached, atomically written JSON config with change notification.
+
+    ``get``/``data`` never touch the disk; ``update`` merges and writes the file;
+    ``subscribe`` callbacks receive ``(old, new)`` dicts after an external edit
+    is detected by ``start_watching``.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or default_config_path()
+        self._lock = threading.RLock()
+        self._data: Dict[str, Any] = {}
+        self._stamp = None
+        self._listeners: List[Callable[[dict, dict], None]] = []
+        self._watch_thread = None
+        self._stop = threading.Event()
+        self.reload()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        """Re-read the file if it changed on disk; returns True when the cache changed."""
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            data = {}
+            if stamp is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    # keep the last good config while an editor is mid-write
+                    logging.warning("读取配置文件失败: %s", e)
+                    return False
+            self._stamp = stamp
+            if data == self._data:
+                return False
+            self._data = data
+            return True
+
+    def data(self) -> Dict[str, Any]:
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return copy.deepcopy(self._data.get(key, default))
+
+    def exists(self) -> bool:
+        return self._stamp is not None
+
+    def update(self, **changes):
+        """Merge ``changes`` into the config and write it atomically."""
+        with self._lock:
+            data = dict(self._data)
+            data.update(changes)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            tmp = os.path.join(directory, f".{os.path.basename(self.path)}.{os.getpid()}.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._data = data
+            # our own write must not be reported as an external change
+            self._stamp = self._file_stamp()
+
+    def subscribe(self, callback: Callable[[dict, dict], None]):
+        self._listeners.append(callback)
+
+    def _check(self):
+        with self._lock:
+            old = copy.deepcopy(self._data)
+            changed = self.reload()
+            new = copy.deepcopy(self._data)
+        if not changed:
+            return
+        logging.info("检测到配置文件变更，已重新加载: %s", self.path)
+        for cb in list(self._listeners):
+            try:
+                cb(old, new)
+            except Exception as e:
+                logging.error("应用配置变更失败: %s", e)
+
+    def _watch(self, poll_interval: float):
+        notifier: Optional[_Inotify] = None
+        if sys.platform.startswith("linux"):
+            try:
+                notifier = _Inotify(os.path.dirname(os.path.abspath(self.path)))
+            except (OSError, AttributeError) as e:
+                logging.debug("inotify 不可用，改用轮询: %s", e)
+        name = os.path.basename(self.path)
+        try:
+            while not self._stop.is_set():
+                if notifier:
+                    # the periodic timeout still catches anything inotify missed
+                    if notifier.wait(name, poll_interval * 5):
+                        time.sleep(0.05)  # let the writer finish its rename
+                else:
+                    self._stop.wait(poll_interval)
+                self._check()
+        finally:
+            if notifier:
+                notifier.close()
+
+    def start_watching(self, poll_interval: float = 2.0):
+        if self._watch_thread is None:
+            self._watch_thread = threading.Thread(
+                target=self._watch, args=(poll_interval,), name="config-watcher", daemon=True)
+            self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
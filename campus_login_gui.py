@@ -17,24 +17,59 @@ License: MIT
 - 不向第三方服务上传数据
 - 发布时不包含个人配置文件
 """
+import time
+
+# 启动计时起点：用于统计窗口出现/可交互耗时
+_START_TS = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import threading
-import json
+import functools
 import os
 import sys
+import random
 from datetime import datetime
 import logging
-from PIL import Image, ImageDraw
-import pystray
 import winreg  # Windows注册表操作
 
-# 导入核心登录模块
-from auto_campus_login import (
-    internet_ok, find_captive_portal, perform_login,
-    DEFAULT_PROBE_URLS, setup_logger, check_network_status
-)
-import requests
+from campus_config import ConfigStore, default_config_path, url_list
+
+# 核心登录模块（连带 requests / bs4）以及托盘依赖（PIL / pystray）较重，
+# 在窗口显示后由后台线程加载，见 CampusLoginGUI.start_background_loading；
+# 历史记录（sqlite3）和多进程选主只有监控用得到，也一并在后台加载
+core = None
+login_history = None
+process_leader = None
+
+
+# 窗口缩放时按钮重绘的防抖间隔（毫秒）
+RESIZE_DEBOUNCE_MS = 60
+
+# 勾选“会话保活”且配置中未指定 keepalive 时的初始保活间隔（秒），与 CLI 文档示例一致
+DEFAULT_KEEPALIVE_INTERVAL = 120.0
+
+# 圆角矩形顶点缓存的条目上限（缩放窗口会产生大量不同尺寸）
+ROUNDED_RECT_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=ROUNDED_RECT_CACHE_SIZE)
+def rounded_rect_points(x1, y1, x2, y2, radius):
+    """圆角矩形顶点（按尺寸缓存，重复绘制时不再重新计算）"""
+    return (
+        x1+radius, y1,
+        x2-radius, y1,
+        x2, y1,
+        x2, y1+radius,
+        x2, y2-radius,
+        x2, y2,
+        x2-radius, y2,
+        x1+radius, y2,
+        x1, y2,
+        x1, y2-radius,
+        x1, y1+radius,
+        x1, y1
+    )
 
 
 class ModernCheckbox(tk.Canvas):
@@ -46,6 +81,11 @@ class ModernCheckbox(tk.Canvas):
         self.command = command
         self.theme_colors = {}
         
+        # 图形只创建一次，之后仅通过 itemconfig 更新颜色/显隐
+        self._box = None
+        self._ticks = ()
+        self._drawn = None
+        
         # 创建文本标签
         self.label = tk.Label(parent, text=text, cursor="hand2")
         
@@ -65,6 +105,8 @@ class ModernCheckbox(tk.Canvas):
     
     def set_theme(self, colors):
         """设置主题颜色"""
+        if colors is self.theme_colors:
+            return
         self.theme_colors = colors
         self.config(bg=colors['card_bg'])
         self.label.config(
@@ -75,8 +117,7 @@ class ModernCheckbox(tk.Canvas):
         self.draw()
     
     def draw(self):
-        """绘制勾选框"""
-        self.delete("all")
+        """绘制勾选框（仅更新发生变化的颜色和勾号显隐）"""
         colors = self.theme_colors
         
         is_checked = self.variable.get()
@@ -97,32 +138,28 @@ class ModernCheckbox(tk.Canvas):
                 # 添加淡淡的背景高亮
                 fill_color = colors.get('input_bg', '#f8f9fa')
         
-        # 绘制圆角矩形（扁平化设计，边框加粗）
-        self.create_rounded_rect(2, 2, 16, 16, radius=3, fill=fill_color, outline=outline_color, width=2.5)
+        state = (fill_color, outline_color, bool(is_checked))
+        if state == self._drawn:
+            return
         
-        # 绘制勾选标记（更粗更明显）
-        if is_checked:
-            # 使用白色粗勾号
-            self.create_line(5, 9, 8, 12, fill='white', width=2.5, capstyle=tk.ROUND)
-            self.create_line(8, 12, 13, 6, fill='white', width=2.5, capstyle=tk.ROUND)
+        if self._box is None:
+            # 绘制圆角矩形（扁平化设计，边框加粗）
+            self._box = self.create_rounded_rect(2, 2, 16, 16, radius=3, fill=fill_color, outline=outline_color, width=2.5)
+            # 绘制勾选标记（使用白色粗勾号）
+            self._ticks = (
+                self.create_line(5, 9, 8, 12, fill='white', width=2.5, capstyle=tk.ROUND),
+                self.create_line(8, 12, 13, 6, fill='white', width=2.5, capstyle=tk.ROUND),
+            )
+        else:
+            self.itemconfig(self._box, fill=fill_color, outline=outline_color)
+        tick_state = 'normal' if is_checked else 'hidden'
+        for tick in self._ticks:
+            self.itemconfig(tick, state=tick_state)
+        self._drawn = state
     
     def create_rounded_rect(self, x1, y1, x2, y2, radius=4, **kwargs):
         """创建圆角矩形"""
-        points = [
-            x1+radius, y1,
-            x2-radius, y1,
-            x2, y1,
-            x2, y1+radius,
-            x2, y2-radius,
-            x2, y2,
-            x2-radius, y2,
-            x1+radius, y2,
-            x1, y2,
-            x1, y2-radius,
-            x1, y1+radius,
-            x1, y1
-        ]
-        return self.create_polygon(points, smooth=True, **kwargs)
+        return self.create_polygon(rounded_rect_points(x1, y1, x2, y2, radius), smooth=True, **kwargs)
     
     def toggle(self, event=None):
         """切换勾选状态"""
@@ -152,6 +189,14 @@ class ModernButton(tk.Canvas):
         self.is_pressed = False
         self.is_disabled = False
         
+        # 已绘制的图形：尺寸不变时只用 itemconfig 更新颜色和文字
+        self._rect = None
+        self._label = None
+        self._drawn_size = None
+        self._drawn_color = None
+        self._drawn_text = None
+        self._resize_job = None
+        
         super().__init__(parent, highlightthickness=0, **kwargs)
         
         self.bind("<Button-1>", self.on_press)
@@ -163,18 +208,27 @@ class ModernButton(tk.Canvas):
         self.bind("<Configure>", self.on_configure)
         
     def on_configure(self, event=None):
-        """窗口配置改变时重绘"""
+        """窗口配置改变时重绘（防抖：连续缩放只在停止后重建一次图形）"""
+        if event is not None and (event.width, event.height) == self._drawn_size:
+            return
+        if self._resize_job is not None:
+            self.after_cancel(self._resize_job)
+        self._resize_job = self.after(RESIZE_DEBOUNCE_MS, self._on_resize_idle)
+    
+    def _on_resize_idle(self):
+        self._resize_job = None
         self.draw()
         
     def set_theme(self, colors):
         """设置主题"""
+        if colors is self.theme_colors:
+            return
         self.theme_colors = colors
         self.config(bg=colors['bg'])
         self.draw()
     
-    def draw(self):
-        """绘制按钮"""
-        self.delete("all")
+    def current_color(self):
+        """根据样式、主题和交互状态计算当前填充色"""
         colors = self.theme_colors
         
         # 根据样式选择颜色
@@ -193,13 +247,16 @@ class ModernButton(tk.Canvas):
         
         # 应用悬停和按下效果
         if self.is_disabled:
-            current_color = colors.get('text_light', '#9ca3af')
+            return colors.get('text_light', '#9ca3af')
         elif self.is_pressed:
-            current_color = hover_color
+            return hover_color
         elif self.is_hover:
-            current_color = hover_color
-        else:
-            current_color = bg_color
+            return hover_color
+        return bg_color
+    
+    def draw(self):
+        """绘制按钮：尺寸变化时重建图形，否则只更新变化的颜色/文字"""
+        current_color = self.current_color()
         
         # 获取Canvas实际尺寸,如果未渲染则使用配置的尺寸
         width = self.winfo_width()
@@ -217,35 +274,34 @@ class ModernButton(tk.Canvas):
         if height <= 1:
             height = 40
         
-        # 绘制圆角矩形按钮
-        self.create_rounded_rect(0, 0, width, height, radius=6, fill=current_color, outline='')
+        if (width, height) != self._drawn_size:
+            self.delete("all")
+            # 绘制圆角矩形按钮
+            self._rect = self.create_rounded_rect(0, 0, width, height, radius=6, fill=current_color, outline='')
+            
+            # 绘制文字 - 使用anchor='center'确保居中
+            self._label = self.create_text(
+                width/2, height/2,
+                text=self.btn_text,
+                fill='white',
+                font=('Microsoft YaHei UI', 10, 'bold'),
+                anchor='center'
+            )
+            self._drawn_size = (width, height)
+            self._drawn_color = current_color
+            self._drawn_text = self.btn_text
+            return
         
-        # 绘制文字 - 使用anchor='center'确保居中
-        self.create_text(
-            width/2, height/2,
-            text=self.btn_text,
-            fill='white',
-            font=('Microsoft YaHei UI', 10, 'bold'),
-            anchor='center'
-        )
+        if current_color != self._drawn_color:
+            self.itemconfig(self._rect, fill=current_color)
+            self._drawn_color = current_color
+        if self.btn_text != self._drawn_text:
+            self.itemconfig(self._label, text=self.btn_text)
+            self._drawn_text = self.btn_text
     
     def create_rounded_rect(self, x1, y1, x2, y2, radius=6, **kwargs):
         """创建圆角矩形"""
-        points = [
-            x1+radius, y1,
-            x2-radius, y1,
-            x2, y1,
-            x2, y1+radius,
-            x2, y2-radius,
-            x2, y2,
-            x2-radius, y2,
-            x1+radius, y2,
-            x1, y2,
-            x1, y2-radius,
-            x1, y1+radius,
-            x1, y1
-        ]
-        return self.create_polygon(points, smooth=True, **kwargs)
+        return self.create_polygon(rounded_rect_points(x1, y1, x2, y2, radius), smooth=True, **kwargs)
     
     def on_press(self, event=None):
         """按下效果"""
@@ -351,22 +407,39 @@ class CampusLoginGUI:
         self.root.minsize(420, 580)
         self.root.resizable(True, True)
         
-        # 配置文件路径 - 修复打包后路径问题
-        if getattr(sys, 'frozen', False):
-            # 打包后的exe运行时,使用exe所在目录
-            application_path = os.path.dirname(sys.executable)
-        else:
-            # 源码运行时,使用脚本所在目录
-            application_path = os.path.dirname(__file__)
-        self.config_file = os.path.join(application_path, "login_config.json")
+        # 配置文件路径（打包后为exe所在目录）；与 CLI 共用同一配置层：只解析一次并缓存，原子写入
+        self.config_file = default_config_path()
+        self.config_store = ConfigStore(self.config_file)
         
         # 监控线程控制
         self.monitoring = False
         self.monitor_thread = None
-        self.session = requests.Session()
-        
-        # 系统托盘
+        # 登录协调器持有登录会话：并发登录请求合并为一次，后台任务使用有界线程池
+        # （网络模块在后台加载完成后创建，见 _load_backend）
+        self.coordinator = None
+        # 监控/探测用的会话（与登录会话共享 cookie，不共享连接）
+        self.session = None
+        # 网络状态共享：并发检测合并为一次探测，结果短时缓存
+        self.connectivity = None
+        self.probe_urls = None
+        self.backend_ready = threading.Event()
+        # 网络模块加载失败的原因；失败时 backend_ready 同样会被置位，等待者需检查
+        self.backend_error = None
+        self._pending_actions = []
+        # 启动各阶段耗时（毫秒）：window / backend / tray / interactive
+        self.startup_timings = {}
+        # (报告路径或 None, 是否统计CPU, 是否统计内存)，由 --profile/--trace-alloc 设置
+        self.profiling = None
+        
+        # 本地控制接口（--control 开启）
+        self.control = None
+        
+        # 系统托盘（图标在后台构建；构建完成前请求显示托盘会在就绪后补上）
+        # tray_icon/_tray_wanted/_tray_started 会被 Tk 线程和托盘构建线程同时访问，由 _tray_lock 保护
         self.tray_icon = None
+        self._tray_wanted = False
+        self._tray_started = False
+        self._tray_lock = threading.Lock()
         self.is_hidden = False
         
         # 主题管理（默认使用深色主题，与截图一致）
@@ -377,6 +450,9 @@ class CampusLoginGUI:
         self.checkboxes = []
         self.buttons = []
         self.widgets_to_theme = []
+        # 每个主题下各组件的配置项（首次应用该主题时计算），以及各组件当前已生效的配置
+        self._theme_options = {}
+        self._widget_options = {}
         
         # 设置样式
         self.setup_styles()
@@ -393,9 +469,77 @@ class CampusLoginGUI:
         # 设置窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
-        # 创建系统托盘图标
-        self.create_tray_icon()
-        
+    def start_background_loading(self):
+        """窗口显示后在后台加载网络/解析模块和托盘资源"""
+        threading.Thread(target=self._load_backend, name="gui-backend-loader", daemon=True).start()
+        threading.Thread(target=self.create_tray_icon, name="gui-tray-loader", daemon=True).start()
+    
+    def _load_backend(self):
+        """后台线程：导入核心登录模块并创建登录协调器"""
+        global core, login_history, process_leader
+        t0 = time.perf_counter()
+        try:
+            import requests
+            import auto_campus_login as core
+            import login_history
+            import process_leader
+            if self.profiling:
+                core.enable_profiling(*self.profiling)
+            login_session = requests.Session()
+            # 探测、保活、会话到期查询在监控线程里进行，与协调器线程池中的登录并发：
+            # 使用独立会话（独立连接池），只共享登录得到的 cookie，保活请求才能带上认证状态
+            monitor_session = requests.Session()
+            monitor_session.cookies = login_session.cookies
+            coordinator = core.LoginCoordinator(
+                login_session, connectivity=core.ConnectivityState(monitor_session, urls=self.probe_urls))
+        except Exception as e:
+            logging.error("加载网络模块失败: %s", e)
+            self.backend_error = str(e)
+            # 唤醒正在等待的监控线程，由它们检查 backend_error 后退出
+            self.backend_ready.set()
+            self.root.after(0, self.log, f"加载网络模块失败: {str(e)}", "ERROR")
+            return
+        coordinator.probe_urls = self.probe_urls
+        coordinator.connectivity.urls = self.probe_urls
+        self.coordinator = coordinator
+        self.session = monitor_session
+        self.connectivity = coordinator.connectivity
+        self.startup_timings['backend'] = (time.perf_counter() - t0) * 1000.0
+        self.backend_ready.set()
+        self.root.after(0, self._on_backend_ready)
+    
+    def _on_backend_ready(self):
+        """网络模块就绪（主线程）：执行加载期间排队的操作"""
+        self.log(f"网络模块已加载 ({self.startup_timings['backend']:.0f}ms)")
+        # 加载期间配置可能又变了
+        if self.coordinator.probe_urls != self.probe_urls:
+            self.set_probe_urls(self.probe_urls)
+        pending, self._pending_actions = self._pending_actions, []
+        for action in pending:
+            action()
+    
+    def when_ready(self, action):
+        """网络模块已就绪返回 True；否则把 action 排到加载完成后执行并返回 False（主线程）"""
+        if self.backend_ready.is_set():
+            if self.backend_error:
+                self.log(f"网络模块不可用: {self.backend_error}", "ERROR")
+                return False
+            return True
+        if action not in self._pending_actions:
+            self._pending_actions.append(action)
+        self.log("正在加载网络模块，稍后自动执行...")
+        return False
+    
+    def mark_interactive(self):
+        """首次进入事件循环且界面绘制完成：记录并报告可交互耗时"""
+        self.startup_timings['interactive'] = (time.perf_counter() - _START_TS) * 1000.0
+        timings = self.startup_timings
+        parts = [f"可交互 {timings['interactive']:.0f}ms"]
+        if 'window' in timings:
+            parts.insert(0, f"窗口 {timings['window']:.0f}ms")
+        self.log("启动耗时: " + "，".join(parts))
+        logging.info("[Startup] %s", timings)
+    
     def setup_styles(self):
         """设置现代化扁平样式"""
         colors = self.theme_colors
@@ -644,6 +788,28 @@ class CampusLoginGUI:
         retry_spin.pack(side=tk.LEFT)
         self.widgets_to_theme.append(('spinbox', retry_spin))
         
+        # 第二行选项：与 CLI 一致，默认关闭
+        row2 = tk.Frame(advanced_frame, bg=colors['card_bg'])
+        row2.pack(fill=tk.X)
+        self.widgets_to_theme.append(('frame', row2))
+        
+        # 会话保活（登录后定期访问认证入口，避免空闲超时被踢下线）
+        self.keepalive_var = tk.BooleanVar()
+        self.keepalive_interval = DEFAULT_KEEPALIVE_INTERVAL
+        keepalive_cb = ModernCheckbox(row2, text="会话保活", variable=self.keepalive_var)
+        keepalive_cb.pack(side=tk.LEFT)
+        keepalive_cb.label.pack(side=tk.LEFT, padx=(5, 20))
+        keepalive_cb.set_theme(colors)
+        self.checkboxes.append(keepalive_cb)
+        
+        # 记录探测/断网/登录历史（login_history.db）
+        self.history_var = tk.BooleanVar()
+        history_cb = ModernCheckbox(row2, text="记录历史", variable=self.history_var)
+        history_cb.pack(side=tk.LEFT)
+        history_cb.label.pack(side=tk.LEFT, padx=(5, 20))
+        history_cb.set_theme(colors)
+        self.checkboxes.append(history_cb)
+        
     def create_action_buttons(self, parent):
         """创建操作按钮区域"""
         colors = self.theme_colors
@@ -759,9 +925,74 @@ class CampusLoginGUI:
         # 保存主题设置
         self.save_theme_preference()
     
+    def widget_theme_options(self, widget_type, widget, colors):
+        """组件在给定主题下的配置项"""
+        if widget_type == 'label':
+            # 智能判断标签背景色：根据父组件背景选择合适的背景色
+            try:
+                parent = widget.master
+                parent_bg = parent.cget('bg') if hasattr(parent, 'cget') else colors['bg']
+            except Exception:
+                return {'bg': colors['card_bg'], 'fg': colors['text']}
+            if parent_bg == colors['card_bg']:
+                return {'bg': colors['card_bg'], 'fg': colors['text']}
+            if parent_bg == colors['input_bg']:
+                return {'bg': colors['input_bg'], 'fg': colors['text_secondary']}
+            return {'bg': colors['bg'], 'fg': colors['text']}
+        
+        if widget_type == 'entry':
+            return {
+                'bg': colors['input_bg'],
+                'fg': colors['text'],
+                'insertbackground': colors['text'],
+                'highlightbackground': colors['border'],
+                'highlightcolor': colors['primary']
+            }
+        
+        if widget_type == 'spinbox':
+            return {
+                'bg': colors['input_bg'],
+                'fg': colors['text'],
+                'buttonbackground': colors['card_bg'],
+                'readonlybackground': colors['input_bg']
+            }
+        
+        if widget_type == 'card':
+            # LabelFrame 和 卡片
+            if isinstance(widget, tk.LabelFrame):
+                return {'bg': colors['card_bg'], 'fg': colors['text']}
+            return {'bg': colors['card_bg']}
+        
+        if widget_type == 'frame':
+            # Frame 智能判断
+            try:
+                parent = widget.master
+                if not hasattr(parent, 'cget'):
+                    return {'bg': colors['bg']}
+                parent_bg = parent.cget('bg')
+            except Exception:
+                return {'bg': colors['bg']}
+            # 如果父组件是卡片背景，则使用卡片背景
+            if 'card' in str(parent.__class__.__name__).lower() or parent_bg == colors['card_bg']:
+                return {'bg': colors['card_bg']}
+            if parent_bg == colors['log_bg']:
+                return {'bg': colors['log_bg']}
+            if parent_bg == colors['input_bg']:
+                return {'bg': colors['input_bg']}
+            return {'bg': colors['bg']}
+        
+        if widget_type == 'log':
+            return {
+                'bg': colors['log_bg'],
+                'fg': colors['log_text'],
+                'insertbackground': colors['log_text']
+            }
+        return {}
+    
     def apply_theme(self):
-        """应用主题到所有组件"""
+        """应用主题到所有组件（每个组件只重新配置与当前不同的颜色）"""
         colors = self.theme_colors
+        theme_options = self._theme_options.setdefault(self.current_theme, {})
         
         # 更新根窗口和主容器
         self.root.configure(bg=colors['bg'])
@@ -770,74 +1001,14 @@ class CampusLoginGUI:
         # 更新所有存储的组件
         for widget_type, widget in self.widgets_to_theme:
             try:
-                if widget_type == 'label':
-                    # 智能判断标签背景色
-                    try:
-                        # 获取父组件背景色
-                        parent = widget.master
-                        parent_bg = parent.cget('bg') if hasattr(parent, 'cget') else colors['bg']
-                        
-                        # 根据父组件背景选择合适的背景色
-                        if parent_bg in [colors['card_bg'], self.theme_colors.get('card_bg', '#ffffff')]:
-                            widget.configure(bg=colors['card_bg'], fg=colors['text'])
-                        elif parent_bg in [colors['input_bg'], self.theme_colors.get('input_bg', '#f8f9fa')]:
-                            widget.configure(bg=colors['input_bg'], fg=colors['text_secondary'])
-                        else:
-                            widget.configure(bg=colors['bg'], fg=colors['text'])
-                    except:
-                        widget.configure(bg=colors['card_bg'], fg=colors['text'])
-                        
-                elif widget_type == 'entry':
-                    widget.configure(
-                        bg=colors['input_bg'],
-                        fg=colors['text'],
-                        insertbackground=colors['text'],
-                        highlightbackground=colors['border'],
-                        highlightcolor=colors['primary']
-                    )
-                    
-                elif widget_type == 'spinbox':
-                    widget.configure(
-                        bg=colors['input_bg'],
-                        fg=colors['text'],
-                        buttonbackground=colors['card_bg'],
-                        readonlybackground=colors['input_bg']
-                    )
-                    
-                elif widget_type == 'card':
-                    # LabelFrame 和 卡片
-                    if isinstance(widget, tk.LabelFrame):
-                        widget.configure(bg=colors['card_bg'], fg=colors['text'])
-                    else:
-                        widget.configure(bg=colors['card_bg'])
-                        
-                elif widget_type == 'frame':
-                    # Frame 智能判断
-                    try:
-                        parent = widget.master
-                        if hasattr(parent, 'cget'):
-                            parent_bg = parent.cget('bg')
-                            # 如果父组件是卡片背景，则使用卡片背景
-                            if 'card' in str(parent.__class__.__name__).lower() or parent_bg == colors['card_bg']:
-                                widget.configure(bg=colors['card_bg'])
-                            elif parent_bg == colors['log_bg']:
-                                widget.configure(bg=colors['log_bg'])
-                            elif parent_bg == colors['input_bg']:
-                                widget.configure(bg=colors['input_bg'])
-                            else:
-                                widget.configure(bg=colors['bg'])
-                        else:
-                            widget.configure(bg=colors['bg'])
-                    except:
-                        widget.configure(bg=colors['bg'])
-                        
-                elif widget_type == 'log':
-                    widget.configure(
-                        bg=colors['log_bg'],
-                        fg=colors['log_text'],
-                        insertbackground=colors['log_text']
-                    )
-                    
+                options = theme_options.get(widget)
+                if options is None:
+                    options = theme_options[widget] = self.widget_theme_options(widget_type, widget, colors)
+                applied = self._widget_options.get(widget, {})
+                changed = {k: v for k, v in options.items() if applied.get(k) != v}
+                if changed:
+                    widget.configure(**changed)
+                    self._widget_options[widget] = options
             except Exception as e:
                 # 静默跳过错误，避免中断主题应用
                 pass
@@ -859,13 +1030,7 @@ class CampusLoginGUI:
     def save_theme_preference(self):
         """保存主题偏好"""
         try:
-            config = {}
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-            config['theme'] = self.current_theme
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2)
+            self.config_store.update(theme=self.current_theme)
         except:
             pass
     
@@ -911,10 +1076,13 @@ class CampusLoginGUI:
         
     def check_network_status(self):
         """检测网络状态"""
+        if not self.when_ready(self.check_network_status):
+            return
+        
         def check():
             self.log("正在检测网络状态...")
             colors = self.theme_colors
-            if internet_ok(self.session):
+            if self.connectivity.check():
                 self.status_label.config(
                     text="● 网络正常",
                     fg=colors['status_online']
@@ -927,7 +1095,7 @@ class CampusLoginGUI:
                 )
                 self.log("网络未连接或需要认证", "WARNING")
                 
-        threading.Thread(target=check, daemon=True).start()
+        self.coordinator.submit(check)
         
     def perform_login(self):
         """执行登录"""
@@ -937,67 +1105,61 @@ class CampusLoginGUI:
         if not username or not password:
             messagebox.showwarning("输入错误", "请输入用户名和密码！")
             return
+        
+        if not self.when_ready(self.perform_login):
+            return
+        retries = self._retry_count()
             
         # 保存配置
         if self.remember_var.get():
             self.save_config()
             
-        def login_thread():
-            self.login_btn.set_state('disabled')
-            self.login_btn.set_text("登录中...")
-            self.log(f"开始登录，用户名: {username}")
-            
-            try:
-                # 检查网络
-                if internet_ok(self.session):
-                    self.log("已联网，无需登录", "INFO")
-                    messagebox.showinfo("提示", "网络已连接！")
-                    return
-                    
-                # 查找认证入口
-                self.log("正在查找认证入口...")
-                portal_url = find_captive_portal(self.session, DEFAULT_PROBE_URLS)
-                
-                if not portal_url:
-                    self.log("未找到认证入口", "ERROR")
-                    messagebox.showerror("错误", "未找到认证入口！")
-                    return
-                    
-                self.log(f"找到认证入口: {portal_url}")
-                
-                # 执行登录
-                retry_count = int(self.retry_var.get())
-                for attempt in range(1, retry_count + 1):
-                    self.log(f"第 {attempt}/{retry_count} 次尝试登录...")
-                    
-                    success = perform_login(
-                        self.session,
-                        portal_url,
-                        username,
-                        password
-                    )
-                    
-                    if success:
-                        self.log("登录成功！", "INFO")
-                        colors = self.theme_colors
-                        self.status_label.config(
-                            text="● 已连接",
-                            fg=colors['status_online']
-                        )
-                        messagebox.showinfo("成功", "登录成功！")
-                        return
-                        
+        self.login_btn.set_state('disabled')
+        self.login_btn.set_text("登录中...")
+        self.log(f"开始登录，用户名: {username}")
+        # 由登录协调器执行：与监控/托盘触发的登录合并，不会重复提交
+        future = self.coordinator.ensure_login(username, password, retries=retries)
+        future.add_done_callback(lambda f: self.root.after(0, self._on_login_done, f))
+    
+    def _retry_count(self):
+        """重试次数输入框的值（1~10）；手动输入了非数字时回退为 3 并纠正输入框"""
+        try:
+            retries = min(10, max(1, int(self.retry_var.get())))
+        except (TypeError, ValueError, tk.TclError):
+            self.log(f"重试次数无效: {self.retry_var.get()!r}，使用默认值 3", "WARNING")
+            retries = 3
+        if self.retry_var.get() != str(retries):
+            self.retry_var.set(str(retries))
+        return retries
+        
+    def _on_login_done(self, future):
+        """登录流程结束（主线程回调）"""
+        try:
+            outcome, portal_url = future.result()
+            if outcome == core.LOGIN_ALREADY_ONLINE:
+                self.log("已联网，无需登录", "INFO")
+                messagebox.showinfo("提示", "网络已连接！")
+            elif outcome == core.LOGIN_NO_PORTAL:
+                self.log("未找到认证入口", "ERROR")
+                messagebox.showerror("错误", "未找到认证入口！")
+            elif outcome == core.LOGIN_OK:
+                self.log("登录成功！", "INFO")
+                colors = self.theme_colors
+                self.status_label.config(
+                    text="● 已连接",
+                    fg=colors['status_online']
+                )
+                messagebox.showinfo("成功", "登录成功！")
+            else:
                 self.log("登录失败，请检查用户名和密码", "ERROR")
                 messagebox.showerror("失败", "登录失败！请检查账号密码。")
-                
-            except Exception as e:
-                self.log(f"登录出错: {str(e)}", "ERROR")
-                messagebox.showerror("错误", f"登录出错：{str(e)}")
-            finally:
+        except Exception as e:
+            self.log(f"登录出错: {str(e)}", "ERROR")
+            messagebox.showerror("错误", f"登录出错：{str(e)}")
+        finally:
+            if not self.monitoring:
                 self.login_btn.set_state('normal')
-                self.login_btn.set_text("立即登录")
-                
-        threading.Thread(target=login_thread, daemon=True).start()
+            self.login_btn.set_text("立即登录")
         
     def toggle_monitoring(self):
         """切换监控状态"""
@@ -1026,18 +1188,115 @@ class CampusLoginGUI:
         self.login_btn.set_state('disabled')
         
         self.log("开始网络监控...", "INFO")
+        # 在主线程读取界面选项，本次监控期间不变
+        keepalive_interval = self.keepalive_interval if self.keepalive_var.get() else 0
+        use_history = self.history_var.get()
         
         def monitor_loop():
-            import time
+            # 开机自启时监控可能早于网络模块加载完成
+            self.backend_ready.wait()
+            if self.backend_error:
+                self.root.after(0, self.log, f"网络模块不可用，无法监控: {self.backend_error}", "ERROR")
+                self.root.after(0, self.stop_monitoring)
+                return
             fail_count = 0
+            # 登录成功后记住认证入口，定期保活避免会话空闲超时
+            keepalive = core.PortalKeepalive(self.session, interval=keepalive_interval) if keepalive_interval else None
+            # 会话到期前提前续期，避免被强制下线
+            expiry = core.SessionExpiry(self.session)
+            last_portal = None
+            # 记录探测/断网/登录历史（失败不影响监控）
+            history = None
+            if use_history:
+                try:
+                    history = login_history.HistoryStore(source="gui")
+                except Exception as e:
+                    self.log(f"历史记录不可用: {str(e)}", "WARNING")
+
+            # 分层探测：网络正常时每次只需一次 TCP 握手，异常/可疑时才做完整 HTTP 探测
+            liveness = core.LivenessPipeline(self.session, urls=self.probe_urls)
+
+            def probe():
+                t0 = time.perf_counter()
+                liveness.urls = self.probe_urls
+                with core.profile_section("probe"):
+                    ok = liveness.check()
+                # 结果同步给按钮/托盘的网络检测
+                self.connectivity.set(ok)
+                latency_ms = (time.perf_counter() - t0) * 1000.0
+                if history:
+                    history.record_probe(ok, latency_ms)
+                leader.publish(online=ok, latency_ms=latency_ms, source="gui")
+                if self.control:
+                    self.control.record_probe(ok, latency_ms)
+                    self.control.update(liveness=liveness.snapshot())
+                return ok
+
+            self.coordinator.history = history
+            # 多进程选主：同一时间只有一个 CLI/GUI 进程负责探测和登录
+            leader = process_leader.LeaderLock()
+            following = False
+            # 登录失败后按指数退避（带随机抖动、遵守认证服务器的 Retry-After）重试
+            round_backoff = core.LoginBackoff(5)
+
+            def login(portal_url=None):
+                future = self.coordinator.ensure_login(
+                    username, password, portal_url=portal_url, check_first=False)
+                result = future.result()
+                # 登录后（无论成败）下一次探测直接走完整 HTTP 探测
+                liveness.invalidate()
+                return result
+
             while self.monitoring:
                 try:
-                    if check_network_status(self.session):
+                    if not leader.try_acquire():
+                        # 跟随模式：读取主进程共享的网络状态，不产生额外流量
+                        state = leader.read_state(max_age=60)
+                        if not following:
+                            pid = state.get('pid') if state else '?'
+                            self.log(f"已有其他进程 (PID {pid}) 在监控，本程序转为跟随模式", "INFO")
+                            following = True
+                        if state:
+                            colors = self.theme_colors
+                            if state.get('online'):
+                                self.status_label.config(text="● 网络正常", fg=colors['status_online'])
+                            else:
+                                self.status_label.config(text="● 未连接", fg=colors['status_offline'])
+                        if self.control and state:
+                            self.control.update(role="follower", online=state.get('online'),
+                                                latency_ms=state.get('latency_ms'), last_probe_ts=state.get('ts'))
+                        time.sleep(core.FOLLOWER_POLL_INTERVAL)
+                        continue
+                    if following:
+                        self.log("主监控进程已退出，本程序接管监控", "INFO")
+                        following = False
+                        if self.control:
+                            self.control.update(role="leader")
+
+                    if self.control and self.control.paused:
+                        self.control.sleep(20)
+                        continue
+
+                    if last_portal and expiry.renewal_due():
+                        self.log("会话即将到期，提前重新登录", "INFO")
+                        if login(last_portal)[0] in (core.LOGIN_OK, core.LOGIN_ALREADY_ONLINE):
+                            expiry.renewed(last_portal)
+                        else:
+                            expiry.deadline = None
+                        # 两次续期之间至少间隔一个检测周期
+                        time.sleep(core.jittered(20))
+                        continue
+
+                    if probe():
                         if fail_count > 0:
                             self.log("网络恢复，重置失败计数", "INFO")
                         fail_count = 0
-                        # 网络正常，等待20秒后重新检测
-                        time.sleep(20)
+                        round_backoff.reset()
+                        # 网络正常，约20秒（或到下次保活）后重新检测；随机抖动避免多台机器同步探测
+                        wait = min(core.jittered(20), expiry.seconds_until_renewal())
+                        if keepalive:
+                            wait = min(wait, keepalive.tick())
+                        time.sleep(wait)
                         continue
 
                     # 网络检测失败，增加失败计数
@@ -1046,31 +1305,46 @@ class CampusLoginGUI:
 
                     # 只有连续3次失败才触发重连
                     if fail_count < 3:
-                        time.sleep(5)  # 等待5秒后重新检测
+                        time.sleep(core.jittered(5))  # 约5秒后重新检测
                         continue
 
                     self.log("连续3次检测失败，触发重新登录", "WARNING")
+                    # 同一网段的机器往往同时掉线：随机错开登录时刻
+                    time.sleep(random.uniform(0, core.LOGIN_SPLAY))
 
-                    portal_url = find_captive_portal(self.session, DEFAULT_PROBE_URLS)
-                    if portal_url:
-                        success = perform_login(
-                            self.session,
-                            portal_url,
-                            username,
-                            password
-                        )
-                        if success:
-                            self.log("自动登录成功", "INFO")
-                            fail_count = 0  # 登录成功后重置失败计数
-                        else:
-                            self.log("自动登录失败", "WARNING")
-                    else:
+                    outcome, portal_url = login()
+                    if keepalive and outcome in (core.LOGIN_OK, core.LOGIN_FAILED):
+                        # 找到了认证页：是认证服务器把会话踢下线，而不是上游断网
+                        keepalive.record_drop()
+                    if outcome == core.LOGIN_OK:
+                        self.log("自动登录成功", "INFO")
+                        fail_count = 0  # 登录成功后重置失败计数
+                        round_backoff.reset()
+                        if keepalive:
+                            keepalive.remember(portal_url)
+                        last_portal = portal_url
+                        expiry.refresh(portal_url)
+                        time.sleep(core.jittered(5))
+                        continue
+                    if outcome == core.LOGIN_ALREADY_ONLINE:
+                        # 合并进了按钮/控制接口发起的登录流程，它发现网络已经正常
+                        self.log("网络已恢复，无需登录", "INFO")
+                        fail_count = 0
+                        round_backoff.reset()
+                        time.sleep(core.jittered(5))
+                        continue
+                    if outcome == core.LOGIN_NO_PORTAL:
                         self.log("未捕获到认证重定向", "WARNING")
-
-                    time.sleep(5)  # 每5秒检测一次
+                    else:
+                        self.log("自动登录失败", "WARNING")
+                    time.sleep(round_backoff.next_delay(self.coordinator.retry_after))
                 except Exception as e:
                     self.log(f"监控出错: {str(e)}", "ERROR")
                     time.sleep(5)
+            self.coordinator.history = None
+            leader.release()
+            if history:
+                history.close()
                     
         self.monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
         self.monitor_thread.start()
@@ -1092,12 +1366,15 @@ class CampusLoginGUI:
             'remember': self.remember_var.get(),
             'auto_reconnect': self.auto_reconnect_var.get(),
             'retry': self.retry_var.get(),
+            'keepalive': self.keepalive_interval if self.keepalive_var.get() else 0,
+            'history': self.history_var.get(),
             'theme': self.current_theme
         }
+        if self.probe_urls:
+            config['probe_urls'] = self.probe_urls
         
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2)
+            self.config_store.update(**config)
             self.log("配置已保存", "INFO")
             
             # 设置Windows开机自启
@@ -1113,16 +1390,20 @@ class CampusLoginGUI:
             
     def load_config(self):
         """加载配置"""
-        if os.path.exists(self.config_file):
+        if self.config_store.exists():
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
+                config = self.config_store.data()
                     
                 self.username_var.set(config.get('username', ''))
                 self.password_var.set(config.get('password', ''))
                 self.remember_var.set(config.get('remember', False))
                 self.auto_reconnect_var.set(config.get('auto_reconnect', False))
                 self.retry_var.set(config.get('retry', '3'))
+                self.set_keepalive(config.get('keepalive'))
+                self.history_var.set(bool(config.get('history', False)))
+                
+                # 自定义探测站点（按健康度动态排序）
+                self.set_probe_urls(config.get('probe_urls') or None)
                 
                 # 加载主题设置（默认深色主题）
                 theme = config.get('theme', 'dark')
@@ -1147,6 +1428,93 @@ class CampusLoginGUI:
                         
             except Exception as e:
                 self.log(f"加载配置失败: {str(e)}", "ERROR")
+        
+        # 监听配置文件变更（外部编辑或 CLI 修改），无需重启即可生效
+        self.config_store.subscribe(lambda old, new: self.root.after(0, self._apply_config_change, old, new))
+        self.config_store.start_watching()
+    
+    def _apply_config_change(self, old, new):
+        """应用外部修改的配置（主线程）"""
+        if new.get('retry') is not None and new.get('retry') != old.get('retry'):
+            self.retry_var.set(new['retry'])
+            self.log(f"重试次数已更新为 {new['retry']}", "INFO")
+        if new.get('probe_urls') != old.get('probe_urls'):
+            if self.set_probe_urls(new.get('probe_urls') or None):
+                self.log("探测站点列表已更新", "INFO")
+        if new.get('keepalive') != old.get('keepalive'):
+            if self.set_keepalive(new.get('keepalive')):
+                self.log("会话保活设置已更新，下次开始监控时生效", "INFO")
+        if new.get('history') != old.get('history'):
+            self.history_var.set(bool(new.get('history', False)))
+            self.log("历史记录设置已更新，下次开始监控时生效", "INFO")
+    
+    def set_keepalive(self, value):
+        """按配置项 keepalive（秒，0 或缺省表示关闭，与 CLI 相同）设置保活选项；值无效时返回 False"""
+        if value in (None, ""):
+            value = 0
+        try:
+            interval = float(value)
+        except (TypeError, ValueError):
+            self.log(f"配置项 keepalive 的值无效: {value!r}", "WARNING")
+            return False
+        if interval > 0:
+            self.keepalive_interval = interval
+        self.keepalive_var.set(interval > 0)
+        return True
+    
+    def set_probe_urls(self, probe_urls):
+        """更新探测站点（值无效时返回 False）；网络模块尚未加载时在加载完成后生效"""
+        if probe_urls:
+            try:
+                probe_urls = url_list(probe_urls)
+            except TypeError as e:
+                # 与 CLI 一致：无效的配置项不生效，保留当前探测站点
+                self.log(f"配置项 probe_urls 的值无效: {e}", "WARNING")
+                return False
+        self.probe_urls = probe_urls or None
+        if self.coordinator:
+            self.coordinator.probe_urls = self.probe_urls
+            self.connectivity.urls = self.probe_urls
+            self.connectivity.invalidate()
+        return True
+    
+    def start_control(self, address):
+        """开启本地控制接口（状态查询 / 触发登录 / 暂停恢复监控）"""
+        # 只在 --control 时导入（http.server 等），不拖慢普通启动
+        import local_control
+        address = address or local_control.DEFAULT_CONTROL_ADDRESS
+        self.control = local_control.ControlState(source="gui")
+        # 触发登录直接交给登录协调器，与其他登录请求合并
+        self.control.login_handler = self._control_login
+        try:
+            local_control.start_control_server(self.control, address)
+            self.log(f"本地控制接口已启动: {address}", "INFO")
+        except Exception as e:
+            self.control = None
+            self.log(f"本地控制接口启动失败: {str(e)}", "ERROR")
+    
+    def _control_login(self):
+        """控制接口：触发登录（在 HTTP 服务线程中调用，转交主线程，立即返回）"""
+        self.root.after(0, self._control_login_main)
+    
+    def _control_login_main(self):
+        """控制接口触发的登录（主线程，后台执行，不弹窗）"""
+        if not self.when_ready(self._control_login_main):
+            return
+        username = self.username_var.get().strip()
+        password = self.password_var.get().strip()
+        if not username or not password:
+            self.log("控制接口请求登录，但未填写账号密码", "WARNING")
+            return
+        
+        def done(future):
+            outcome, portal_url = future.result()
+            self.control.update(last_login={'ts': datetime.now().timestamp(), 'outcome': outcome,
+                                            'portal': portal_url})
+            self.root.after(0, self.log, f"控制接口触发的登录结束: {outcome}", "INFO")
+        
+        future = self.coordinator.ensure_login(username, password, retries=self._retry_count())
+        future.add_done_callback(done)
     
     def _auto_start_monitoring(self):
         """自动启动监控（内部方法）"""
@@ -1214,7 +1582,15 @@ class CampusLoginGUI:
     
     
     def create_tray_icon(self):
-        """创建系统托盘图标"""
+        """创建系统托盘图标（后台线程，延迟导入 PIL / pystray）"""
+        t0 = time.perf_counter()
+        try:
+            from PIL import Image, ImageDraw
+            import pystray
+        except Exception as e:
+            logging.error("加载托盘组件失败: %s", e)
+            return
+        
         def create_icon_image():
             width = 64
             height = 64
@@ -1245,24 +1621,37 @@ class CampusLoginGUI:
         )
         
         icon_image = create_icon_image()
-        self.tray_icon = pystray.Icon(
+        icon = pystray.Icon(
             "campus_login",
             icon_image,
             "校园网自动登录",
             menu
         )
+        self.startup_timings['tray'] = (time.perf_counter() - t0) * 1000.0
+        with self._tray_lock:
+            self.tray_icon = icon
+            wanted = self._tray_wanted
+        if wanted:
+            self.start_tray_icon()
     
     def start_tray_icon(self):
-        """在后台线程中启动托盘图标"""
-        if self.tray_icon:
-            threading.Thread(target=self.tray_icon.run, daemon=True).start()
+        """在后台线程中启动托盘图标（只启动一次）；图标尚未构建好时在构建完成后启动"""
+        with self._tray_lock:
+            if self._tray_started:
+                return
+            if self.tray_icon is None:
+                self._tray_wanted = True
+                return
+            self._tray_wanted = False
+            self._tray_started = True
+            icon = self.tray_icon
+        threading.Thread(target=icon.run, daemon=True).start()
     
     def hide_window(self):
         """隐藏窗口到系统托盘"""
         self.root.withdraw()
         self.is_hidden = True
-        if self.tray_icon and not self.tray_icon.visible:
-            self.start_tray_icon()
+        self.start_tray_icon()
         self.log("程序已最小化到系统托盘", "INFO")
     
     def show_window(self, icon=None, item=None):
@@ -1325,6 +1714,10 @@ class CampusLoginGUI:
         if self.tray_icon:
             self.tray_icon.stop()
         
+        if self.coordinator:
+            self.coordinator.shutdown()
+        self.config_store.stop_watching()
+        
         self.root.quit()
         self.root.destroy()
 
@@ -1335,6 +1728,11 @@ def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='校园网自动登录工具')
     parser.add_argument('--startup', action='store_true', help='开机启动模式(隐藏窗口)')
+    parser.add_argument('--control', nargs='?', const='', default=None,
+                        metavar='ADDR', help='开启本地控制接口（host:port 或 unix:/path，默认 127.0.0.1:8765）')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='FILE',
+                        help='统计探测/认证页发现/登录各阶段的耗时函数，退出时写入报告')
+    parser.add_argument('--trace-alloc', action='store_true', help='统计各阶段的内存峰值和分配位置')
     args = parser.parse_args()
     
     root = tk.Tk()
@@ -1347,31 +1745,32 @@ def main():
         pass
         
     app = CampusLoginGUI(root)
+    if args.profile is not None or args.trace_alloc:
+        app.profiling = (args.profile or None, args.profile is not None, args.trace_alloc)
+    if args.control is not None:
+        app.start_control(args.control)
     
-    # 居中显示
-    root.update_idletasks()
-    width = root.winfo_width()
-    height = root.winfo_height()
-    x = (root.winfo_screenwidth() // 2) - (width // 2)
-    y = (root.winfo_screenheight() // 2) - (height // 2)
-    root.geometry(f'{width}x{height}+{x}+{y}')
+    if args.startup and app.config_store.get('auto_reconnect', False):
+        # 开机启动模式且配置了自动启动：窗口不显示，只启动托盘
+        root.withdraw()
+        app.is_hidden = True
+        app.log("开机启动模式:已最小化到系统托盘", "INFO")
+    else:
+        # 居中显示
+        root.update_idletasks()
+        width = root.winfo_width()
+        height = root.winfo_height()
+        x = (root.winfo_screenwidth() // 2) - (width // 2)
+        y = (root.winfo_screenheight() // 2) - (height // 2)
+        root.geometry(f'{width}x{height}+{x}+{y}')
+    app.startup_timings['window'] = (time.perf_counter() - _START_TS) * 1000.0
     
-    # 启动系统托盘
+    # 启动系统托盘（图标在后台构建完成后显示）
     app.start_tray_icon()
     
-    # 如果是开机启动模式且配置了自动启动,则隐藏窗口
-    if args.startup:
-        # 读取配置检查是否启用了开机自启
-        if os.path.exists(app.config_file):
-            try:
-                with open(app.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    if config.get('auto_reconnect', False):
-                        # 延迟隐藏窗口,确保托盘图标已创建
-                        root.after(500, app.hide_window)
-                        app.log("开机启动模式:已最小化到系统托盘", "INFO")
-            except:
-                pass
+    # 先让窗口完成首次绘制，再在后台加载网络模块和托盘资源
+    root.after_idle(app.mark_interactive)
+    root.after_idle(app.start_background_loading)
     
     root.mainloop()
 
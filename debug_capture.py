@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background capture of portal traffic for troubleshooting
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+When a portal changes, the pages and login responses it returned are the only
+way to see what broke. ``DebugCapture.capture`` only puts a reference to the
+response into a bounded queue (dropping captures when full, never blocking the
+login); a daemon thread serialises, redacts and gzips them into size-capped,
+rotated JSON Lines archives:
+
+    debug_captures/capture-20250101-120000.jsonl.gz
+
+Each line holds the request method/URL/body, the response status, headers,
+final URL, elapsed time and (truncated) body. Password fields, cookies and
+authorization headers are masked before anything reaches the disk.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from typing import Callable
+
+from campus_config import app_dir
+
+CAPTURE_DIR = "debug_captures"
+
+_SECRET_KEY_RE = re.compile(r"pass|pwd", re.I)
+_SECRET_HEADERS = {"cookie", "set-cookie", "authorization", "proxy-authorization"}
+_URL_HEADERS = {"referer", "location", "content-location"}
+
+
+def redact_mapping(d: dict, redact: Callable[[dict], dict] = None) -> dict:
+    """Apply ``redact`` (e.g. redact_payload) and mask any key that looks like a password."""
+    out = redact(d) if redact else dict(d)
+    for k in out:
+        if k and _SECRET_KEY_RE.search(k):
+            out[k] = "***"
+    return out
+
+
+def redact_url(url: str, redact: Callable[[dict], dict] = None) -> str:
+    parts = urlsplit(url or "")
+    if not parts.query:
+        return url
+    query = redact_mapping(dict(parse_qsl(parts.query, keep_blank_values=True)), redact)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def redact_body(body, content_type: str, redact: Callable[[dict], dict] = None):
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    if not isinstance(body, str):
+        return f"<{type(body).__name__}>"
+    if "json" in content_type:
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict):
+            return json.dumps(redact_mapping(obj, redact), ensure_ascii=False)
+    elif "=" in body:
+        return urlencode(redact_mapping(dict(parse_qsl(body, keep_blank_values=True)), redact))
+    # unknown encodings may carry credentials; keep only the size
+    return f"<{len(body)} chars>"
+
+
+def redact_headers(headers, redact: Callable[[dict], dict] = None, keep_cookies: bool = False) -> dict:
+    out = {}
+    for k, v in (headers or {}).items():
+        low = k.lower()
+        if low in _SECRET_HEADERS and not (keep_cookies and "cookie" in low):
+            v = "***"
+        elif low in _URL_HEADERS:
+            # redirect URLs may carry credentials in their query string
+            v = redact_url(v, redact)
+        out[k] = v
+    return out
+
+
+def default_capture_dir() -> str:
+    """Captures live next to the program, like login_config.json."""
+    return os.path.join(app_dir(), CAPTURE_DIR)
+
+
+class DebugCapture:
+    """
+    Bounded, asynchronous, compressed capture writer.
+
+    At most ``max_archives`` archives of about ``max_archive_bytes`` (compressed)
+    each are kept; the oldest is deleted when a new one is started.
+    """
+
+    def __init__(self, directory: str = None, redact: Callable[[dict], dict] = None,
+                 max_queue: int = 64, max_body_bytes: int = 256 * 1024,
+                 max_archive_bytes: int = 2 * 1024 * 1024, max_archives: int = 5):
+        self.directory = directory or default_capture_dir()
+        self.redact = redact
+        self.max_body_bytes = max_body_bytes
+        self.max_archive_bytes = max_archive_bytes
+        self.max_archives = max_archives
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._raw = None
+        self._gz = None
+        self._closed = False
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._writer, name="debug-capture", daemon=True)
+        self._thread.start()
+
+    def capture(self, resp, tag: str = ""):
+        """Queue ``resp`` for writing; never blocks and never raises."""
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait((time.time(), tag, resp))
+        except queue.Full:
+            self.dropped += 1
+
+    # -- writer thread -------------------------------------------------------
+
+    def _record(self, ts: float, tag: str, resp) -> dict:
+        req = resp.request
+        content = resp.content or b""
+        encoding = resp.encoding or "utf-8"
+        redact = self.redact
+        return {
+            "ts": ts,
+            "tag": tag,
+            "method": req.method if req else None,
+            "url": redact_url(req.url if req else resp.url, redact),
+            "request_headers": redact_headers(req.headers if req else None, redact),
+            "request_body": redact_body(req.body if req else None,
+                                        (req.headers or {}).get("Content-Type", "") if req else "", redact),
+            "status": resp.status_code,
+            "final_url": redact_url(resp.url, redact),
+            "redirects": [redact_url(r.url, redact) for r in resp.history],
+            "elapsed_ms": resp.elapsed.total_seconds() * 1000.0 if resp.elapsed else None,
+            "headers": redact_headers(resp.headers, redact),
+            "body": content[:self.max_body_bytes].decode(encoding, "replace"),
+            "truncated": len(content) > self.max_body_bytes,
+        }
+
+    def _open_archive(self):
+        self._close_archive()
+        archives = sorted(fn for fn in os.listdir(self.directory)
+                          if fn.startswith("capture-") and fn.endswith(".jsonl.gz"))
+        for fn in archives[:max(0, len(archives) - self.max_archives + 1)]:
+            try:
+                os.remove(os.path.join(self.directory, fn))
+            except OSError:
+                pass
+        name = f"capture-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz"
+        self._raw = open(os.path.join(self.directory, name), "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+
+    def _close_archive(self):
+        if self._gz is not None:
+            self._gz.close()
+            self._raw.close()
+            self._gz = self._raw = None
+
+    def _write(self, lines):
+        if self._gz is None or self._raw.tell() >= self.max_archive_bytes:
+            self._open_archive()
+        for line in lines:
+            self._gz.write(line)
+        self._gz.flush()
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # drain whatever else is waiting so one flush covers the burst
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(i is None for i in batch)
+            lines = []
+            for i in batch:
+                if i is None:
+                    continue
+                try:
+                    lines.append((json.dumps(self._record(*i), ensure_ascii=False) + "\n").encode("utf-8"))
+                except Exception as e:
+                    logging.debug("[Capture] 序列化响应失败: %s", e)
+            if lines:
+                try:
+                    self._write(lines)
+                except OSError as e:
+                    logging.warning("[Capture] 写入调试抓包失败: %s", e)
+            if stop:
+                self._close_archive()
+                return
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self.dropped:
+            logging.info("[Capture] 队列已满，丢弃 %d 条抓包", self.dropped)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fleet-scale load test of the watch loop against a stand-in portal
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+Simulates a campus-wide portal outage ending: hundreds of watchers, all logged
+out at the same instant, run the watch loop (probe -> 3 failures -> splay ->
+discovery -> login with backoff) against a local portal that only accepts a
+limited number of concurrent / per-second logins and answers 503/429 with
+Retry-After beyond that. Reports the fleet-wide time to recover, so splay,
+jitter and backoff settings can be compared with the old fixed cadence:
+
+    python auto_campus_login.py loadtest --watchers 300 --compare
+
+Time is compressed by ``--time-scale`` (0.1 = ten times faster than real
+time); all durations given on the command line and printed in the report are
+in portal (uncompressed) seconds. HTTP timeouts are the exception and are
+applied as given.
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+import requests
+
+import auto_campus_login as core
+
+PORTAL_PAGE = (b"<html><head><title>Portal</title></head><body>"
+               b"<form action=\"/login\" method=\"post\">"
+               b"<input name=\"username\"><input type=\"password\" name=\"password\">"
+               b"<input type=\"submit\" value=\"Login\"></form></body></html>")
+
+
+class _PortalServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # every watcher may connect at once; the default backlog of 5 would turn that into connect timeouts
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # watchers that timed out hang up mid-reply; that is part of the overload being simulated
+        pass
+
+
+class StandInPortal:
+    """
+    Local HTTP portal with the overload behaviour of a real one.
+
+    ``/probe`` redirects unauthenticated watchers to ``/portal``. The login page
+    and ``POST /login`` share ``capacity`` workers (a login takes ``service``
+    seconds, the page a fifth of that); requests beyond that queue, and once
+    ``backlog`` are queued the portal answers 503. Logins beyond ``rate`` per
+    second are answered 429. Both carry ``Retry-After: retry_after``. Work for
+    watchers that already gave up is still done, as on a real server.
+    Watchers are told apart by the ``X-Watcher`` header, as a real portal would
+    use their IP address.
+    """
+
+    def __init__(self, capacity: int = 20, rate: float = 10.0, service: float = 0.5, backlog: int = 40,
+                 retry_after: float = 10.0, scale: float = 1.0):
+        self.capacity = capacity
+        self.rate = rate
+        self.service = service
+        self.backlog = backlog
+        self.retry_after = retry_after
+        self.scale = scale
+        self.authenticated = set()
+        self.counts = {"probes": 0, "pages": 0, "logins": 0, "accepted": 0, "duplicate": 0,
+                       "busy": 0, "rate_limited": 0}
+        self.peak_active = 0
+        self.peak_queued = 0
+        self._active = 0
+        self._queued = 0
+        self._tokens = float(max(1.0, rate))
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self._free = threading.Condition(self._lock)
+        self._server = _PortalServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-in-portal", daemon=True)
+
+    def start(self) -> "StandInPortal":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _rate_limited(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            # portal seconds elapsed = wall seconds / scale
+            self._tokens = min(max(1.0, self.rate),
+                               self._tokens + (now - self._refilled) / self.scale * self.rate)
+            self._refilled = now
+            if self._tokens < 1.0:
+                self.counts["rate_limited"] += 1
+                return True
+            self._tokens -= 1.0
+            return False
+
+    def _acquire(self) -> bool:
+        """Wait for a worker; False (-> 503) when the queue is already full."""
+        with self._free:
+            if self._active >= self.capacity and self._queued >= self.backlog:
+                self.counts["busy"] += 1
+                return False
+            self._queued += 1
+            self.peak_queued = max(self.peak_queued, self._queued)
+            while self._active >= self.capacity:
+                self._free.wait()
+            self._queued -= 1
+            self._active += 1
+            self.peak_active = max(self.peak_active, self._active)
+            return True
+
+    def _release(self):
+        with self._free:
+            self._active -= 1
+            self._free.notify()
+
+    def _handler(self):
+        portal = self
+        throttled_body = b"<html><body>busy, try again later</body></html>"
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes = b"", headers: Dict[str, str] = None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _throttled(self, status: int):
+                self._reply(status, throttled_body, {"Retry-After": f"{portal.retry_after * portal.scale:.3f}"})
+
+            def do_GET(self):
+                watcher = self.headers.get("X-Watcher")
+                if self.path.startswith("/probe"):
+                    with portal._lock:
+                        portal.counts["probes"] += 1
+                        online = watcher in portal.authenticated
+                    if online:
+                        self._reply(200, b"<html><body>ok</body></html>")
+                    else:
+                        self._reply(302, headers={"Location": f"{portal.url}/portal"})
+                elif self.path.startswith("/portal"):
+                    with portal._lock:
+                        portal.counts["pages"] += 1
+                    if not portal._acquire():
+                        self._throttled(503)
+                        return
+                    try:
+                        time.sleep(portal.service * portal.scale / 5)
+                    finally:
+                        portal._release()
+                    self._reply(200, PORTAL_PAGE)
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode("utf-8", "replace"))
+                watcher = self.headers.get("X-Watcher")
+                with portal._lock:
+                    portal.counts["logins"] += 1
+                if portal._rate_limited():
+                    self._throttled(429)
+                    return
+                if not portal._acquire():
+                    self._throttled(503)
+                    return
+                try:
+                    time.sleep(portal.service * portal.scale)
+                    with portal._lock:
+                        if form.get("username") and form.get("password"):
+                            # a login the watcher timed out on and repeated is wasted work
+                            portal.counts["duplicate" if watcher in portal.authenticated else "accepted"] += 1
+                            portal.authenticated.add(watcher)
+                finally:
+                    portal._release()
+                self._reply(200, b"<html><body>login success</body></html>")
+
+        return Handler
+
+
+class _FixedDelay:
+    """The pre-backoff behaviour: always the same delay, Retry-After ignored."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def next_delay(self, retry_after: float = None) -> float:
+        return self.delay
+
+    def reset(self):
+        pass
+
+
+def run_watcher(index: int, portal_url: str, strategy: str, args, t0: float, stop: threading.Event,
+                recovered: Dict[int, float]):
+    """
+    One watcher: the CLI's ``WatchLoop`` with the real probe, discovery and
+    login code, every wait multiplied by ``args.time_scale``.
+    """
+    scale = args.time_scale
+    jitter = strategy == "jittered"
+
+    def nap(seconds: float):
+        stop.wait(seconds * scale)
+
+    session = requests.Session()
+    session.headers["X-Watcher"] = str(index)
+    probe_urls = [f"{portal_url}/probe"]
+    # not compressed: a few hundred threads in one interpreter need the slack
+    timeout = args.timeout
+    if jitter:
+        retry_backoff = core.LoginBackoff(args.interval)
+        round_backoff = core.LoginBackoff(args.watch_interval)
+    else:
+        retry_backoff = _FixedDelay(args.interval)
+        round_backoff = _FixedDelay(args.watch_interval)
+
+    def login(portal: str):
+        retry_backoff.reset()
+        retry_after = None
+        for attempt in range(1, args.retries + 1):
+            stats = {}
+            ok = core.perform_login(session, portal, f"user{index}", "secret", timeout=timeout, driver="generic",
+                                    stats=stats, verify_urls=probe_urls)
+            # the stand-in portal's Retry-After is in compressed (wall-clock) seconds
+            retry_after = stats["retry_after"] / scale if "retry_after" in stats else None
+            if ok or stop.is_set():
+                return ok, retry_after
+            if attempt < args.retries:
+                nap(retry_backoff.next_delay(retry_after))
+        return False, retry_after
+
+    def discover():
+        portal = core.find_captive_portal(session, probe_urls, timeout, dns_check=False)
+        return portal, portal is not None
+
+    watch = core.WatchLoop(
+        probe=lambda: core.check_network_status(session, timeout, urls=probe_urls),
+        discover=discover,
+        login=login, nap=nap, splay=args.splay if jitter else 0.0,
+        cadence=core.jittered if jitter else float, round_backoff=round_backoff)
+    # the network came back for everyone at once (e.g. after a switch or portal restart)
+    nap(random.uniform(0, args.sync_window))
+
+    while not stop.is_set():
+        if watch.step() in (core.WATCH_ONLINE, core.WATCH_LOGGED_IN):
+            recovered[index] = time.monotonic() - t0
+            return
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_fleet(strategy: str, args) -> dict:
+    """Run ``args.watchers`` watchers against a fresh portal; returns the fleet statistics."""
+    portal = StandInPortal(args.capacity, args.rate, args.service, args.backlog, args.retry_after,
+                           args.time_scale).start()
+    core.PORTAL_PAGE_CACHE.clear()
+    stop = threading.Event()
+    recovered: Dict[int, float] = {}
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=run_watcher, name=f"watcher-{i}", daemon=True,
+                                args=(i, portal.url, strategy, args, t0, stop, recovered))
+               for i in range(args.watchers)]
+    for t in threads:
+        t.start()
+    deadline = t0 + args.deadline * args.time_scale
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    stop.set()
+    for t in threads:
+        t.join(args.timeout + 1.0)
+    portal.stop()
+
+    times = [v / args.time_scale for v in recovered.values()]
+    return {
+        "strategy": strategy,
+        "watchers": args.watchers,
+        "recovered": len(times),
+        "p50_s": _percentile(times, 0.5),
+        "p95_s": _percentile(times, 0.95),
+        "all_s": max(times) if len(times) == args.watchers else None,
+        "peak_queued": portal.peak_queued,
+        **portal.counts,
+    }
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def print_result(r: dict):
+    print(f"[{r['strategy']}] {r['recovered']}/{r['watchers']} 台恢复  "
+          f"p50 {_fmt(r['p50_s'])}  p95 {_fmt(r['p95_s'])}  全部恢复 {_fmt(r['all_s'])}")
+    print(f"    登录请求 {r['logins']}（成功 {r['accepted']}，重复 {r['duplicate']}，429 限速 {r['rate_limited']}），"
+          f"503 繁忙 {r['busy']}，排队峰值 {r['peak_queued']}，探测 {r['probes']}，认证页 {r['pages']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="auto_campus_login.py loadtest",
+                                     description="模拟大批监控进程在认证服务器恢复后同时重新登录，统计全体恢复耗时")
+    parser.add_argument("--watchers", type=int, default=200, help="模拟的监控进程数")
+    parser.add_argument("--strategy", choices=("jittered", "naive"), default="jittered",
+                        help="jittered：随机错峰 + 抖动退避 + 遵守 Retry-After；naive：固定间隔（旧行为）")
+    parser.add_argument("--compare", action="store_true", help="依次运行两种策略并对比")
+    parser.add_argument("--capacity", type=int, default=20, help="认证服务器可同时处理的请求数")
+    parser.add_argument("--rate", type=float, default=10.0, help="认证服务器每秒可接受的登录数")
+    parser.add_argument("--service", type=float, default=0.5, help="每次登录的处理耗时（秒）")
+    parser.add_argument("--backlog", type=int, default=40, help="认证服务器排队上限，超出返回 503")
+    parser.add_argument("--retry-after", type=float, default=10.0, help="过载时返回的 Retry-After（秒）")
+    parser.add_argument("--watch-interval", type=float, default=20.0, help="监控检测间隔（秒）")
+    parser.add_argument("--interval", type=float, default=3.0, help="登录重试间隔（秒）")
+    parser.add_argument("--retries", type=int, default=3, help="每轮登录重试次数")
+    parser.add_argument("--splay", type=float, default=core.LOGIN_SPLAY, help="首次登录前的随机等待上限（秒）")
+    parser.add_argument("--timeout", type=float, default=8.0, help="HTTP 超时（秒）")
+    parser.add_argument("--sync-window", type=float, default=2.0, help="各监控进程开始检测的时间差（秒），模拟同时掉线")
+    parser.add_argument("--deadline", type=float, default=600.0, help="最长模拟时长（秒）")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="时间压缩比例，0.1 表示按 10 倍速模拟")
+    parser.add_argument("-v", action="count", default=0, help="输出监控进程日志")
+    args = parser.parse_args(argv)
+
+    # hundreds of watchers logging every throttled attempt would drown the report
+    logging.getLogger().setLevel(logging.INFO if args.v >= 2 else logging.WARNING if args.v else logging.CRITICAL)
+    strategies = ("naive", "jittered") if args.compare else (args.strategy,)
+    print(f"{args.watchers} 台监控进程，认证服务器容量 {args.capacity} 并发 / {args.rate:g} 次每秒，"
+          f"时间压缩 {args.time_scale:g}")
+    for strategy in strategies:
+        print_result(run_fleet(strategy, args))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record/replay HTTP cassettes for the login flow
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+``--record FILE`` mounts a recording transport on the requests session, so the
+whole probe -> portal discovery -> login attempt exchange (including failed
+connections and timeouts) is saved to a JSON cassette. ``--replay FILE`` serves
+that cassette back without touching the network, at full speed by default, so a
+misbehaving portal can be re-run, profiled and regression-tested offline:
+
+    python auto_campus_login.py -u USER -p PASS --record portal.json
+    python auto_campus_login.py -u USER -p PASS --replay portal.json --interval 0
+
+Passwords in URLs, form/JSON bodies and redirect headers are masked before the
+cassette is written; requests are matched on method + masked URL, in recorded
+order. Portal cookies are kept because the flow depends on them.
+"""
+import io
+import os
+import json
+import time
+import base64
+import logging
+import threading
+from http.client import parse_headers
+from typing import Callable, Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from debug_capture import redact_body, redact_headers, redact_url
+
+CASSETTE_VERSION = 1
+
+# Hop-by-hop/encoding headers: bodies are stored decoded, so these no longer apply
+_DROP_HEADERS = {"content-encoding", "transfer-encoding", "content-length", "connection"}
+_URL_HEADERS = {"location", "content-location"}
+
+
+class _OriginalResponse:
+    """Just enough of http.client.HTTPResponse for requests' cookie extraction."""
+
+    def __init__(self, headers: List[Tuple[str, str]]):
+        raw = "".join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n"
+        self.msg = parse_headers(io.BytesIO(raw.encode("latin-1", "replace")))
+
+    def isclosed(self):
+        return True
+
+
+def _encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(entry: dict) -> bytes:
+    if "base64" in entry:
+        return base64.b64decode(entry["base64"])
+    return entry.get("text", "").encode("utf-8")
+
+
+class _CassetteAdapter(HTTPAdapter):
+    def __init__(self, redact: Callable[[dict], dict] = None):
+        super().__init__()
+        self.redact = redact
+
+    def _key(self, request) -> str:
+        return f"{request.method} {redact_url(request.url, self.redact)}"
+
+    def _response(self, request, status: int, reason: str, headers: List[Tuple[str, str]],
+                  body: bytes) -> requests.Response:
+        headers = [(k, v) for k, v in headers if k.lower() not in _DROP_HEADERS]
+        headers.append(("Content-Length", str(len(body))))
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, reason=reason,
+                           preload_content=False, decode_content=False)
+        raw._original_response = _OriginalResponse(headers)
+        return self.build_response(request, raw)
+
+
+class RecordingAdapter(_CassetteAdapter):
+    """Real transport that also appends every exchange to ``interactions``."""
+
+    def __init__(self, redact: Callable[[dict], dict] = None):
+        super().__init__(redact)
+        self.interactions: List[dict] = []
+        self._lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = {
+            "key": self._key(request),
+            "request": {
+                "headers": redact_headers(request.headers, self.redact, keep_cookies=True),
+                "body": redact_body(request.body, request.headers.get("Content-Type", ""), self.redact),
+            },
+        }
+        t0 = time.perf_counter()
+        try:
+            resp = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+            # decoded body, so the replay does not depend on the original content coding
+            body = resp.raw.read(decode_content=True) or b""
+        except requests.RequestException as e:
+            entry["error"] = {"type": type(e).__name__, "message": str(e)}
+            entry["elapsed_ms"] = (time.perf_counter() - t0) * 1000.0
+            self._append(entry)
+            raise
+        headers = list(resp.raw.headers.items())
+        entry["elapsed_ms"] = (time.perf_counter() - t0) * 1000.0
+        # a list of pairs keeps repeated headers such as Set-Cookie
+        stored = [[k, redact_url(v, self.redact) if k.lower() in _URL_HEADERS else v] for k, v in headers]
+        entry["response"] = dict(status=resp.status_code, reason=resp.reason, headers=stored, **_encode_body(body))
+        self._append(entry)
+        resp.raw.release_conn()
+        return self._response(request, resp.status_code, resp.reason, headers, body)
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self.interactions.append(entry)
+
+
+class ReplayAdapter(_CassetteAdapter):
+    """Offline transport serving recorded exchanges by method + masked URL, in order."""
+
+    def __init__(self, interactions: List[dict], redact: Callable[[dict], dict] = None, realtime: bool = False):
+        super().__init__(redact)
+        self.realtime = realtime
+        self.served = 0
+        self._queues: Dict[str, List[dict]] = {}
+        self._last: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        for entry in interactions:
+            self._queues.setdefault(entry["key"], []).append(entry)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = self._key(request)
+        with self._lock:
+            pending = self._queues.get(key)
+            if pending:
+                entry = self._last[key] = pending.pop(0)
+            else:
+                # more requests than recorded: keep answering like the last time
+                entry = self._last.get(key)
+            self.served += 1
+        if entry is None:
+            raise requests.ConnectionError(f"cassette has no recording for {key}", request=request)
+        if self.realtime and entry.get("elapsed_ms"):
+            time.sleep(entry["elapsed_ms"] / 1000.0)
+        if "error" in entry:
+            exc_type = getattr(requests.exceptions, entry["error"]["type"], requests.ConnectionError)
+            if not (isinstance(exc_type, type) and issubclass(exc_type, requests.RequestException)):
+                exc_type = requests.ConnectionError
+            raise exc_type(entry["error"]["message"], request=request)
+        r = entry["response"]
+        return self._response(request, r["status"], r.get("reason") or "",
+                              [tuple(h) for h in r["headers"]], _decode_body(r))
+
+
+class Cassette:
+    """A cassette file bound to a session in ``record`` or ``replay`` mode."""
+
+    def __init__(self, path: str, mode: str, redact: Callable[[dict], dict] = None, realtime: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        if mode == "record":
+            self.adapter = RecordingAdapter(redact)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"unsupported cassette version: {data.get('version')}")
+            self.adapter = ReplayAdapter(data["interactions"], redact, realtime)
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        return session
+
+    def save(self):
+        """Write the recorded interactions (record mode only; atomic replace)."""
+        if self.mode != "record":
+            return
+        with self.adapter._lock:
+            data = {"version": CASSETTE_VERSION, "recorded_at": time.time(),
+                    "interactions": list(self.adapter.interactions)}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+        logging.info("[Cassette] 已保存 %d 条请求到 %s", len(data["interactions"]), self.path)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local control and status API for a running watcher
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+The CLI watcher (``--control``) and the GUI (``--control``) can expose a tiny
+HTTP API on localhost or a Unix socket so other scripts can read the current
+connectivity state or steer the watcher without spawning a new process:
+
+    GET  /status   current state (online, last probe latency, paused, ...)
+    POST /login    trigger a login as soon as possible
+    POST /pause    stop probing/logging in until resumed
+    POST /resume   resume probing
+
+Status reads are served from a pre-encoded in-memory snapshot and never touch
+the network.
+
+POST requests must carry ``X-Campus-Control: 1`` and no ``Origin`` header. A
+web page cannot send that (the custom header needs a CORS preflight we never
+answer, and browsers always add Origin), so a visited site cannot log us in
+or pause the watcher through the user's browser:
+
+    curl -X POST -H "X-Campus-Control: 1" http://127.0.0.1:8765/login
+"""
+import os
+import json
+import stat
+import time
+import socket
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+DEFAULT_CONTROL_ADDRESS = "127.0.0.1:8765"
+CONTROL_HEADER = "X-Campus-Control"
+
+
+class ControlState:
+    """Watcher state shared with the control server; all methods are thread-safe."""
+
+    def __init__(self, source: str = "cli"):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._status = {
+            "pid": os.getpid(),
+            "source": source,
+            "online": None,
+            "latency_ms": None,
+            "last_probe_ts": None,
+            "paused": False,
+            "role": "leader",
+            "last_login": None,
+        }
+        self._body = b""
+        self._login_requested = False
+        # If set, POST /login calls this directly instead of queueing for the watch loop
+        self.login_handler: Optional[Callable[[], None]] = None
+        self._encode()
+
+    def _encode(self):
+        self._body = json.dumps(self._status, ensure_ascii=False).encode("utf-8")
+
+    def update(self, **fields):
+        with self._lock:
+            self._status.update(fields)
+            self._encode()
+
+    def record_probe(self, online: bool, latency_ms: float = None):
+        self.update(online=online, latency_ms=latency_ms, last_probe_ts=time.time())
+
+    def status_body(self) -> bytes:
+        # bytes are immutable, so readers can use the snapshot without the lock
+        return self._body
+
+    @property
+    def paused(self) -> bool:
+        return self._status["paused"]
+
+    def set_paused(self, paused: bool):
+        self.update(paused=paused)
+        self._wake.set()
+
+    def request_login(self) -> bool:
+        """
+        False if refused: only the elected leader logs in, and a follower's queue
+        would only run after a takeover, long stale. ``login_handler`` must not
+        block (it runs on the server thread).
+        """
+        with self._lock:
+            if self._status["role"] == "follower":
+                return False
+            handler = self.login_handler
+            if not handler:
+                self._login_requested = True
+        if handler:
+            handler()
+            return True
+        self._wake.set()
+        return True
+
+    def take_login_request(self) -> bool:
+        with self._lock:
+            requested, self._login_requested = self._login_requested, False
+        return requested
+
+    def sleep(self, seconds: float):
+        """Interruptible sleep: returns early on pause/resume/login requests."""
+        if self._wake.wait(max(0.0, seconds)):
+            self._wake.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "CampusLogin"
+    # headers and body leave in one write, flushed once per request
+    wbufsize = -1
+
+    def _send(self, code: int, body: bytes):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path in ("/status", "/"):
+            self._send(200, self.server.state.status_body())
+        else:
+            self._send(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.headers.get("Origin") is not None or self.headers.get(CONTROL_HEADER) != "1":
+            logging.warning("[Control] 拒绝未带 %s 头或来自浏览器页面的请求: %s", CONTROL_HEADER, self.path)
+            self._send(403, b'{"error": "forbidden"}')
+            return
+        state = self.server.state
+        if self.path == "/login":
+            if state.request_login():
+                self._send(202, b'{"queued": true}')
+            else:
+                self._send(409, b'{"error": "follower", "queued": false}')
+        elif self.path == "/pause":
+            state.set_paused(True)
+            self._send(200, b'{"paused": true}')
+        elif self.path == "/resume":
+            state.set_paused(False)
+            self._send(200, b'{"paused": false}')
+        else:
+            self._send(404, b'{"error": "not found"}')
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) tuple
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, fmt, *args):
+        logging.debug("[Control] " + fmt, *args)
+
+
+class _TCPHandler(_Handler):
+    # TCP_NODELAY is only valid on TCP sockets
+    disable_nagle_algorithm = True
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _TCP6Server(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+if hasattr(socket, "AF_UNIX"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+def _remove_stale_socket(path: str):
+    """Unlink a leftover socket from a dead watcher; refuse to touch anything else."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError(f"{path} 已存在且不是 socket，拒绝覆盖")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)  # nobody listening
+            return
+    raise ValueError(f"{path} 上已有控制接口在运行")
+
+
+def start_control_server(state: ControlState, address: str = DEFAULT_CONTROL_ADDRESS):
+    """
+    Serve ``state`` on ``host:port`` (loopback recommended, IPv6 as
+    ``[::1]:port``) or ``unix:/path`` from a daemon thread; returns the server (call ``shutdown()`` to stop).
+    """
+    if address.startswith("unix:"):
+        if _UnixServer is None:
+            raise ValueError("当前系统不支持 Unix socket，请使用 host:port")
+        path = address[len("unix:"):]
+        _remove_stale_socket(path)
+        server = _UnixServer(path, _Handler)
+    else:
+        host, _, port = address.rpartition(":")
+        host = host.strip("[]") or "127.0.0.1"  # [::1]:8765
+        if host not in ("127.0.0.1", "localhost", "::1"):
+            logging.warning("[Control] 控制接口监听在非本机地址 %s，任何可访问该地址的人都能控制本程序", host)
+        server_cls = _TCP6Server if ":" in host else _TCPServer
+        server = server_cls((host, int(port)), _TCPHandler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="control-server", daemon=True).start()
+    logging.info("[Control] 本地控制接口已启动: %s", address)
+    return server
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Campus Network Login History
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+Append-only SQLite (WAL) history of connectivity probes, outages and login
+runs, shared by the CLI watcher and the GUI monitor. Writes are queued and
+committed in batches by a background thread so recording never blocks a probe.
+
+Usage:
+    python auto_campus_login.py history [--db PATH] [--window 1h 1d 7d]
+"""
+import os
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from campus_config import app_dir
+
+HISTORY_FILE = "login_history.db"
+
+# Probe latencies are aggregated in buckets of this width (ms), which lets
+# percentiles over millions of rows be answered with a single GROUP BY scan.
+LATENCY_BUCKET_MS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    ts REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    latency_ms REAL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_probes_ts ON probes (ts, ok, latency_ms);
+
+CREATE TABLE IF NOT EXISTS outages (
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    duration_s REAL NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outages_end ON outages (end_ts, duration_s);
+
+CREATE TABLE IF NOT EXISTS logins (
+    ts REAL NOT NULL,
+    success INTEGER NOT NULL,
+    mode TEXT,
+    portal TEXT,
+    attempts INTEGER,
+    total_ms REAL,
+    discover_ms REAL,
+    driver_ms REAL,
+    page_ms REAL,
+    parse_ms REAL,
+    submit_ms REAL,
+    verify_ms REAL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_logins_ts ON logins (ts);
+"""
+
+_PHASES = ("discover", "driver", "page", "parse", "submit", "verify")
+
+
+def default_history_path() -> str:
+    """History lives next to the program, like login_config.json."""
+    return os.path.join(app_dir(), HISTORY_FILE)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class HistoryStore:
+    """
+    Batched, append-only history writer.
+
+    All ``record_*`` methods only enqueue a row; a daemon thread owns the SQLite
+    connection and commits whatever accumulated every ``flush_interval`` seconds
+    (or every ``batch_size`` rows) in a single transaction.
+    """
+
+    def __init__(self, path: str = None, source: str = "cli",
+                 flush_interval: float = 2.0, batch_size: int = 500):
+        self.path = path or default_history_path()
+        self.source = source
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue" = queue.Queue(maxsize=100000)
+        self._outage_start: Optional[float] = None
+        self._closed = False
+        # create the schema up front so errors surface in the caller's thread
+        connect(self.path).close()
+        self._thread = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _put(self, sql: str, row: tuple):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait((sql, row))
+        except queue.Full:
+            logging.debug("[History] 写入队列已满，丢弃一条记录")
+
+    def record_probe(self, ok: bool, latency_ms: float = None, ts: float = None):
+        ts = time.time() if ts is None else ts
+        self._put("INSERT INTO probes VALUES (?, ?, ?, ?)", (ts, int(bool(ok)), latency_ms, self.source))
+        # outages are derived from probe transitions
+        if not ok and self._outage_start is None:
+            self._outage_start = ts
+        elif ok and self._outage_start is not None:
+            self._put("INSERT INTO outages VALUES (?, ?, ?, ?)",
+                      (self._outage_start, ts, ts - self._outage_start, self.source))
+            self._outage_start = None
+
+    def record_login(self, success: bool, stats: dict = None, portal: str = None, ts: float = None):
+        stats = stats or {}
+        phases = stats.get("phases", {})
+        ts = time.time() if ts is None else ts
+        row = (ts, int(bool(success)), stats.get("mode"), portal, stats.get("attempts"),
+               sum(phases.values()) if phases else None) + tuple(phases.get(p) for p in _PHASES) + (self.source,)
+        self._put("INSERT INTO logins VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _writer(self):
+        conn = connect(self.path)
+        pending: Dict[str, List[tuple]] = {}
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                if item[0] is None:  # close sentinel
+                    self._commit(conn, pending)
+                    conn.close()
+                    return
+                pending.setdefault(item[0], []).append(item[1])
+                count += 1
+            if count >= self.batch_size or time.monotonic() >= deadline:
+                self._commit(conn, pending)
+                pending = {}
+                count = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, pending: Dict[str, List[tuple]]):
+        if not pending:
+            return
+        try:
+            with conn:
+                for sql, rows in pending.items():
+                    conn.executemany(sql, rows)
+        except sqlite3.Error as e:
+            logging.warning("[History] 写入历史记录失败: %s", e)
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+
+
+def _histogram_percentiles(buckets: Sequence[tuple], total: int, quantiles: Sequence[float]) -> Dict[float, float]:
+    out = {}
+    if not total:
+        return out
+    targets = sorted(quantiles)
+    cum = 0
+    i = 0
+    for bucket, n in buckets:
+        cum += n
+        while i < len(targets) and cum >= targets[i] * total:
+            out[targets[i]] = (bucket + 1) * LATENCY_BUCKET_MS
+            i += 1
+    return out
+
+
+def _exact_percentile(conn: sqlite3.Connection, since: float, total: int, q: float,
+                      source: str = None) -> Optional[float]:
+    if not total:
+        return None
+    offset = min(total - 1, int(q * total))
+    where, params = _source_filter(source)
+    row = conn.execute(
+        "SELECT duration_s FROM outages WHERE end_ts >= ?" + where + " ORDER BY duration_s LIMIT 1 OFFSET ?",
+        (since,) + params + (offset,)).fetchone()
+    return row[0] if row else None
+
+
+def _source_filter(source: Optional[str]):
+    """Extra WHERE clause and parameters restricting a query to one writer (cli / gui)."""
+    return (" AND source = ?", (source,)) if source else ("", ())
+
+
+def _ongoing_outage_start(conn: sqlite3.Connection, since: float, source: str = None) -> Optional[float]:
+    """First failed probe in the window after the last successful one: an outage that has no row yet."""
+    where, params = _source_filter(source)
+    row = conn.execute(
+        "SELECT MIN(ts) FROM probes WHERE ok = 0 AND ts >= ?" + where + " AND ts > "
+        "COALESCE((SELECT MAX(ts) FROM probes WHERE ok = 1 AND ts >= ?" + where + "), 0)",
+        (since,) + params + (since,) + params).fetchone()
+    return row[0] if row else None
+
+
+def summarize(conn: sqlite3.Connection, window_s: float, now: float = None, source: str = None) -> dict:
+    """
+    Uptime, time-to-recover and probe latency percentiles over the last
+    ``window_s`` seconds, optionally for one ``source`` only. Uptime is
+    relative to the part of the window that has probes (a 7d window over two
+    days of history is judged on two days) and counts an outage still in
+    progress up to the latest probe.
+    """
+    now = time.time() if now is None else now
+    since = now - window_s
+    where, params = _source_filter(source)
+    probes, probes_ok, first_ts, last_ts = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(ok), 0), MIN(ts), MAX(ts) FROM probes WHERE ts >= ?" + where,
+        (since,) + params).fetchone()
+    buckets = conn.execute(
+        "SELECT CAST(latency_ms / ? AS INTEGER) AS b, COUNT(*) FROM probes "
+        "WHERE ts >= ? AND ok = 1 AND latency_ms IS NOT NULL" + where + " GROUP BY b ORDER BY b",
+        (LATENCY_BUCKET_MS, since) + params).fetchall()
+    latency = _histogram_percentiles(buckets, sum(n for _, n in buckets), (0.5, 0.95, 0.99))
+
+    outages, down_s = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(MIN(end_ts, ?) - MAX(start_ts, ?)), 0) FROM outages WHERE end_ts >= ?" + where,
+        (now, since, since) + params).fetchone()
+    ttr = {q: _exact_percentile(conn, since, outages, q, source) for q in (0.5, 0.95)}
+    ongoing_s = None
+    if probes:
+        ongoing_start = _ongoing_outage_start(conn, since, source)
+        if ongoing_start is not None:
+            ongoing_s = last_ts - ongoing_start
+    covered_s = last_ts - first_ts if probes else 0.0
+    if covered_s > 0:
+        uptime = max(0.0, 1.0 - (down_s + (ongoing_s or 0.0)) / covered_s)
+    else:
+        uptime = (probes_ok / probes) if probes else None
+
+    logins = conn.execute(
+        "SELECT mode, COUNT(*), SUM(success), AVG(total_ms) FROM logins WHERE ts >= ?" + where + " GROUP BY mode "
+        "ORDER BY COUNT(*) DESC", (since,) + params).fetchall()
+    return {
+        "window_s": window_s,
+        "probes": probes,
+        "probe_success": (probes_ok / probes) if probes else None,
+        "uptime": uptime,
+        "outages": outages,
+        "ongoing_outage_s": ongoing_s,
+        "ttr_p50_s": ttr[0.5],
+        "ttr_p95_s": ttr[0.95],
+        "latency_p50_ms": latency.get(0.5),
+        "latency_p95_ms": latency.get(0.95),
+        "latency_p99_ms": latency.get(0.99),
+        "logins": [{"mode": m, "runs": n, "success": s or 0, "avg_ms": avg} for m, n, s, avg in logins],
+    }
+
+
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_window(text: str) -> float:
+    """``90``, ``30m``, ``1h``, ``7d`` ... as seconds; an argparse ``type``."""
+    value = text.strip().lower()
+    scale = 1
+    if value and value[-1] in _WINDOW_UNITS:
+        value, scale = value[:-1], _WINDOW_UNITS[value[-1]]
+    try:
+        seconds = float(value) * scale
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0 or seconds == float("inf"):
+        raise argparse.ArgumentTypeError(f"无效的时间窗口: {text!r}（示例: 30m 1h 1d 7d）")
+    return seconds
+
+
+def _window_label(seconds: float) -> str:
+    for unit, scale in sorted(_WINDOW_UNITS.items(), key=lambda kv: -kv[1]):
+        if seconds % scale == 0:
+            return f"{seconds / scale:g}{unit}"
+    return f"{seconds:g}s"
+
+
+def _fmt(value, unit="", digits=1):
+    if value is None:
+        return "-"
+    return f"{value:.{digits}f}{unit}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="auto_campus_login.py history", description="查看探测/断网/登录历史统计")
+    parser.add_argument("--db", default=None, help=f"历史数据库路径，默认程序目录下 {HISTORY_FILE}")
+    parser.add_argument("--window", nargs="*", type=parse_window, default=[parse_window(w) for w in ("1h", "1d", "7d")],
+                        help="统计时间窗口，如 1h 1d 7d")
+    parser.add_argument("--source", choices=("cli", "gui"), default=None, help="只统计命令行或图形界面写入的记录")
+    args = parser.parse_args(argv)
+
+    path = args.db or default_history_path()
+    if not os.path.exists(path):
+        print(f"历史数据库不存在: {path}")
+        return 1
+    conn = connect(path)
+    try:
+        for w in args.window:
+            r = summarize(conn, w, source=args.source)
+            print(f"== 最近 {_window_label(w)} ==")
+            print(f"  探测 {r['probes']} 次，成功率 {_fmt(r['probe_success'] and r['probe_success'] * 100, '%')}，"
+                  f"可用率 {_fmt(r['uptime'] and r['uptime'] * 100, '%', 3)}")
+            print(f"  断网 {r['outages']} 次，恢复耗时 p50 {_fmt(r['ttr_p50_s'], 's')} / p95 {_fmt(r['ttr_p95_s'], 's')}"
+                  + (f"，当前已断网 {_fmt(r['ongoing_outage_s'], 's')}" if r['ongoing_outage_s'] is not None else ""))
+            print(f"  探测延迟 p50 {_fmt(r['latency_p50_ms'], 'ms', 0)} / p95 {_fmt(r['latency_p95_ms'], 'ms', 0)}"
+                  f" / p99 {_fmt(r['latency_p99_ms'], 'ms', 0)}")
+            for item in r["logins"]:
+                print(f"  登录方式 {item['mode'] or '(失败)'}: {item['runs']} 次，成功 {item['success']} 次，"
+                      f"平均 {_fmt(item['avg_ms'], 'ms', 0)}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-phase CPU and allocation profiling for bug reports
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+``--profile [FILE]`` wraps the probe, discovery and login phases in cProfile;
+``--trace-alloc`` additionally traces allocations with tracemalloc. The report
+is a short plain-text file the user can attach to an issue:
+
+    == login: 2 runs, 5321.4 ms wall (avg 2660.7 ms), peak +812.3 KiB
+        ncalls  tott(ms)  cumt(ms)  function
+    ...
+
+Only one section is profiled at a time (cProfile cannot run two profilers at
+once on Python 3.12+, and tracemalloc peaks are process-wide); a section that
+starts while another is active, e.g. a probe inside the login, is counted in
+the outer one. When profiling is off the callers use a shared no-op context
+manager, so the hooks cost nothing.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import logging
+import platform
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from campus_config import app_dir
+
+REPORT_FILE = "campus_profile.txt"
+
+# Rows per phase in the report
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 10
+
+
+def default_report_path() -> str:
+    """The report lives next to the program, like login_config.json."""
+    return os.path.join(app_dir(), REPORT_FILE)
+
+
+class _Phase:
+    def __init__(self):
+        self.runs = 0
+        self.nested = 0
+        self.wall_ms = 0.0
+        self.profile = None
+        self.peak = 0
+        self.alloc: Dict[str, List[int]] = {}  # "file:line" -> [bytes, blocks]
+
+
+class PhaseProfiler:
+    """Accumulates cProfile stats and tracemalloc peaks per named phase."""
+
+    def __init__(self, path: str = None, cpu: bool = True, alloc: bool = False, frames: int = 1):
+        self.path = path or default_report_path()
+        self.cpu = cpu
+        self.alloc = alloc
+        self.started = time.time()
+        self._phases: Dict[str, _Phase] = {}
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        if alloc and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def _phase(self, name: str) -> _Phase:
+        with self._lock:
+            phase = self._phases.get(name)
+            if phase is None:
+                phase = self._phases[name] = _Phase()
+            return phase
+
+    @contextmanager
+    def section(self, name: str):
+        phase = self._phase(name)
+        if not self._active.acquire(blocking=False):
+            # already inside another section (or another thread's); counted there
+            with self._lock:
+                phase.nested += 1
+            yield
+            return
+        try:
+            before = None
+            if self.alloc:
+                before = tracemalloc.take_snapshot()
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            prof = None
+            if self.cpu:
+                prof = phase.profile = phase.profile or cProfile.Profile()
+                try:
+                    prof.enable()
+                except ValueError as e:
+                    # another profiler (e.g. a debugger) owns the hook
+                    logging.debug("[Profile] 无法启用 cProfile: %s", e)
+                    prof = None
+            t0 = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = (time.perf_counter() - t0) * 1000.0
+                if prof:
+                    prof.disable()
+                with self._lock:
+                    phase.runs += 1
+                    phase.wall_ms += elapsed
+                if before is not None:
+                    phase.peak = max(phase.peak, tracemalloc.get_traced_memory()[1] - base)
+                    self._record_alloc(phase, before)
+        finally:
+            self._active.release()
+
+    def _record_alloc(self, phase: _Phase, before):
+        after = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        with self._lock:
+            for stat in after.compare_to(before, "lineno"):
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                # package/module.py is enough to locate the line and keeps user paths out
+                where = os.path.join(os.path.basename(os.path.dirname(frame.filename)),
+                                     os.path.basename(frame.filename))
+                slot = phase.alloc.setdefault(f"{where}:{frame.lineno}", [0, 0])
+                slot[0] += stat.size_diff
+                slot[1] += stat.count_diff
+
+    def _format_cpu(self, prof) -> List[str]:
+        out = io.StringIO()
+        stats = pstats.Stats(prof, stream=out)
+        stats.sort_stats("cumulative")
+        rows = []
+        for func in stats.fcn_list[:TOP_FUNCTIONS]:
+            cc, nc, tt, ct, _ = stats.stats[func]
+            filename, line, fn = func
+            where = f"{os.path.basename(filename)}:{line}({fn})" if line else fn
+            rows.append(f"  {nc:>8} {tt * 1000:>9.1f} {ct * 1000:>9.1f}  {where}")
+        return rows
+
+    def report(self) -> str:
+        lines = [f"campus login profile, {datetime.now():%Y-%m-%d %H:%M:%S}",
+                 f"python {platform.python_version()} on {platform.platform()}",
+                 f"uptime {time.time() - self.started:.0f}s, cpu={self.cpu}, alloc={self.alloc}", ""]
+        with self._lock:
+            phases = sorted(self._phases.items())
+        for name, phase in phases:
+            head = f"== {name}: {phase.runs} runs, {phase.wall_ms:.1f} ms wall"
+            if phase.runs:
+                head += f" (avg {phase.wall_ms / phase.runs:.1f} ms)"
+            if self.alloc:
+                head += f", peak +{phase.peak / 1024:.1f} KiB"
+            if phase.nested:
+                head += f", {phase.nested} nested runs counted in other phases"
+            lines.append(head)
+            if phase.profile is not None:
+                lines.append("    ncalls  tott(ms)  cumt(ms)  function")
+                lines.extend(self._format_cpu(phase.profile))
+            if phase.alloc:
+                lines.append("  allocated (net, all runs):")
+                top = sorted(phase.alloc.items(), key=lambda kv: kv[1][0], reverse=True)[:TOP_ALLOCATIONS]
+                for where, (size, count) in top:
+                    lines.append(f"  {size / 1024:>9.1f} KiB {count:>7} blocks  {where}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def write_report(self) -> str:
+        """Write the report to ``self.path`` (atomic replace) and return the path."""
+        text = self.report()
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+        return self.path
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline analysis of saved portal login pages
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+Runs the same heuristics ``perform_login`` uses (``pick_login_form``,
+``extract_form_data``, ``guess_field_name`` and the driver fingerprints) over a
+directory, tar or zip of captured pages on all CPU cores, and reports what was
+chosen for every page together with aggregate statistics. Per-page results can
+be saved as JSON lines and compared against a previous run to see exactly which
+pages a heuristic change fixed or broke.
+
+Usage:
+    python auto_campus_login.py analyze PAGES [--workers N] [--json OUT] [--baseline OLD]
+"""
+import os
+import re
+import sys
+import json
+import time
+import tarfile
+import zipfile
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+PAGE_SUFFIXES = (".html", ".htm", ".xhtml", ".jsp", ".asp", ".aspx", ".php", ".txt")
+
+# Pages are shipped to worker processes in batches to amortise IPC overhead
+BATCH_SIZE = 32
+
+# Pages below this confidence are listed individually in the summary
+LOW_CONFIDENCE = 0.5
+
+
+def _is_page(name: str) -> bool:
+    return name.lower().endswith(PAGE_SUFFIXES)
+
+
+def iter_corpus(path: str) -> Iterator[Tuple[str, object]]:
+    """
+    Yield ``(name, source)`` for every page under ``path``. For directories the
+    source is the file path (workers read it themselves); for tar/zip archives
+    it is the page bytes.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fn in sorted(files):
+                if _is_page(fn):
+                    full = os.path.join(root, fn)
+                    yield os.path.relpath(full, path), full
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _is_page(info.filename):
+                    yield info.filename, zf.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as tf:
+            for member in tf:
+                if member.isfile() and _is_page(member.name):
+                    yield member.name, tf.extractfile(member).read()
+    else:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+
+
+def _field_confidence(keys: Sequence[str], chosen: Optional[str]) -> float:
+    """1.0 for a whole-token match (first pass of guess_field_name), 0.5 for a substring match."""
+    if not chosen:
+        return 0.0
+    low = chosen.lower()
+    for key in keys:
+        if re.search(r"(^|[_.-])" + re.escape(key.lower()) + r"($|[_.-])", low):
+            return 1.0
+    return 0.5
+
+
+def analyze_page(name: str, source) -> dict:
+    """Run the login-form heuristics on one page and time them."""
+    from bs4 import BeautifulSoup
+    import auto_campus_login as core
+
+    result = {"page": name, "forms": 0, "action": None, "method": None, "fields": [],
+              "user_field": None, "pass_field": None, "driver": None,
+              "confidence": 0.0, "parse_ms": None, "error": None}
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        t0 = time.perf_counter()
+        soup = BeautifulSoup(source, "html.parser")
+        forms = soup.find_all("form")
+        form = core.pick_login_form(soup)
+        if form:
+            action, method, data = core.extract_form_data(form)
+            names = list(data.keys())
+            user_field = core.guess_field_name(core.COMMON_USER_FIELDS, names)
+            pass_field = core.guess_field_name(core.COMMON_PASS_FIELDS, names)
+            password_inputs = [i.get("name") for i in form.find_all("input", type="password")]
+        result["parse_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        # perform_login fingerprints the raw head of the page the same way
+        drv = core.detect_portal_driver("", source[:core.FINGERPRINT_BYTES].decode("utf-8", "replace"))
+        result["driver"] = drv.name if drv else None
+        result["forms"] = len(forms)
+        if not form:
+            return result
+
+        confidence = (_field_confidence(core.COMMON_USER_FIELDS, user_field) +
+                      _field_confidence(core.COMMON_PASS_FIELDS, pass_field)) / 2
+        # a guessed password field that is not the page's <input type=password> is suspicious
+        if pass_field and password_inputs and pass_field not in password_inputs:
+            confidence *= 0.5
+        # several forms means pick_login_form's choice may be wrong
+        if len(forms) > 1:
+            confidence *= 0.8
+        result.update(action=action, method=method, fields=names, user_field=user_field,
+                      pass_field=pass_field, confidence=round(confidence, 3))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _analyze_batch(batch: List[Tuple[str, object]]) -> List[dict]:
+    return [analyze_page(name, source) for name, source in batch]
+
+
+def _batches(items: Iterator[Tuple[str, object]], size: int) -> Iterator[List[Tuple[str, object]]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def analyze_corpus(path: str, workers: int = None) -> List[dict]:
+    """Analyze every page under ``path`` on ``workers`` processes (default: all cores)."""
+    workers = workers or os.cpu_count() or 1
+    batches = _batches(iter_corpus(path), BATCH_SIZE)
+    if workers == 1:
+        return [r for batch in batches for r in _analyze_batch(batch)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [r for chunk in pool.map(_analyze_batch, batches) for r in chunk]
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(results: List[dict]) -> dict:
+    ok = [r for r in results if not r["error"]]
+    with_form = [r for r in ok if r["action"] is not None]
+    both = [r for r in with_form if r["user_field"] and r["pass_field"]]
+    times = [r["parse_ms"] for r in ok if r["parse_ms"] is not None]
+    conf = [r["confidence"] for r in with_form]
+    return {
+        "pages": len(results),
+        "errors": len(results) - len(ok),
+        "with_form": len(with_form),
+        "fields_found": len(both),
+        "high_confidence": sum(1 for c in conf if c >= 0.9),
+        "low_confidence": sum(1 for c in conf if c < LOW_CONFIDENCE),
+        "mean_confidence": (sum(conf) / len(conf)) if conf else None,
+        "parse_p50_ms": _percentile(times, 0.5),
+        "parse_p95_ms": _percentile(times, 0.95),
+        "parse_max_ms": max(times) if times else None,
+        "drivers": Counter(r["driver"] for r in ok if r["driver"]).most_common(),
+        "user_fields": Counter(r["user_field"] for r in both).most_common(5),
+        "pass_fields": Counter(r["pass_field"] for r in both).most_common(5),
+    }
+
+
+_COMPARED = ("action", "user_field", "pass_field", "driver")
+
+
+def compare(results: List[dict], baseline: Dict[str, dict]) -> Dict[str, List[str]]:
+    """Pages whose chosen form/fields/driver differ from a previous ``--json`` run."""
+    diff = {"fixed": [], "broken": [], "changed": [], "new": []}
+    for r in results:
+        old = baseline.get(r["page"])
+        if old is None:
+            diff["new"].append(r["page"])
+            continue
+        if all(r.get(k) == old.get(k) for k in _COMPARED):
+            continue
+        was_ok = bool(old.get("user_field") and old.get("pass_field"))
+        now_ok = bool(r["user_field"] and r["pass_field"])
+        key = "fixed" if now_ok and not was_ok else "broken" if was_ok and not now_ok else "changed"
+        diff[key].append(r["page"])
+    return diff
+
+
+def _load_jsonl(path: str) -> Dict[str, dict]:
+    out = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                out[r["page"]] = r
+    return out
+
+
+def _fmt(value, unit="", digits=1):
+    if value is None:
+        return "-"
+    return f"{value:.{digits}f}{unit}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="auto_campus_login.py analyze",
+                                     description="离线批量分析保存的认证页面，评估表单/字段识别效果")
+    parser.add_argument("path", help="页面目录，或 .tar/.tar.gz/.zip 压缩包")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认使用全部CPU核心")
+    parser.add_argument("--json", dest="json_out", default=None, metavar="OUT",
+                        help="逐页结果写入 JSON Lines 文件（- 表示标准输出）")
+    parser.add_argument("--baseline", default=None, metavar="OLD",
+                        help="与之前 --json 的结果对比，列出识别结果发生变化的页面")
+    parser.add_argument("--show-low", type=int, default=20, metavar="N",
+                        help=f"列出置信度低于 {LOW_CONFIDENCE} 的前 N 个页面")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"路径不存在: {args.path}")
+        return 1
+    t0 = time.perf_counter()
+    results = analyze_corpus(args.path, args.workers)
+    elapsed = time.perf_counter() - t0
+
+    if args.json_out:
+        out = sys.stdout if args.json_out == "-" else open(args.json_out, "w", encoding="utf-8")
+        try:
+            for r in results:
+                out.write(json.dumps(r, ensure_ascii=False) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if args.json_out == "-":
+            return 0
+
+    s = summarize(results)
+    n = s["pages"] or 1
+    print(f"共 {s['pages']} 个页面，耗时 {elapsed:.2f}s（{s['pages'] / elapsed if elapsed else 0:.0f} 页/秒）")
+    print(f"  找到表单 {s['with_form']} ({s['with_form'] * 100 / n:.1f}%)，"
+          f"识别出账号+密码字段 {s['fields_found']} ({s['fields_found'] * 100 / n:.1f}%)，解析失败 {s['errors']}")
+    print(f"  置信度 平均 {_fmt(s['mean_confidence'], '', 2)}，高(>=0.9) {s['high_confidence']}，"
+          f"低(<{LOW_CONFIDENCE}) {s['low_confidence']}")
+    print(f"  解析耗时 p50 {_fmt(s['parse_p50_ms'], 'ms')} / p95 {_fmt(s['parse_p95_ms'], 'ms')}"
+          f" / max {_fmt(s['parse_max_ms'], 'ms')}")
+    if s["drivers"]:
+        print("  识别到的专用驱动: " + ", ".join(f"{d} {c}" for d, c in s["drivers"]))
+    if s["user_fields"]:
+        print("  常见账号字段: " + ", ".join(f"{f} {c}" for f, c in s["user_fields"]))
+        print("  常见密码字段: " + ", ".join(f"{f} {c}" for f, c in s["pass_fields"]))
+
+    low = [r for r in results if r["error"] or r["confidence"] < LOW_CONFIDENCE]
+    if low and args.show_low:
+        print(f"  低置信度/失败页面（前 {args.show_low} 个）:")
+        for r in low[:args.show_low]:
+            if r["error"]:
+                detail = r["error"]
+            elif r["action"] is None:
+                detail = f"未找到表单（驱动: {r['driver'] or '无'}）"
+            else:
+                detail = f"置信度 {r['confidence']:.2f} 账号={r['user_field']} 密码={r['pass_field']}"
+            print(f"    {r['page']}: {detail}")
+
+    if args.baseline:
+        diff = compare(results, _load_jsonl(args.baseline))
+        print(f"  与基线对比: 修复 {len(diff['fixed'])}，退化 {len(diff['broken'])}，"
+              f"变化 {len(diff['changed'])}，新增 {len(diff['new'])}")
+        for page in diff["broken"][:args.show_low]:
+            print(f"    退化: {page}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
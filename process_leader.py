@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cross-process leader election for campus login watchers
+
+Copyright (c) 2025 yushi-xh
+License: MIT
+
+Only one process (CLI ``--watch`` or GUI monitor) should probe and log in at
+a time. The leader holds an OS-level lock on a lock file (released by the OS
+when the process dies) and publishes its latest connectivity state to a JSON
+file; followers read that file instead of generating their own traffic and
+retry the lock every few seconds to take over promptly.
+
+The files are per user (XDG_RUNTIME_DIR, or the temp directory with the uid
+in the name), so another user's watcher neither blocks nor breaks ours. If the
+lock file cannot be opened at all the process runs standalone as its own
+leader rather than failing every tick.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+from typing import Optional
+
+if os.name == "nt":
+    import msvcrt
+    fcntl = None
+else:
+    import fcntl
+    msvcrt = None
+
+LOCK_NAME = "campus_login"
+
+
+def default_lock_dir() -> str:
+    """XDG_RUNTIME_DIR when set (private per user); otherwise the temp directory."""
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isdir(runtime):
+        return runtime
+    return tempfile.gettempdir()
+
+
+def _user_lock_name(name: str) -> str:
+    # a shared /tmp holds every user's files; Windows %TEMP% is already per user
+    uid = getattr(os, "getuid", None)
+    return f"{name}-{uid()}" if uid else name
+
+
+class LeaderLock:
+    """Non-blocking lock file + PID, with an atomically replaced shared state file."""
+
+    def __init__(self, name: str = LOCK_NAME, directory: str = None):
+        if directory is None:
+            directory = default_lock_dir()
+            name = _user_lock_name(name)
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self.state_path = os.path.join(directory, f"{name}_state.json")
+        self._fh = None
+        self.standalone = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fh is not None or self.standalone
+
+    def try_acquire(self) -> bool:
+        """Become the leader if nobody holds the lock; cheap to call every tick."""
+        if self._fh is not None or self.standalone:
+            return True
+        # O_CREAT without O_TRUNC: never clobber the current leader's PID
+        try:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            logging.warning("[Leader] 无法打开锁文件 %s (%s)，本进程独立运行", self.lock_path, e)
+            self.standalone = True
+            return True
+        fh = os.fdopen(fd, "r+")
+        try:
+            if msvcrt:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        if not msvcrt:
+            # on Windows the locked byte range cannot be rewritten; the PID is in the state file
+            fh.seek(0)
+            fh.truncate()
+            fh.write(str(os.getpid()))
+            fh.flush()
+        self._fh = fh
+        logging.info("[Leader] 当前进程 (PID %d) 成为主探测进程", os.getpid())
+        return True
+
+    def release(self):
+        if self._fh is None:
+            return
+        try:
+            if msvcrt:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        self._fh.close()
+        self._fh = None
+
+    def publish(self, **state):
+        """Leader only: write the latest state for followers (atomic replace)."""
+        if self._fh is None:
+            return
+        state.setdefault("ts", time.time())
+        state["pid"] = os.getpid()
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            logging.debug("[Leader] 写入共享状态失败: %s", e)
+
+    def read_state(self, max_age: float = None) -> Optional[dict]:
+        """Follower: the leader's last published state, or None if missing/stale."""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if max_age is not None and time.time() - state.get("ts", 0) > max_age:
+            return None
+        return state
+
+    def __enter__(self):
+        self.try_acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()